@@ -1,8 +1,8 @@
-import lxml.etree as ET
+import boom_core
 import wx
 
 from edit_dialog import EditDialog
-from pubsub import pub
+from event_bus import CHANGE, TREE_UPDATE
 
 
 class NodeDialog(EditDialog):
@@ -19,10 +19,11 @@ class NodeDialog(EditDialog):
         tells the UI to update to display the new element
         before destroying the dialog
         """
-        element = ET.SubElement(self.xml_obj, self.value_one.GetValue())
-        element.text = self.value_two.GetValue()
-        pub.sendMessage("tree_update_{}".format(self.page_id), xml_obj=element)
-        pub.sendMessage("on_change_{}".format(self.page_id), event=None)
+        element, edit = boom_core.add_node(
+            self.xml_obj, self.value_one.GetValue(), self.value_two.GetValue()
+        )
+        self.bus.send(TREE_UPDATE, xml_obj=element)
+        self.bus.send(CHANGE, edit=edit)
         self.Close()
 
 
@@ -1,5 +1,7 @@
+import boom_core
+
 from edit_dialog import EditDialog
-from pubsub import pub
+from event_bus import CHANGE, UI_UPDATE
 
 
 class AttributeDialog(EditDialog):
@@ -19,9 +21,9 @@ class AttributeDialog(EditDialog):
         attr = self.value_one.GetValue()
         value = self.value_two.GetValue()
         if attr:
-            self.xml_obj.attrib[attr] = value
-            pub.sendMessage("ui_updater_{}".format(self.page_id), xml_obj=self.xml_obj)
-            pub.sendMessage("on_change_{}".format(self.page_id), event=None)
+            edit = boom_core.set_attribute(self.xml_obj, attr, value)
+            self.bus.send(UI_UPDATE, xml_obj=self.xml_obj)
+            self.bus.send(CHANGE, edit=edit)
         else:
             # TODO - Show a dialog telling the user that there is no attr to save
             raise NotImplementedError
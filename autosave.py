@@ -0,0 +1,149 @@
+import copy
+import perf
+import threading
+import wx
+import xml_io
+
+from pubsub import pub
+
+# How long the document has to be quiet before the draft is updated
+AUTOSAVE_DELAY_MS = 1500
+
+
+class AutoSaveScheduler:
+    """
+    Coalesces the change notifications of a page and updates the draft
+    once the document has been quiet for a while
+
+    Edits are appended to the journal of the DraftStore as they happen.
+    When the quiet window expires the journal is synced to disk and, once
+    it has grown large enough, compacted into a full snapshot that is
+    written from a worker thread
+    """
+
+    def __init__(self, xml_tree, draft_store, delay=AUTOSAVE_DELAY_MS):
+        """
+        @param xml_tree: The lxml ElementTree of the page
+        @param draft_store: The DraftStore that holds the page's draft
+        @param delay: The quiet window in milliseconds
+        """
+        self.xml_tree = xml_tree
+        self.draft_store = draft_store
+        self.delay = delay
+        self.timer = None
+        self.worker = None
+        self.pending = False
+        self.closed = False
+        # bumped when the draft is thrown away, so that a snapshot that
+        # was being written for the old draft is ignored
+        self.epoch = 0
+
+    def record(self, edit):
+        """
+        Journal an edit and schedule a draft update. Changes that are
+        not described by an edit force a full snapshot instead
+        """
+        if edit is None:
+            self.draft_store.unjournaled = True
+        else:
+            self.draft_store.record(edit)
+        self.schedule()
+
+    def schedule(self):
+        """
+        Request a draft update. Every call restarts the quiet window so
+        a burst of keystrokes results in a single update
+        """
+        if self.closed:
+            return
+
+        if self.timer is None:
+            self.timer = wx.CallLater(self.delay, self.flush)
+        else:
+            self.timer.Restart(self.delay)
+
+    @perf.timed("autosave.flush")
+    def flush(self):
+        """
+        Sync the journal, or snapshot the tree on the GUI thread and
+        hand the snapshot to a worker thread for serialization
+        """
+        if self.worker is not None:
+            # A write is still running, check again once it is done
+            self.pending = True
+            return
+
+        if not self.draft_store.needs_snapshot():
+            self.draft_store.sync()
+            path = self.draft_store.journal_path()
+            pub.sendMessage("on_change_status", save_path=path)
+            return
+
+        save_path = self.draft_store.begin_snapshot()
+        generation = self.draft_store.generation
+        with perf.span("autosave.snapshot"):
+            snapshot = copy.deepcopy(self.xml_tree)
+        self.worker = threading.Thread(
+            target=self.write_draft,
+            args=(snapshot, save_path, generation, self.epoch),
+            daemon=True,
+        )
+        self.worker.start()
+
+    @perf.timed("autosave.write_draft")
+    def write_draft(self, snapshot, save_path, generation, epoch):
+        """
+        Write the snapshot to a temporary file and atomically move it
+        into place. Runs in the worker thread
+        """
+        error = None
+        try:
+            xml_io.save(snapshot, save_path)
+        except (IOError, OSError) as e:
+            error = e
+        wx.CallAfter(self.on_draft_written, save_path, generation, epoch, error)
+
+    def on_draft_written(self, save_path, generation, epoch, error):
+        """
+        Called on the GUI thread when the worker thread has finished
+        """
+        if self.closed or epoch != self.epoch:
+            return
+
+        self.worker = None
+        if error:
+            print("Unable to autosave to {}: {}".format(save_path, error))
+            self.draft_store.unjournaled = True
+        else:
+            self.draft_store.finish_snapshot(generation)
+            pub.sendMessage("on_change_status", save_path=save_path)
+
+        if self.pending:
+            self.pending = False
+            self.schedule()
+
+    def reset(self):
+        """
+        Throw the draft away once the document was saved over the file
+        the draft is based on. Later edits are journaled against the
+        saved file
+        """
+        self.stop()
+        self.epoch += 1
+        self.draft_store.discard()
+
+    def close(self):
+        """
+        Stop any scheduled update and wait for a running one to finish
+        """
+        self.closed = True
+        self.stop()
+
+    def stop(self):
+        if self.timer is not None:
+            self.timer.Stop()
+            self.timer = None
+        self.pending = False
+        if self.worker is not None:
+            self.worker.join()
+            self.worker = None
@@ -0,0 +1,57 @@
+"""
+Compare the cost of announcing one keystroke through pubsub, the way
+pages used to, with the per page EventBus
+
+Run from the repository root: python benchmarks/bench_dispatch.py
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from event_bus import CHANGE, EventBus  # noqa: E402
+from pubsub import pub  # noqa: E402
+
+KEYSTROKES = 200000
+LISTENERS = 3
+
+
+class Listener:
+    def __init__(self):
+        self.calls = 0
+
+    def on_change(self, edit=None):
+        self.calls += 1
+
+
+def main():
+    page_id = 140234567890
+    edit = object()
+
+    listeners = [Listener() for _ in range(LISTENERS)]
+    for listener in listeners:
+        pub.subscribe(listener.on_change, "on_change_{}".format(page_id))
+
+    def send_pubsub():
+        pub.sendMessage("on_change_{}".format(page_id), edit=edit)
+
+    bus = EventBus()
+    for listener in listeners:
+        bus.subscribe(CHANGE, listener.on_change)
+
+    def send_bus():
+        bus.send(CHANGE, edit=edit)
+
+    print("{} keystrokes, {} listeners".format(KEYSTROKES, LISTENERS))
+    results = {}
+    for name, func in (("pubsub", send_pubsub), ("EventBus", send_bus)):
+        seconds = min(timeit.repeat(func, number=KEYSTROKES, repeat=5))
+        results[name] = seconds / KEYSTROKES * 1e6
+        print("  {:<10} {:6.2f} us per keystroke".format(name, results[name]))
+    print("  speedup    {:6.1f}x".format(results["pubsub"] / results["EventBus"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+"""
+Time and peak memory of the main editor operations on generated corpora
+
+Every operation runs in a fresh process, so its peak RSS is not hidden
+by an earlier, bigger one. The results are saved per commit and two
+result files can be compared:
+
+    python benchmarks/bench_suite.py --sizes 1KB 1MB 16MB
+    python benchmarks/bench_suite.py --compare results/abc123.json results/def456.json
+
+The tree and editor operations need wxPython. They create their widgets
+in a frame that is never shown and are reported as skipped without wx
+"""
+
+import argparse
+import copy
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import boom_core  # noqa: E402
+import corpus  # noqa: E402
+import xml_io  # noqa: E402
+
+from journal import DraftStore  # noqa: E402
+from xml_index import LazyDocument  # noqa: E402
+
+CORPUS_DIR = os.path.join(BENCH_DIR, "corpus")
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+
+# Keystrokes journaled by the autosave benchmark
+KEYSTROKES = 1000
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def peak_rss_mb():
+    """
+    Returns the peak resident set size of this process in MB
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes everywhere else
+    if sys.platform == "darwin":
+        return peak / 1024**2
+    return peak / 1024
+
+
+class SkipOperation(Exception):
+    pass
+
+
+def first_leaf(xml_root):
+    for element in xml_root.iter():
+        if isinstance(element.tag, str) and not len(element):
+            return element
+    return xml_root
+
+
+def gui():
+    """
+    Returns a hidden frame to put widgets in
+    """
+    try:
+        import wx
+    except ImportError:
+        raise SkipOperation("wxPython is not installed")
+    app = wx.App(False)
+    frame = wx.Frame(None)
+    # keep the app alive as long as the frame
+    frame.app = app
+    return frame
+
+
+def op_parse(path, workdir):
+    start = time.perf_counter()
+    boom_core.load(path)
+    return time.perf_counter() - start
+
+
+def op_expand(path, workdir):
+    frame = gui()
+    from boom_tree import BoomTreePanel
+
+    xml_tree = boom_core.load(path)
+    start = time.perf_counter()
+    panel = BoomTreePanel(frame, xml_tree.getroot(), 1, xml_tree=xml_tree)
+    tree = panel.tree
+    child, _ = tree.GetFirstChild(tree.GetRootItem())
+    if child.IsOk():
+        tree.fill_item(child)
+    return time.perf_counter() - start
+
+
+def op_select(path, workdir):
+    frame = gui()
+    from boom_xml_editor import XmlEditorPanel
+
+    xml_tree = boom_core.load(path)
+    xml_root = xml_tree.getroot()
+    child = xml_root[0] if len(xml_root) else xml_root
+    if isinstance(xml_tree, LazyDocument):
+        child = xml_tree.materialize(child)
+    panel = XmlEditorPanel(frame, 1)
+    start = time.perf_counter()
+    panel.update_ui(xml_root)
+    panel.update_ui(child)
+    return time.perf_counter() - start
+
+
+def op_autosave(path, workdir):
+    """
+    What NewPage.auto_save does for a burst of keystrokes: journal
+    every edit, then compact the draft into a snapshot
+    """
+    xml_tree = boom_core.load(path)
+    leaf = first_leaf(xml_tree.getroot())
+    store = DraftStore(workdir, path)
+    start = time.perf_counter()
+    for number in range(KEYSTROKES):
+        store.record(boom_core.set_text(leaf, str(number)))
+    store.sync()
+    save_path = store.begin_snapshot()
+    snapshot = copy.deepcopy(xml_tree)
+    xml_io.save(snapshot, save_path)
+    return time.perf_counter() - start
+
+
+def op_save(path, workdir):
+    xml_tree = boom_core.load(path)
+    start = time.perf_counter()
+    boom_core.save(xml_tree, os.path.join(workdir, "saved.xml"))
+    return time.perf_counter() - start
+
+
+OPERATIONS = {
+    "parse": op_parse,
+    "expand": op_expand,
+    "select": op_select,
+    "autosave": op_autosave,
+    "save": op_save,
+}
+
+
+def run_operation(op, path):
+    """
+    Run one operation. Called in a fresh worker process
+    """
+    with tempfile.TemporaryDirectory() as workdir:
+        baseline = peak_rss_mb()
+        try:
+            seconds = OPERATIONS[op](path, workdir)
+        except SkipOperation as e:
+            return {"status": "skipped: {}".format(e)}
+        except Exception as e:
+            return {"status": "error: {}".format(e)}
+        peak = peak_rss_mb()
+    result = {"status": "ok", "seconds": seconds, "peak_rss_mb": peak}
+    if peak is not None:
+        result["rss_growth_mb"] = peak - baseline
+    return result
+
+
+def current_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=BENCH_DIR,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run(shapes, sizes, ops, output):
+    commit = current_commit()
+    results = []
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(1, maxtasksperchild=1) as pool:
+        for size_name in sizes:
+            for shape in shapes:
+                path = corpus.ensure_corpus(CORPUS_DIR, shape, size_name)
+                for op in ops:
+                    result = pool.apply(run_operation, (op, path))
+                    result.update(
+                        commit=commit, shape=shape, size=size_name, operation=op
+                    )
+                    results.append(result)
+                    print(format_result(result))
+
+    if not os.path.exists(os.path.dirname(output)):
+        os.makedirs(os.path.dirname(output))
+    with open(output, "w") as fobj:
+        json.dump(results, fobj, indent=1)
+    print("Results written to {}".format(output))
+
+
+def format_result(result):
+    label = "{size:>6} {shape:<6} {operation:<9}".format(**result)
+    if result["status"] != "ok":
+        return "{} {}".format(label, result["status"])
+    peak = result.get("peak_rss_mb")
+    memory = "{:9.1f} MB peak".format(peak) if peak is not None else ""
+    return "{} {:10.4f}s {}".format(label, result["seconds"], memory)
+
+
+def compare(old_path, new_path):
+    """
+    Print the change in time and peak memory between two result files
+    """
+    with open(old_path) as fobj:
+        old = {
+            (r["size"], r["shape"], r["operation"]): r
+            for r in json.load(fobj)
+            if r["status"] == "ok"
+        }
+    with open(new_path) as fobj:
+        new = [r for r in json.load(fobj) if r["status"] == "ok"]
+
+    print(
+        "{:>6} {:<6} {:<9} {:>10} {:>10} {:>7} {:>9}".format(
+            "size", "shape", "operation", "old s", "new s", "time", "memory"
+        )
+    )
+    for result in new:
+        key = (result["size"], result["shape"], result["operation"])
+        if key not in old:
+            continue
+        before = old[key]
+        ratio = result["seconds"] / before["seconds"] if before["seconds"] else 0
+        memory = ""
+        if result.get("peak_rss_mb") and before.get("peak_rss_mb"):
+            memory = "{:+.1f}MB".format(result["peak_rss_mb"] - before["peak_rss_mb"])
+        print(
+            "{:>6} {:<6} {:<9} {:10.4f} {:10.4f} {:6.2f}x {:>9}".format(
+                key[0],
+                key[1],
+                key[2],
+                before["seconds"],
+                result["seconds"],
+                ratio,
+                memory,
+            )
+        )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--shapes", nargs="+", default=list(corpus.SHAPES))
+    parser.add_argument(
+        "--sizes",
+        nargs="+",
+        default=["1KB", "1MB", "16MB"],
+        choices=list(corpus.SIZES),
+    )
+    parser.add_argument("--ops", nargs="+", default=list(OPERATIONS))
+    parser.add_argument("--output", help="Result file (default: results/<commit>.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.compare:
+        compare(*args.compare)
+        return
+    output = args.output or os.path.join(
+        RESULTS_DIR, "{}.json".format(current_commit())
+    )
+    run(args.shapes, args.sizes, args.ops, output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Generate synthetic XML documents of a given shape and size
+
+The documents are written as a stream, so even the 1 GB ones never
+need to fit in memory. Generation is deterministic: the same shape and
+size always produce the same file
+"""
+
+import os
+import random
+
+SHAPES = ("wide", "deep", "attrs", "text")
+
+SIZES = {
+    "1KB": 1024,
+    "1MB": 1024**2,
+    "16MB": 16 * 1024**2,
+    "64MB": 64 * 1024**2,
+    "256MB": 256 * 1024**2,
+    "1GB": 1024**3,
+}
+
+WORDS = (
+    "alpha bravo charlie delta echo foxtrot golf hotel india juliet kilo "
+    "lima mike november oscar papa quebec romeo sierra tango uniform"
+).split()
+
+# Depth of the nested chains in the deep shape
+DEEP_LEVELS = 40
+
+
+def sentence(rng, count):
+    return " ".join(rng.choice(WORDS) for _ in range(count))
+
+
+def wide_record(rng, index):
+    return (
+        '  <record id="{0}">\n'
+        "    <name>{1}</name>\n"
+        "    <value>{2}</value>\n"
+        "    <enabled>true</enabled>\n"
+        "  </record>\n"
+    ).format(index, sentence(rng, 2), rng.randint(0, 100000))
+
+
+def deep_record(rng, index):
+    opening = "".join('<level n="{}">'.format(depth) for depth in range(DEEP_LEVELS))
+    closing = "</level>" * DEEP_LEVELS
+    return '  <chain id="{}">{}<leaf>{}</leaf>{}</chain>\n'.format(
+        index, opening, sentence(rng, 3), closing
+    )
+
+
+def attrs_record(rng, index):
+    attrs = " ".join(
+        'a{}="{}"'.format(number, rng.choice(WORDS)) for number in range(20)
+    )
+    return '  <item id="{}" {}/>\n'.format(index, attrs)
+
+
+def text_record(rng, index):
+    return '  <para id="{}">{}</para>\n'.format(index, sentence(rng, 120))
+
+
+RECORDS = {
+    "wide": wide_record,
+    "deep": deep_record,
+    "attrs": attrs_record,
+    "text": text_record,
+}
+
+
+def corpus_path(directory, shape, size_name):
+    return os.path.join(directory, "{}-{}.xml".format(shape, size_name))
+
+
+def generate(path, shape, size):
+    """
+    Write a document of the shape that is about size bytes long
+    """
+    rng = random.Random(size)
+    make_record = RECORDS[shape]
+    footer = "</corpus>\n"
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as fobj:
+        written = fobj.write('<?xml version="1.0" encoding="UTF-8"?>\n<corpus>\n')
+        index = 0
+        while True:
+            record = make_record(rng, index)
+            if index and written + len(record) + len(footer) > size:
+                break
+            written += fobj.write(record)
+            index += 1
+        fobj.write(footer)
+    os.replace(tmp_path, path)
+
+
+def ensure_corpus(directory, shape, size_name):
+    """
+    Returns the path of the document, generating it if needed
+    """
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    path = corpus_path(directory, shape, size_name)
+    if not os.path.exists(path):
+        generate(path, shape, SIZES[size_name])
+    return path
@@ -1,8 +1,10 @@
+import boom_core
+import perf
 import wx
 
 from attribute_dialog import AttributeDialog
+from event_bus import CHANGE, UI_UPDATE, get_bus
 from functools import partial
-from pubsub import pub
 
 
 class State:
@@ -17,32 +19,49 @@ class State:
         self.val_widget = val_widget
 
 
+class AttributeRow:
+    """
+    A pooled attribute name / value text control pair
+    """
+
+    def __init__(self, sizer, attr_name, attr_val):
+        self.sizer = sizer
+        self.attr_name = attr_name
+        self.attr_val = attr_val
+        # keep track of the attribute text control's state
+        self.state = State(None, attr_val)
+
+    def bind(self, key, value):
+        """
+        Show the attribute in the row's widgets without firing any
+        text events
+        """
+        self.state.current_key = key
+        self.state.previous_key = None
+        self.attr_name.ChangeValue(key)
+        self.attr_val.ChangeValue(value)
+
+
 class AttributeEditorPanel(wx.Panel):
     """
     A class that holds all UI elements for editing
     XML attribute elements
+
+    Like the XmlEditorPanel, rows are recycled between updates instead
+    of being destroyed and recreated
     """
 
     def __init__(self, parent, page_id):
         wx.Panel.__init__(self, parent)
         self.page_id = page_id
         self.xml_obj = None
-        self.widgets = []
+        self.rows = []
+        self.visible_rows = 0
 
-        pub.subscribe(self.update_ui, "ui_updater_{}".format(self.page_id))
+        self.bus = get_bus(page_id)
+        self.bus.subscribe(UI_UPDATE, self.update_ui)
 
         self.main_sizer = wx.BoxSizer(wx.VERTICAL)
-        self.SetSizer(self.main_sizer)
-
-    def update_ui(self, xml_obj):
-        """
-        Update the user interface to have elements for editing
-        XML attributes
-
-        Called via pubsub
-        """
-        self.clear()
-        self.xml_obj = xml_obj
 
         sizer = wx.BoxSizer(wx.HORIZONTAL)
         attr_lbl = wx.StaticText(self, label="Attribute")
@@ -50,35 +69,77 @@ class AttributeEditorPanel(wx.Panel):
         sizer.Add(attr_lbl, 0, wx.ALL, 5)
         sizer.Add((133, 0))
         sizer.Add(value_lbl, 0, wx.ALL, 5)
-        self.widgets.extend([attr_lbl, value_lbl])
-
         self.main_sizer.Add(sizer)
+        self.main_sizer.Show(sizer, False)
+        self.label_sizer = sizer
+
+        self.add_attr_btn = wx.Button(self, label="Add Attribute")
+        self.add_attr_btn.Bind(wx.EVT_BUTTON, self.on_add_attr)
+        self.main_sizer.Add(self.add_attr_btn, 0, wx.ALL | wx.CENTER, 5)
+        self.add_attr_btn.Hide()
 
-        for key in xml_obj.attrib:
-            _ = wx.BoxSizer(wx.HORIZONTAL)
-            attr_name = wx.TextCtrl(self, value=key)
-            _.Add(attr_name, 1, wx.ALL | wx.EXPAND, 5)
-            self.widgets.append(attr_name)
+        self.SetSizer(self.main_sizer)
 
-            val = str(xml_obj.attrib[key])
-            attr_val = wx.TextCtrl(self, value=val)
-            _.Add(attr_val, 1, wx.ALL | wx.EXPAND, 5)
+    @perf.timed("attributes.update_ui")
+    def update_ui(self, xml_obj):
+        """
+        Update the user interface to have elements for editing
+        XML attributes
+
+        Called via pubsub
+        """
+        if not isinstance(xml_obj.tag, str):
+            # comments and processing instructions have no attributes
+            self.xml_obj = None
+            self.clear()
+            return
+
+        self.Freeze()
+        try:
+            self.xml_obj = xml_obj
+            self.main_sizer.Show(self.label_sizer, True)
+
+            attributes = list(xml_obj.attrib.items())
+            for index, (key, value) in enumerate(attributes):
+                self.get_row(index).bind(key, str(value))
+            self.show_rows(len(attributes))
+
+            self.add_attr_btn.Show()
+            self.Layout()
+        finally:
+            self.Thaw()
+
+    def get_row(self, index):
+        """
+        Returns the pooled row at the index, creating it if needed
+        """
+        if index < len(self.rows):
+            return self.rows[index]
 
-            # keep track of the attribute text control's state
-            attr_state = State(key, attr_val)
+        sizer = wx.BoxSizer(wx.HORIZONTAL)
+        attr_name = wx.TextCtrl(self)
+        sizer.Add(attr_name, 1, wx.ALL | wx.EXPAND, 5)
+        attr_val = wx.TextCtrl(self)
+        sizer.Add(attr_val, 1, wx.ALL | wx.EXPAND, 5)
 
-            attr_name.Bind(wx.EVT_TEXT, partial(self.on_key_change, state=attr_state))
-            attr_val.Bind(wx.EVT_TEXT, partial(self.on_val_change, attr=attr_name))
+        row = AttributeRow(sizer, attr_name, attr_val)
+        attr_name.Bind(wx.EVT_TEXT, partial(self.on_key_change, state=row.state))
+        attr_val.Bind(wx.EVT_TEXT, partial(self.on_val_change, attr=attr_name))
 
-            self.widgets.append(attr_val)
-            self.main_sizer.Add(_, 0, wx.EXPAND)
-        else:
-            add_attr_btn = wx.Button(self, label="Add Attribute")
-            add_attr_btn.Bind(wx.EVT_BUTTON, self.on_add_attr)
-            self.main_sizer.Add(add_attr_btn, 0, wx.ALL | wx.CENTER, 5)
-            self.widgets.append(add_attr_btn)
+        # rows go between the column labels and the Add Attribute button
+        self.main_sizer.Insert(index + 1, sizer, 0, wx.EXPAND)
+        self.rows.append(row)
+        return row
 
-        self.Layout()
+    def show_rows(self, count):
+        """
+        Show the first count rows and hide the rest
+        """
+        for index in range(count, self.visible_rows):
+            self.main_sizer.Show(self.rows[index].sizer, False)
+        for index in range(self.visible_rows, count):
+            self.main_sizer.Show(self.rows[index].sizer, True)
+        self.visible_rows = count
 
     def on_add_attr(self, event):
         """
@@ -97,19 +158,9 @@ class AttributeEditorPanel(wx.Panel):
         """
         Clears the panel of widgets
         """
-        sizers = {}
-        for widget in self.widgets:
-            sizer = widget.GetContainingSizer()
-            if sizer:
-                sizer_id = id(sizer)
-                if sizer_id not in sizers:
-                    sizers[sizer_id] = sizer
-            widget.Destroy()
-
-        for sizer in sizers:
-            self.main_sizer.Remove(sizers[sizer])
-
-        self.widgets = []
+        self.show_rows(0)
+        self.main_sizer.Show(self.label_sizer, False)
+        self.add_attr_btn.Hide()
         self.Layout()
 
     def on_key_change(self, event, state):
@@ -119,18 +170,17 @@ class AttributeEditorPanel(wx.Panel):
         """
         new_key = event.GetString()
         if new_key not in self.xml_obj.attrib:
-            if state.current_key in self.xml_obj.attrib:
-                self.xml_obj.attrib.pop(state.current_key)
-            self.xml_obj.attrib[new_key] = state.val_widget.GetValue()
+            edit = boom_core.rename_attribute(
+                self.xml_obj, state.current_key, new_key, state.val_widget.GetValue()
+            )
             state.previous_key = state.current_key
             state.current_key = new_key
-            pub.sendMessage("on_change_{}".format(self.page_id), event=None)
+            self.bus.send(CHANGE, edit=edit)
 
     def on_val_change(self, event, attr):
         """
         Event handler that is called on text change in the
         attribute value field
         """
-        new_val = event.GetString()
-        self.xml_obj.attrib[attr.GetValue()] = new_val
-        pub.sendMessage("on_change_{}".format(self.page_id), event=None)
+        edit = boom_core.set_attribute(self.xml_obj, attr.GetValue(), event.GetString())
+        self.bus.send(CHANGE, edit=edit)
@@ -0,0 +1,72 @@
+import argparse
+import boom_core
+import json
+import os
+import sys
+import time
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Apply a script of edits to XML files without the GUI"
+    )
+    parser.add_argument(
+        "script",
+        help="JSON file with a list of steps, like "
+        '[{"op": "set_text", "xpath": "//price", "text": "0"}]',
+    )
+    parser.add_argument("files", nargs="+", help="The XML files to edit")
+    parser.add_argument(
+        "-o",
+        "--output-dir",
+        help="Write the edited files here instead of changing them in place",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of worker processes (default: one per CPU)",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    Run the script against every file in a pool of processes and report
+    the throughput. Returns the exit code
+    """
+    args = parse_args(argv)
+    with open(args.script) as fobj:
+        script = json.load(fobj)
+
+    if args.output_dir and not os.path.exists(args.output_dir):
+        os.makedirs(args.output_dir)
+
+    failed = 0
+    changes = 0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+        futures = {
+            pool.submit(boom_core.process_file, path, script, args.output_dir): path
+            for path in args.files
+        }
+        for future in as_completed(futures):
+            try:
+                changes += future.result()
+            except Exception as e:
+                failed += 1
+                print("{}: {}".format(futures[future], e), file=sys.stderr)
+    elapsed = time.perf_counter() - start
+
+    processed = len(args.files) - failed
+    rate = processed / elapsed if elapsed else 0
+    msg = "Processed {} files ({} changes, {} failed) in {:.2f}s: {:.1f} files/sec"
+    print(msg.format(processed, changes, failed, elapsed, rate))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,184 @@
+import lxml.etree as ET
+import os
+import xml_io
+
+from journal import Edit, edit_path, serialize
+from replace import ReplacePlan
+from xml_index import LazyDocument, is_large_file
+
+
+def load(xml_path):
+    """
+    Returns the tree for the given file. Files above the
+    LARGE_FILE_THRESHOLD are only indexed and parsed on demand
+    """
+    if is_large_file(xml_path) and not xml_io.is_compressed(xml_path):
+        return LazyDocument(xml_path)
+    return xml_io.parse(xml_path)
+
+
+def save(xml_tree, path):
+    """
+    Write the document to the given path. The file is replaced
+    atomically and compressed if the path ends in .gz or .xz
+    """
+    xml_io.save(xml_tree, path)
+
+
+def set_text(element, text):
+    """
+    Change the text of an element
+    """
+    old_text = element.text
+    element.text = text
+    return Edit("text", edit_path(element), old=old_text, new=element.text)
+
+
+def set_attribute(element, key, value):
+    """
+    Add an attribute or change its value
+    """
+    edit = Edit(
+        "attrib", edit_path(element), old=element.attrib.get(key), new=value, key=key
+    )
+    element.attrib[key] = value
+    return edit
+
+
+def rename_attribute(element, old_key, new_key, value):
+    """
+    Give an attribute a new name. The old attribute may not exist yet,
+    as happens while the user is typing the name of a new attribute
+    """
+    element.attrib.pop(old_key, None)
+    element.attrib[new_key] = value
+    return Edit(
+        "rename_attrib", edit_path(element), old=old_key, new=new_key, value=value
+    )
+
+
+def add_node(parent, tag, text=None):
+    """
+    Append a new element to the parent. Returns the element and the edit
+    """
+    element = ET.SubElement(parent, tag)
+    element.text = text
+    edit = Edit(
+        "add",
+        edit_path(parent),
+        new=serialize(element),
+        index=parent.index(element),
+    )
+    return element, edit
+
+
+def remove_node(element):
+    """
+    Remove an element from its parent
+    """
+    parent = element.getparent()
+    edit = Edit(
+        "remove",
+        edit_path(parent),
+        old=serialize(element),
+        index=parent.index(element),
+        value=element.tail,
+    )
+    parent.remove(element)
+    return edit
+
+
+def paste_node(parent, element, text=None):
+    """
+    Append the element to the parent. lxml moves elements that are
+    already in a tree, so the removal from the old parent is part of
+    the edit as well
+
+    @param text: The element serialized without its tail, if the caller
+        has it already. Saves serializing large subtrees again
+    """
+    edits = []
+    if element.getparent() is not None:
+        edits.append(remove_node(element))
+
+    parent.append(element)
+    edits.append(
+        Edit(
+            "paste",
+            edit_path(parent),
+            new=text if text is not None else serialize(element),
+            index=parent.index(element),
+            value=element.tail,
+        )
+    )
+    return Edit("batch", None, new=edits) if len(edits) > 1 else edits[0]
+
+
+def run_step(xml_root, step):
+    """
+    Run one step of a script and return its edits. A step is a dict
+    with an op and the XPath of the elements it applies to, like
+    {"op": "set_text", "xpath": "//price", "text": "0"}
+    """
+    op = step["op"]
+    if op == "replace":
+        plan = ReplacePlan(
+            step["find"],
+            step["replace"],
+            scope=step.get("xpath", "//*"),
+            regex=step.get("regex", False),
+            ignore_case=step.get("ignore_case", False),
+            targets=step.get("targets", ("text", "attr_values")),
+        )
+        plan.find(xml_root)
+        edit = plan.apply()
+        return [edit] if edit else []
+
+    edits = []
+    for element in xml_root.xpath(step["xpath"]):
+        if op == "set_text":
+            edits.append(set_text(element, step["text"]))
+        elif op == "set_attribute":
+            edits.append(set_attribute(element, step["key"], step["value"]))
+        elif op == "rename_attribute":
+            if step["old"] in element.attrib:
+                value = element.attrib[step["old"]]
+                edits.append(rename_attribute(element, step["old"], step["new"], value))
+        elif op == "add_node":
+            edits.append(add_node(element, step["tag"], step.get("text"))[1])
+        elif op == "remove_node":
+            if element.getparent() is not None:
+                edits.append(remove_node(element))
+        else:
+            raise ValueError("Unknown script operation: {}".format(op))
+    return edits
+
+
+def run_script(xml_tree, script):
+    """
+    Run every step of a script against the document and return the
+    edits that were made
+    """
+    edits = []
+    for step in script:
+        edits.extend(run_step(xml_tree.getroot(), step))
+    return edits
+
+
+def process_file(xml_path, script, output_dir=None):
+    """
+    Load a file, run the script and save it, either in place or under
+    the same name in output_dir. Returns the number of edits made
+
+    Large files are parsed fully as well. The XPaths of a script could
+    only see the empty placeholders of a LazyDocument, and the edits
+    made to those would never be written
+    """
+    xml_tree = xml_io.parse(xml_path)
+    edits = run_script(xml_tree, script)
+    if edits or output_dir:
+        path = xml_path
+        if output_dir:
+            path = os.path.join(output_dir, os.path.basename(xml_path))
+        save(xml_tree, path)
+    return len(edits)
@@ -0,0 +1,110 @@
+import wx
+import wx.grid as gridlib
+
+TAG_COL = 0
+VALUE_COL = 1
+ATTR_COL = 2
+
+
+class LeafTable(gridlib.GridTableBase):
+    """
+    A virtual table over a list of leaf XML elements. The grid only
+    asks for the cells that are visible, so no per-element widgets or
+    strings are created up front
+    """
+
+    def __init__(self, set_text):
+        """
+        @param set_text: Callable that updates the text of an element
+            and notifies the page, like XmlEditorPanel.set_text
+        """
+        gridlib.GridTableBase.__init__(self)
+        self.set_text = set_text
+        self.elements = []
+        self.read_only = gridlib.GridCellAttr()
+        self.read_only.SetReadOnly(True)
+        self.read_only.SetBackgroundColour(
+            wx.SystemSettings.GetColour(wx.SYS_COLOUR_BTNFACE)
+        )
+
+    def GetNumberRows(self):
+        return len(self.elements)
+
+    def GetNumberCols(self):
+        return 3
+
+    def GetColLabelValue(self, col):
+        return ("Tag", "Value", "Attributes")[col]
+
+    def IsEmptyCell(self, row, col):
+        return False
+
+    def GetValue(self, row, col):
+        element = self.elements[row]
+        if col == TAG_COL:
+            return element.tag
+        if col == VALUE_COL:
+            return element.text if element.text else ""
+        return " ".join('{}="{}"'.format(k, v) for k, v in element.attrib.items())
+
+    def SetValue(self, row, col, value):
+        if col == VALUE_COL:
+            self.set_text(self.elements[row], value)
+
+    def GetAttr(self, row, col, kind):
+        if col == VALUE_COL:
+            return None
+        self.read_only.IncRef()
+        return self.read_only
+
+
+class XmlGridEditor(gridlib.Grid):
+    """
+    Grid used by the XmlEditorPanel for elements with too many leaf
+    children to give each of them a text control
+    """
+
+    def __init__(self, parent, set_text):
+        gridlib.Grid.__init__(self, parent)
+        self.table = LeafTable(set_text)
+        self.SetTable(self.table, takeOwnership=True)
+        self.SetRowLabelSize(60)
+        self.SetColSize(TAG_COL, 120)
+        self.SetColSize(VALUE_COL, 250)
+        self.SetColSize(ATTR_COL, 200)
+        self.DisableDragRowSize()
+
+    def set_elements(self, elements):
+        """
+        Show a new list of elements, telling the grid how the number
+        of rows has changed
+        """
+        old_count = len(self.table.elements)
+        self.table.elements = elements
+        new_count = len(elements)
+
+        self.BeginBatch()
+        if new_count < old_count:
+            msg = gridlib.GridTableMessage(
+                self.table,
+                gridlib.GRIDTABLE_NOTIFY_ROWS_DELETED,
+                new_count,
+                old_count - new_count,
+            )
+            self.ProcessTableMessage(msg)
+        elif new_count > old_count:
+            msg = gridlib.GridTableMessage(
+                self.table,
+                gridlib.GRIDTABLE_NOTIFY_ROWS_APPENDED,
+                new_count - old_count,
+            )
+            self.ProcessTableMessage(msg)
+        msg = gridlib.GridTableMessage(
+            self.table, gridlib.GRIDTABLE_REQUEST_VIEW_GET_VALUES
+        )
+        self.ProcessTableMessage(msg)
+        self.EndBatch()
+
+        if new_count:
+            self.MakeCellVisible(0, VALUE_COL)
+        self.ForceRefresh()
@@ -0,0 +1,133 @@
+import lxml.etree as ET
+import wx
+
+from event_bus import REVEAL, get_bus
+from journal import element_path
+
+TEXT_MODE = 0
+XPATH_MODE = 1
+
+
+class ResultList(wx.ListCtrl):
+    """
+    A virtual list of search results. The paths of the elements are
+    only computed for the rows that are on screen
+    """
+
+    def __init__(self, parent):
+        wx.ListCtrl.__init__(
+            self, parent, style=wx.LC_REPORT | wx.LC_VIRTUAL | wx.LC_SINGLE_SEL
+        )
+        self.InsertColumn(0, "Path", width=400)
+        self.results = []
+
+    def set_results(self, results):
+        self.results = results
+        self.SetItemCount(len(results))
+        self.Refresh()
+
+    def OnGetItemText(self, item, col):
+        return element_path(self.results[item])
+
+
+class SearchPanel(wx.Panel):
+    """
+    Searches the document by XPath or by the words of its tags,
+    attribute values and text, and reveals the hits in the tree
+    """
+
+    def __init__(self, parent, page_id, xml_root, search_index):
+        wx.Panel.__init__(self, parent)
+        self.page_id = page_id
+        self.xml_root = xml_root
+        self.search_index = search_index
+        self.bus = get_bus(page_id)
+        self.current = -1
+
+        main_sizer = wx.BoxSizer(wx.VERTICAL)
+        query_sizer = wx.BoxSizer(wx.HORIZONTAL)
+
+        self.mode = wx.Choice(self, choices=["Text", "XPath"])
+        self.mode.SetSelection(TEXT_MODE)
+        query_sizer.Add(self.mode, 0, wx.ALL, 5)
+
+        self.query = wx.SearchCtrl(self, style=wx.TE_PROCESS_ENTER)
+        self.query.Bind(wx.EVT_TEXT_ENTER, self.on_search)
+        self.query.Bind(wx.EVT_SEARCHCTRL_SEARCH_BTN, self.on_search)
+        query_sizer.Add(self.query, 1, wx.ALL | wx.EXPAND, 5)
+        main_sizer.Add(query_sizer, 0, wx.EXPAND)
+
+        nav_sizer = wx.BoxSizer(wx.HORIZONTAL)
+        prev_btn = wx.Button(self, label="Previous")
+        prev_btn.Bind(wx.EVT_BUTTON, self.on_previous)
+        nav_sizer.Add(prev_btn, 0, wx.ALL, 5)
+        next_btn = wx.Button(self, label="Next")
+        next_btn.Bind(wx.EVT_BUTTON, self.on_next)
+        nav_sizer.Add(next_btn, 0, wx.ALL, 5)
+        self.status = wx.StaticText(self, label="")
+        nav_sizer.Add(self.status, 1, wx.ALL | wx.ALIGN_CENTER_VERTICAL, 5)
+        main_sizer.Add(nav_sizer, 0, wx.EXPAND)
+
+        self.result_list = ResultList(self)
+        self.result_list.Bind(wx.EVT_LIST_ITEM_SELECTED, self.on_result_selected)
+        main_sizer.Add(self.result_list, 1, wx.ALL | wx.EXPAND, 5)
+
+        self.SetSizer(main_sizer)
+
+    def on_search(self, event):
+        """
+        Event handler that runs the query
+        """
+        query = self.query.GetValue().strip()
+        if not query:
+            return
+
+        if self.mode.GetSelection() == XPATH_MODE:
+            try:
+                results = self.xml_root.xpath(query)
+            except ET.XPathError as e:
+                self.show_results([], "Invalid XPath: {}".format(e))
+                return
+            if not isinstance(results, list):
+                self.show_results([], "Result: {}".format(results))
+                return
+            results = [result for result in results if ET.iselement(result)]
+        else:
+            results = self.search_index.search(query)
+
+        self.show_results(results, "{} matches".format(len(results)))
+
+    def show_results(self, results, msg):
+        self.current = -1
+        self.result_list.set_results(results)
+        self.status.SetLabel(msg)
+        self.Layout()
+
+    def select_result(self, index):
+        """
+        Select a result in the list, which reveals it in the tree
+        """
+        results = self.result_list.results
+        if not results:
+            return
+        index %= len(results)
+        self.result_list.Select(index)
+        self.result_list.EnsureVisible(index)
+        self.result_list.Focus(index)
+
+    def on_previous(self, event):
+        self.select_result(self.current - 1)
+
+    def on_next(self, event):
+        self.select_result(self.current + 1)
+
+    def on_result_selected(self, event):
+        """
+        Event handler that reveals the selected result in the tree
+        """
+        self.current = event.GetIndex()
+        xml_obj = self.result_list.results[self.current]
+        self.status.SetLabel(
+            "{} of {} matches".format(self.current + 1, len(self.result_list.results))
+        )
+        self.bus.send(REVEAL, xml_obj=xml_obj)
@@ -1,49 +1,381 @@
+import boom_core
+import functools
+import lxml.etree as ET
+import perf
 import wx
 
 from add_node_dialog import NodeDialog
+from clipboard import get_clipboard
+from collections import deque
+from event_bus import (
+    CHANGE,
+    REVEAL,
+    TREE_REFRESH,
+    TREE_UPDATE,
+    UI_UPDATE,
+    VALIDATION,
+    get_bus,
+)
+from journal import is_attached
+from node_handles import NodeTable
 from pubsub import pub
+from xml_diff import CHANGED, DELETED, INSERTED, MOVED
+from xml_index import is_placeholder
+
+# The maximum number of children that are added to a tree item at once
+BUCKET_SIZE = 1000
+
+# Background colour of the items of elements that failed validation
+ERROR_COLOUR = (255, 215, 215)
+
+# Text colours of the items of a diff
+MARK_COLOURS = {
+    INSERTED: (0, 128, 0),
+    DELETED: (192, 0, 0),
+    MOVED: (0, 0, 192),
+    CHANGED: (192, 112, 0),
+}
+
+
+class ChildRange:
+    """
+    Item data for a tree item that groups the children of an XML
+    element between two indexes. The element is referenced by its handle
+    """
+
+    __slots__ = ("handle", "start", "stop")
+
+    def __init__(self, handle, start, stop):
+        self.handle = handle
+        self.start = start
+        self.stop = stop
 
 
 class XmlTree(wx.TreeCtrl):
     """
     The class that holds all the functionality for the tree control
     widget
+
+    Elements with more than BUCKET_SIZE children get their children
+    grouped into range items that are only filled in when they are
+    expanded, so no expansion creates more than BUCKET_SIZE tree items
+
+    Items refer to their elements by NodeTable handles. The table also
+    records which items have had their children created
+
+    When the panel has diff marks, changed items are coloured by the
+    kind of change and the items that contain changes are bold
     """
 
     def __init__(self, parent, wx_id, pos, size, style):
         wx.TreeCtrl.__init__(self, parent, wx_id, pos, size, style)
-        self.expanded = {}
+        self.nodes = parent.nodes
         self.xml_root = parent.xml_root
+        self.xml_tree = parent.xml_tree
         self.page_id = parent.page_id
-        pub.subscribe(self.update_tree, "tree_update_{}".format(self.page_id))
+        self.marks = parent.marks
+        self.ancestors = parent.ancestors
+        self.invalid = set()
+        self.bus = get_bus(self.page_id)
+        self.bus.subscribe(TREE_UPDATE, self.update_tree)
+        self.bus.subscribe(TREE_REFRESH, self.refresh_element)
+        self.bus.subscribe(REVEAL, self.reveal)
+        self.bus.subscribe(VALIDATION, self.show_errors)
 
         root = self.AddRoot(self.xml_root.tag)
-        self.expanded[id(self.xml_root)] = ""
-        self.SetItemData(root, self.xml_root)
-        wx.CallAfter(
-            pub.sendMessage, "ui_updater_{}".format(self.page_id), xml_obj=self.xml_root
-        )
+        handle = self.nodes.add(self.xml_root)
+        self.nodes.set_expanded(handle)
+        self.SetItemData(root, handle)
+        self.mark_item(root, self.xml_root, None)
+        self.bus.post(UI_UPDATE, xml_obj=self.xml_root)
 
-        if self.xml_root.getchildren():
-            for top_level_item in self.xml_root.getchildren():
-                child = self.AppendItem(root, top_level_item.tag)
-                if top_level_item.getchildren():
-                    self.SetItemHasChildren(child)
-                self.SetItemData(child, top_level_item)
+        self.add_children(root, self.xml_root)
 
         self.Expand(root)
         self.Bind(wx.EVT_TREE_ITEM_EXPANDING, self.on_item_expanding)
         self.Bind(wx.EVT_TREE_SEL_CHANGED, self.on_tree_selection)
 
+    def has_children(self, xml_obj):
+        """
+        Returns True if the XML object has children, including the
+        placeholders of large files that have not been parsed yet
+        """
+        return is_placeholder(xml_obj) or len(xml_obj) > 0
+
+    def get_xml_obj(self, item):
+        """
+        Returns the XML object of a tree item. Placeholders of large
+        files are parsed and swapped in on first access. Range items
+        and items whose element is gone return None
+        """
+        handle = self.GetItemData(item)
+        if handle is None or isinstance(handle, ChildRange):
+            return None
+        xml_obj = self.nodes.get(handle)
+        if xml_obj is not None and is_placeholder(xml_obj):
+            xml_obj = self.xml_tree.materialize(xml_obj)
+            self.nodes.replace(handle, xml_obj)
+        return xml_obj
+
+    def get_handle(self, item):
+        """
+        Returns the handle of the element an item shows, or of the
+        element whose children a range item groups
+        """
+        data = self.GetItemData(item)
+        if isinstance(data, ChildRange):
+            return data.handle
+        return data
+
+    def item_label(self, xml_obj):
+        """
+        Returns the label of the tree item for the XML object
+        """
+        if isinstance(xml_obj.tag, str):
+            return xml_obj.tag
+        if xml_obj.tag is ET.Comment:
+            return "<!-- -->"
+        return "<?{}?>".format(xml_obj.target)
+
+    def append_xml_item(self, item, xml_obj):
+        """
+        Append a tree item for the XML object and return it
+        """
+        child = self.AppendItem(item, self.item_label(xml_obj))
+        handle = self.get_handle(item)
+        self.SetItemData(child, self.nodes.add(xml_obj))
+        if self.has_children(xml_obj):
+            self.SetItemHasChildren(child)
+        self.mark_item(child, xml_obj, self.nodes.get(handle))
+        if xml_obj in self.invalid:
+            self.SetItemBackgroundColour(child, wx.Colour(*ERROR_COLOUR))
+        return child
+
+    def show_errors(self, errors):
+        """
+        Mark the items of the elements that failed validation. Items
+        that have not been created yet are marked when they are.
+        Called via the event bus
+        """
+        invalid = {error.element for error in errors}
+        for xml_obj in self.invalid - invalid:
+            item = self.find_item(xml_obj)
+            if item is not None:
+                self.SetItemBackgroundColour(item, wx.NullColour)
+        for xml_obj in invalid - self.invalid:
+            item = self.find_item(xml_obj)
+            if item is not None:
+                self.SetItemBackgroundColour(item, wx.Colour(*ERROR_COLOUR))
+        self.invalid = invalid
+
+    def mark_item(self, item, xml_obj, parent_obj):
+        """
+        Colour the item of a changed XML object. Everything inside of
+        an inserted or deleted subtree takes the mark of its top
+        """
+        if self.marks is None:
+            return
+        kind = self.marks.get(xml_obj)
+        if kind is None and parent_obj is not None:
+            kind = self.marks.get(parent_obj)
+            if kind in (INSERTED, DELETED):
+                self.marks[xml_obj] = kind
+            else:
+                kind = None
+        if kind is not None:
+            self.SetItemTextColour(item, wx.Colour(*MARK_COLOURS[kind]))
+        if xml_obj in self.ancestors:
+            self.SetItemBold(item)
+
+    def contains_marks(self, item):
+        """
+        Returns True if there are changes below the tree item
+        """
+        data = self.GetItemData(item)
+        if not isinstance(data, ChildRange):
+            return self.get_xml_obj(item) in self.ancestors
+        xml_obj = self.nodes.get(data.handle)
+        return any(
+            child in self.marks or child in self.ancestors
+            for child in xml_obj[data.start : data.stop]
+        )
+
+    def expand_marks(self, limit):
+        """
+        Expand the items that contain changes, breadth first, until
+        limit items have been expanded. Unchanged branches are not
+        created at all
+        """
+        queue = deque([self.GetRootItem()])
+        while queue and limit > 0:
+            item = queue.popleft()
+            self.fill_item(item)
+            self.Expand(item)
+            limit -= 1
+            child, cookie = self.GetFirstChild(item)
+            while child.IsOk():
+                if self.contains_marks(child):
+                    queue.append(child)
+                child, cookie = self.GetNextChild(item, cookie)
+
+    def add_children(self, item, xml_obj, start=0, stop=None):
+        """
+        Add the children of the XML object between start and stop to
+        the tree item, grouping them into ranges if there are too many
+        """
+        if stop is None:
+            stop = len(xml_obj)
+        count = stop - start
+
+        if count <= BUCKET_SIZE:
+            for child_obj in xml_obj[start:stop]:
+                self.append_xml_item(item, child_obj)
+            return
+
+        step = BUCKET_SIZE
+        while count > step * BUCKET_SIZE:
+            step *= BUCKET_SIZE
+
+        handle = self.get_handle(item)
+        for bucket_start in range(start, stop, step):
+            bucket_stop = min(bucket_start + step, stop)
+            label = "[{} - {}]".format(bucket_start + 1, bucket_stop)
+            child = self.AppendItem(item, label)
+            self.SetItemData(child, ChildRange(handle, bucket_start, bucket_stop))
+            self.SetItemHasChildren(child)
+
     def add_elements(self, item, book):
         """
         Add items to the tree control
         """
-        for element in book.getchildren():
-            child = self.AppendItem(item, element.tag)
-            self.SetItemData(child, element)
-            if element.getchildren():
-                self.SetItemHasChildren(child)
+        self.add_children(item, book)
+
+    def find_item(self, xml_obj):
+        """
+        Returns the tree item that shows the XML object, or None if
+        the branch it is in has not been expanded yet
+        """
+        path = [xml_obj] + list(xml_obj.iterancestors())
+        path.reverse()
+        if path[0] is not self.xml_root:
+            return None
+
+        item = self.GetRootItem()
+        for parent_obj, target in zip(path, path[1:]):
+            item = self.find_child_item(item, parent_obj, target)
+            if item is None:
+                return None
+        return item
+
+    def find_child_item(self, item, parent_obj, target, fill=False):
+        """
+        Returns the child item of item that shows the target, looking
+        inside of the range items of wide elements. When fill is True
+        the children of item are created first if needed
+        """
+        if fill:
+            self.fill_item(item)
+
+        index = None
+        child, cookie = self.GetFirstChild(item)
+        while child.IsOk():
+            data = self.GetItemData(child)
+            if isinstance(data, ChildRange):
+                if index is None:
+                    index = parent_obj.index(target)
+                if data.start <= index < data.stop:
+                    return self.find_child_item(child, parent_obj, target, fill)
+            else:
+                xml_obj = self.nodes.get(data)
+                if (
+                    xml_obj is not None
+                    and is_placeholder(xml_obj)
+                    and xml_obj.getparent() is None
+                ):
+                    # the entry was parsed through another reference
+                    xml_obj = self.get_xml_obj(child)
+                if xml_obj is target:
+                    return child
+            child, cookie = self.GetNextChild(item, cookie)
+        return None
+
+    @perf.timed("tree.reveal")
+    def reveal(self, xml_obj):
+        """
+        Select the item of the XML object, creating and expanding only
+        the items on the path from the root to it. Called via the event bus
+        """
+        path = [xml_obj] + list(xml_obj.iterancestors())
+        path.reverse()
+        if path[0] is not self.xml_root:
+            return
+
+        item = self.GetRootItem()
+        for parent_obj, target in zip(path, path[1:]):
+            item = self.find_child_item(item, parent_obj, target, fill=True)
+            if item is None:
+                return
+
+        self.EnsureVisible(item)
+        self.SelectItem(item)
+
+    def refresh_element(self, xml_obj):
+        """
+        Rebuild the children of the item that shows the XML object,
+        if there is one. Called via pubsub after undo and redo
+        """
+        item = self.find_item(xml_obj)
+        if item is not None:
+            self.refresh_item(item)
+
+    def refresh_item(self, item):
+        """
+        Rebuild the children of a tree item from its XML object
+        """
+        xml_obj = self.get_xml_obj(item)
+        handle = self.GetItemData(item)
+        was_expanded = self.IsExpanded(item)
+        self.delete_children(item)
+        self.nodes.set_expanded(handle, False)
+        if self.has_children(xml_obj):
+            self.SetItemHasChildren(item)
+            if was_expanded:
+                self.add_children(item, xml_obj)
+                self.nodes.set_expanded(handle)
+        else:
+            self.SetItemHasChildren(item, False)
+
+    def release_children(self, item):
+        """
+        Release the handles of all the items below item
+        """
+        child, cookie = self.GetFirstChild(item)
+        while child.IsOk():
+            self.release_children(child)
+            data = self.GetItemData(child)
+            if not isinstance(data, ChildRange):
+                self.nodes.release(data)
+            child, cookie = self.GetNextChild(item, cookie)
+
+    def delete_children(self, item):
+        self.release_children(item)
+        self.DeleteChildren(item)
+
+    def remove_item(self, item):
+        """
+        Remove the tree item of an XML object that was removed from
+        its parent. Ranges are rebuilt as their indexes have shifted
+        """
+        parent_item = self.GetItemParent(item)
+        while isinstance(self.GetItemData(parent_item), ChildRange):
+            parent_item = self.GetItemParent(parent_item)
+
+        if parent_item != self.GetItemParent(item):
+            self.refresh_item(parent_item)
+        else:
+            self.delete_children(item)
+            self.nodes.release(self.GetItemData(item))
+            self.Delete(item)
 
     def on_item_expanding(self, event):
         """
@@ -52,64 +384,118 @@ class XmlTree(wx.TreeCtrl):
         This will cause the sub-elements of the tree to be created
         and added to the tree
         """
-        item = event.GetItem()
-        xml_obj = self.GetItemData(item)
+        self.fill_item(event.GetItem())
+
+    @perf.timed("tree.expand")
+    def fill_item(self, item):
+        """
+        Create the children of a tree item unless that already happened
+        """
+        data = self.GetItemData(item)
 
-        if id(xml_obj) not in self.expanded and xml_obj is not None:
-            for top_level_item in xml_obj.getchildren():
-                child = self.AppendItem(item, top_level_item.tag)
-                self.SetItemData(child, top_level_item)
-                if top_level_item.getchildren():
-                    self.SetItemHasChildren(child)
+        if isinstance(data, ChildRange):
+            if not self.GetChildrenCount(item, recursively=False):
+                xml_obj = self.nodes.get(data.handle)
+                if xml_obj is not None:
+                    self.add_children(item, xml_obj, data.start, data.stop)
+            return
 
-        self.expanded[id(xml_obj)] = ""
+        xml_obj = self.get_xml_obj(item)
+        if xml_obj is not None and not self.nodes.is_expanded(data):
+            self.add_children(item, xml_obj)
+            self.nodes.set_expanded(data)
 
     def on_tree_selection(self, event):
         """
         A handler that fires when an item in the tree is selected
 
         This will cause an update to be sent to the XmlEditorPanel
-        to allow editing of the XML
+        to allow editing of the XML. The update is posted, so scrolling
+        through the tree with the keyboard only rebuilds the editors
+        for the item the selection stops on
         """
         item = event.GetItem()
-        xml_obj = self.GetItemData(item)
-        pub.sendMessage("ui_updater_{}".format(self.page_id), xml_obj=xml_obj)
+        xml_obj = self.get_xml_obj(item)
+        if xml_obj is None:
+            return
+        self.bus.post(UI_UPDATE, xml_obj=xml_obj)
 
     def update_tree(self, xml_obj):
         """
         Update the tree with the new data
         """
         selection = self.GetSelection()
-        selected_tree_xml_obj = self.GetItemData(selection)
+        selected_tree_xml_obj = self.get_xml_obj(selection)
+        if selected_tree_xml_obj is None:
+            return
 
-        if id(selected_tree_xml_obj) in self.expanded:
-            child = self.AppendItem(selection, xml_obj.tag)
-            if xml_obj.getchildren():
-                self.SetItemHasChildren(child)
-            self.SetItemData(child, xml_obj)
+        if self.nodes.is_expanded(self.GetItemData(selection)):
+            self.append_xml_item(selection, xml_obj)
 
-        if selected_tree_xml_obj.getchildren():
+        if self.has_children(selected_tree_xml_obj):
             self.SetItemHasChildren(selection)
 
+    def insert_element(self, parent_obj, xml_obj):
+        """
+        Show an element that was appended to parent_obj. Only the item
+        of the element itself is created, the items of its subtree are
+        added when it is expanded
+        """
+        item = self.find_item(parent_obj)
+        if item is None:
+            # the parent's branch is created when it is expanded
+            return
+
+        if self.nodes.is_expanded(self.GetItemData(item)):
+            if len(parent_obj) > BUCKET_SIZE:
+                # the new child belongs in the last range item
+                self.refresh_item(item)
+            else:
+                self.append_xml_item(item, xml_obj)
+        self.SetItemHasChildren(item)
+
 
 class BoomTreePanel(wx.Panel):
     """
     The panel class that contains the XML tree control
     """
 
-    def __init__(self, parent, xml_obj, page_id):
+    def __init__(
+        self,
+        parent,
+        xml_obj,
+        page_id,
+        xml_tree=None,
+        marks=None,
+        ancestors=None,
+        editable=True,
+    ):
+        """
+        @param marks: Optional dict of the changed elements of a diff to
+            the kind of change
+        @param ancestors: The set of elements that contain the changes
+        @param editable: False for a tree that only shows the document
+        """
         wx.Panel.__init__(self, parent)
         self.xml_root = xml_obj
-        self.copied_data = None
+        self.xml_tree = xml_tree
+        self.marks = marks
+        self.ancestors = ancestors if ancestors is not None else set()
+        self.nodes = NodeTable()
         self.page_id = page_id
+        self.bus = get_bus(page_id)
 
-        pub.subscribe(self.add_node, "add_node_{}".format(self.page_id))
-        pub.subscribe(self.remove_node, "remove_node_{}".format(self.page_id))
+        if editable:
+            pub.subscribe(self.add_node, "add_node_{}".format(self.page_id))
+            pub.subscribe(self.remove_node, "remove_node_{}".format(self.page_id))
+            pub.subscribe(self.copy_node, "copy_node_{}".format(self.page_id))
+            pub.subscribe(self.paste_node, "paste_node_{}".format(self.page_id))
 
         self.tree = XmlTree(
             self, wx.ID_ANY, wx.DefaultPosition, wx.DefaultSize, wx.TR_HAS_BUTTONS
         )
-        self.tree.Bind(wx.EVT_CONTEXT_MENU, self.on_context_menu)
+        if editable:
+            self.tree.Bind(wx.EVT_CONTEXT_MENU, self.on_context_menu)
 
         sizer = wx.BoxSizer(wx.VERTICAL)
         sizer.Add(self.tree, 1, wx.EXPAND)
@@ -131,12 +517,19 @@ class BoomTreePanel(wx.Panel):
             self.Bind(wx.EVT_MENU, self.on_copy, id=self.copy_id)
             self.Bind(wx.EVT_MENU, self.on_paste, id=self.paste_id)
 
+        # comments and processing instructions can only be removed
+        xml_obj = self.tree.get_xml_obj(self.tree.GetSelection())
+        is_element = xml_obj is not None and isinstance(xml_obj.tag, str)
+
         # Build the context menu
         menu = wx.Menu()
         menu.Append(self.copy_id, "Copy")
+        menu.Enable(self.copy_id, is_element)
         menu.Append(self.paste_id, "Paste")
+        menu.Enable(self.paste_id, is_element and not get_clipboard().is_empty())
         menu.AppendSeparator()
         menu.Append(self.add_node_id, "Add Node")
+        menu.Enable(self.add_node_id, is_element)
         menu.Append(self.remove_node_id, "Remove Node")
 
         self.PopupMenu(menu)
@@ -154,31 +547,74 @@ class BoomTreePanel(wx.Panel):
 
     def on_copy(self, event):
         """
-        Copy the selected XML object into memory
+        Event handler that copies the selected node
         """
-        node = self.tree.GetSelection()
-        self.copied_data = self.tree.GetItemData(node)
+        self.copy_node()
 
     def on_paste(self, event):
         """
-        Paste / Append the copied XML data to the selected node
+        Event handler that pastes the copied node into the selected one
         """
-        if self.copied_data:
-            node = self.tree.GetSelection()
-            parent_xml_node = self.tree.GetItemData(node)
+        self.paste_node()
 
-            parent_xml_node.append(self.copied_data)
-            pub.sendMessage(
-                "tree_update_{}".format(self.page_id), xml_obj=self.copied_data
+    def copy_node(self):
+        """
+        Put a copy of the selected node on the application's clipboard
+        """
+        xml_obj = self.tree.get_xml_obj(self.tree.GetSelection())
+        if xml_obj is None:
+            return
+        if not isinstance(xml_obj.tag, str):
+            print("Only elements can be copied")
+            return
+        get_clipboard().copy(xml_obj, self.xml_tree)
+
+    def paste_node(self):
+        """
+        Append a copy of the node on the clipboard to the selected node.
+        The node may have been copied in any page
+        """
+        parent_xml_node = self.tree.get_xml_obj(self.tree.GetSelection())
+        if parent_xml_node is None or not isinstance(parent_xml_node.tag, str):
+            return
+        get_clipboard().paste(functools.partial(self.on_pasted, parent_xml_node))
+
+    def on_pasted(self, parent_xml_node, element, text, error):
+        """
+        Insert the parsed copy. Called on the GUI thread once the
+        clipboard's worker is done
+        """
+        if not self:
+            # the page was closed in the meantime
+            return
+        if error is not None:
+            dlg = wx.MessageDialog(
+                parent=None,
+                message="Unable to paste the copied node\n\n{}".format(error),
+                caption="Error",
+                style=wx.OK | wx.ICON_ERROR,
             )
-            pub.sendMessage("on_change_{}".format(self.page_id), event=None)
+            dlg.ShowModal()
+            dlg.Destroy()
+            return
+        if not is_attached(parent_xml_node, self.xml_root):
+            # the node was removed in the meantime
+            return
+        edit = boom_core.paste_node(parent_xml_node, element, text)
+        self.tree.insert_element(parent_xml_node, element)
+        self.bus.send(CHANGE, edit=edit)
 
     def add_node(self):
         """
         Add a sub-node to the selected item in the tree
         """
         node = self.tree.GetSelection()
-        data = self.tree.GetItemData(node)
+        data = self.tree.get_xml_obj(node)
+        if data is None:
+            return
+        if not isinstance(data.tag, str):
+            print("Only elements can have child nodes")
+            return
         dlg = NodeDialog(
             data,
             page_id=self.page_id,
@@ -193,9 +629,9 @@ class BoomTreePanel(wx.Panel):
         Remove the selected node from the tree
         """
         node = self.tree.GetSelection()
-        xml_node = self.tree.GetItemData(node)
+        xml_node = self.tree.get_xml_obj(node)
 
-        if node:
+        if node and xml_node is not None:
             msg = "Are you sure you want to delete the {node} node"
             dlg = wx.MessageDialog(
                 parent=None,
@@ -204,9 +640,7 @@ class BoomTreePanel(wx.Panel):
                 style=wx.YES_NO | wx.YES_DEFAULT | wx.ICON_EXCLAMATION,
             )
             if dlg.ShowModal() == wx.ID_YES:
-                parent = xml_node.getparent()
-                parent.remove(xml_node)
-                self.tree.DeleteChildren(node)
-                self.tree.Delete(node)
-                pub.sendMessage("on_change_{}".format(self.page_id), event=None)
+                edit = boom_core.remove_node(xml_node)
+                self.tree.remove_item(node)
+                self.bus.send(CHANGE, edit=edit)
             dlg.Destroy()
@@ -1,13 +1,50 @@
+import boom_core
+import lxml.etree as ET
+import perf
 import wx
 import wx.lib.scrolledpanel as scrolled
 
+from boom_grid_editor import XmlGridEditor
+from event_bus import CHANGE, UI_UPDATE, get_bus
 from functools import partial
 from pubsub import pub
+from xml_index import is_placeholder
+
+# Elements with more editable children than this are shown in a grid
+GRID_THRESHOLD = 200
+
+
+class EditorRow:
+    """
+    A pooled tag label / value text control pair that can be bound
+    to a different XML element on every update
+    """
+
+    def __init__(self, sizer, tag_txt, value_txt):
+        self.sizer = sizer
+        self.tag_txt = tag_txt
+        self.value_txt = value_txt
+        self.xml_obj = None
+
+    def bind(self, xml_obj):
+        """
+        Show the tag and text of the element in the row's widgets
+        without firing any text events
+        """
+        self.xml_obj = xml_obj
+        if self.tag_txt.GetLabel() != xml_obj.tag:
+            self.tag_txt.SetLabel(xml_obj.tag)
+        self.value_txt.ChangeValue(xml_obj.text if xml_obj.text else "")
 
 
 class XmlEditorPanel(scrolled.ScrolledPanel):
     """
     The panel in the notebook that allows editing of XML element values
+
+    The rows are recycled between updates: widgets are only created when
+    an element has more leaf children than any element shown before and
+    surplus rows are hidden instead of destroyed. Above GRID_THRESHOLD
+    leaf children the panel switches to a virtual grid instead
     """
 
     def __init__(self, parent, page_id):
@@ -15,20 +52,14 @@ class XmlEditorPanel(scrolled.ScrolledPanel):
         scrolled.ScrolledPanel.__init__(self, parent, style=wx.SUNKEN_BORDER)
         self.main_sizer = wx.BoxSizer(wx.VERTICAL)
         self.page_id = page_id
-        self.widgets = []
-        self.label_spacer = None
+        self.rows = []
+        self.visible_rows = 0
+        self.lbl_size = (75, 25)
 
-        pub.subscribe(self.update_ui, "ui_updater_{}".format(self.page_id))
+        self.bus = get_bus(page_id)
+        self.bus.subscribe(UI_UPDATE, self.update_ui)
 
-        self.SetSizer(self.main_sizer)
-
-    def update_ui(self, xml_obj):
-        """
-        Update the panel's user interface based on the data
-        """
         self.label_sizer = wx.BoxSizer(wx.HORIZONTAL)
-        self.clear()
-
         tag_lbl = wx.StaticText(self, label="Tags")
         value_lbl = wx.StaticText(self, label="Value")
         self.label_sizer.Add(tag_lbl, 0, wx.ALL, 5)
@@ -36,85 +67,128 @@ class XmlEditorPanel(scrolled.ScrolledPanel):
         self.label_sizer.Add(value_lbl, 0, wx.ALL, 5)
         self.main_sizer.Add(self.label_sizer)
 
-        self.widgets.extend([tag_lbl, value_lbl])
-
-        if xml_obj is not None:
-            lbl_size = (75, 25)
-            for child in xml_obj.getchildren():
-                if child.getchildren():
-                    continue
-                sizer = wx.BoxSizer(wx.HORIZONTAL)
-                tag_txt = wx.StaticText(self, label=child.tag, size=lbl_size)
-                sizer.Add(tag_txt, 0, wx.ALL, 5)
-                self.widgets.append(tag_txt)
+        self.grid = XmlGridEditor(self, self.set_text)
+        self.main_sizer.Add(self.grid, 1, wx.ALL | wx.EXPAND, 5)
+        self.grid.Hide()
 
-                text = child.text if child.text else ""
+        self.add_node_btn = wx.Button(self, label="Add Node")
+        self.add_node_btn.Bind(wx.EVT_BUTTON, self.on_add_node)
+        self.main_sizer.Add(self.add_node_btn, 0, wx.ALL | wx.CENTER, 5)
+        self.add_node_btn.Hide()
 
-                value_txt = wx.TextCtrl(self, value=text)
-                value_txt.Bind(wx.EVT_TEXT, partial(self.on_text_change, xml_obj=child))
-                sizer.Add(value_txt, 1, wx.ALL | wx.EXPAND, 5)
-                self.widgets.append(value_txt)
+        self.SetSizer(self.main_sizer)
 
-                self.main_sizer.Add(sizer, 0, wx.EXPAND)
+    @perf.timed("editor.update_ui")
+    def update_ui(self, xml_obj):
+        """
+        Update the panel's user interface based on the data
+        """
+        self.Freeze()
+        try:
+            elements = []
+            if xml_obj is not None:
+                elements = self.get_editable_elements(xml_obj)
+            is_element = xml_obj is not None and isinstance(xml_obj.tag, str)
+
+            use_grid = len(elements) > GRID_THRESHOLD
+            if use_grid:
+                self.show_rows(0)
+                self.grid.set_elements(elements)
             else:
-                if getattr(xml_obj, "tag") and getattr(xml_obj, "text"):
-                    if xml_obj.getchildren() == []:
-                        self.add_single_tag_elements(xml_obj, lbl_size)
-
-                add_node_btn = wx.Button(self, label="Add Node")
-                add_node_btn.Bind(wx.EVT_BUTTON, self.on_add_node)
-                self.main_sizer.Add(add_node_btn, 0, wx.ALL | wx.CENTER, 5)
-                self.widgets.append(add_node_btn)
-
-            self.SetAutoLayout(1)
-            self.SetupScrolling()
-
-    def add_single_tag_elements(self, xml_obj, lbl_size):
+                self.grid.set_elements([])
+                for index, element in enumerate(elements):
+                    self.get_row(index).bind(element)
+                self.show_rows(len(elements))
+            self.main_sizer.Show(self.label_sizer, not use_grid)
+            self.grid.Show(use_grid)
+
+            self.add_node_btn.Show(is_element)
+            self.Layout()
+            if use_grid:
+                # the grid scrolls by itself
+                self.SetupScrolling(scroll_x=False, scroll_y=False)
+            elif xml_obj is not None:
+                self.SetAutoLayout(1)
+                self.SetupScrolling()
+        finally:
+            self.Thaw()
+
+    def get_editable_elements(self, xml_obj):
         """
-        Adds the single tag elements to the panel
-
-        This function is only called when there should be just one
-        tag / value
+        Returns the elements that get a row in the panel: the leaf
+        children of the element, or the element itself if it is a leaf
+        with a value. Comments and processing instructions have none
+        """
+        if not isinstance(xml_obj.tag, str):
+            return []
+        elements = [
+            child
+            for child in xml_obj.iterchildren(tag=ET.Element)
+            if not len(child) and not is_placeholder(child)
+        ]
+        if not len(xml_obj) and xml_obj.text:
+            elements.append(xml_obj)
+        return elements
+
+    def get_row(self, index):
         """
+        Returns the pooled row at the index, creating it if needed
+        """
+        if index < len(self.rows):
+            return self.rows[index]
+
         sizer = wx.BoxSizer(wx.HORIZONTAL)
-        tag_txt = wx.StaticText(self, label=xml_obj.tag, size=lbl_size)
+        tag_txt = wx.StaticText(self, label="", size=self.lbl_size)
         sizer.Add(tag_txt, 0, wx.ALL, 5)
-        self.widgets.append(tag_txt)
 
-        value_txt = wx.TextCtrl(self, value=xml_obj.text)
-        value_txt.Bind(wx.EVT_TEXT, partial(self.on_text_change, xml_obj=xml_obj))
+        value_txt = wx.TextCtrl(self)
         sizer.Add(value_txt, 1, wx.ALL | wx.EXPAND, 5)
-        self.widgets.append(value_txt)
 
-        self.main_sizer.Add(sizer, 0, wx.EXPAND)
+        row = EditorRow(sizer, tag_txt, value_txt)
+        value_txt.Bind(wx.EVT_TEXT, partial(self.on_text_change, row=row))
+
+        # rows go between the column labels and the grid
+        self.main_sizer.Insert(index + 1, sizer, 0, wx.EXPAND)
+        self.rows.append(row)
+        return row
+
+    def show_rows(self, count):
+        """
+        Show the first count rows and hide the rest
+        """
+        for index in range(count, self.visible_rows):
+            self.main_sizer.Show(self.rows[index].sizer, False)
+            self.rows[index].xml_obj = None
+        for index in range(self.visible_rows, count):
+            self.main_sizer.Show(self.rows[index].sizer, True)
+        self.visible_rows = count
 
     def clear(self):
         """
         Clears the widgets from the panel in preparation for an update
         """
-        sizers = {}
-        for widget in self.widgets:
-            sizer = widget.GetContainingSizer()
-            if sizer:
-                sizer_id = id(sizer)
-                if sizer_id not in sizers:
-                    sizers[sizer_id] = sizer
-            widget.Destroy()
-
-        for sizer in sizers:
-            self.main_sizer.Remove(sizers[sizer])
-
-        self.widgets = []
+        self.show_rows(0)
+        self.grid.set_elements([])
+        self.grid.Hide()
+        self.add_node_btn.Hide()
         self.Layout()
 
-    def on_text_change(self, event, xml_obj):
+    def on_text_change(self, event, row):
         """
         An event handler that is called when the text changes in the text
-        control. This will update the passed in xml object to something
-        new
+        control. This will update the xml object the row is bound to
+        """
+        xml_obj = row.xml_obj
+        if xml_obj is None:
+            return
+        self.set_text(xml_obj, event.GetString())
+
+    def set_text(self, xml_obj, text):
+        """
+        Update the text of the xml object and notify the page
         """
-        xml_obj.text = event.GetString()
-        pub.sendMessage("on_change_{}".format(self.page_id), event=None)
+        edit = boom_core.set_text(xml_obj, text)
+        self.bus.send(CHANGE, edit=edit)
 
     def on_add_node(self, event):
         """
@@ -0,0 +1,124 @@
+import copy
+import lxml.etree as ET
+import perf
+import threading
+import wx
+import xml_io
+
+from journal import serialize
+from xml_index import LazyDocument
+
+
+class Clipboard:
+    """
+    The clipboard of the whole application, so a subtree that is copied
+    in one page can be pasted into any other
+
+    The clipboard holds the copied subtree as XML text rather than a
+    reference to the element, so later edits of the source don't change
+    what is pasted and every paste parses a new copy. Large subtrees are
+    serialized and parsed in worker threads, only the deep copy that is
+    taken when copying happens on the GUI thread
+    """
+
+    def __init__(self):
+        self.text = None
+        self.tag = None
+        self.generation = 0
+        self.waiting = []
+
+    def is_empty(self):
+        return self.tag is None
+
+    def copy(self, element, xml_tree=None):
+        """
+        Put a copy of the element and its subtree on the clipboard
+
+        @param xml_tree: The document of the element. The top level
+            entries of a LazyDocument that were not opened yet are parsed
+            in the worker when its root is copied
+        """
+        # the worker gets a copy of its own, lxml elements must not be
+        # used by two threads at once
+        with perf.span("clipboard.snapshot"):
+            if isinstance(xml_tree, LazyDocument) and element is xml_tree.getroot():
+                # only the shell is copied, the placeholders in it are
+                # parsed from the source
+                snapshot = copy.deepcopy(xml_tree)
+            else:
+                snapshot = copy.deepcopy(element)
+        self.generation += 1
+        self.text = None
+        self.tag = element.tag
+        self.waiting = []
+        threading.Thread(
+            target=self.serialize, args=(snapshot, self.generation), daemon=True
+        ).start()
+
+    def serialize(self, snapshot, generation):
+        """
+        Serialize the copied subtree. Runs in a worker thread
+        """
+        try:
+            if isinstance(snapshot, LazyDocument):
+                snapshot = xml_io.full_tree(snapshot).getroot()
+            text = serialize(snapshot)
+        except Exception as e:
+            wx.CallAfter(self.on_serialized, None, generation, e)
+            return
+        wx.CallAfter(self.on_serialized, text, generation, None)
+
+    def on_serialized(self, text, generation, error):
+        if generation != self.generation:
+            # something else was copied in the meantime
+            return
+        waiting, self.waiting = self.waiting, []
+        if error is not None:
+            self.tag = None
+            for callback in waiting:
+                callback(None, None, error)
+            return
+        self.text = text
+        for callback in waiting:
+            self.start_paste(callback)
+
+    def paste(self, callback):
+        """
+        Hand a new copy of the clipboard's subtree to the callback, which
+        is called on the GUI thread with the element, its XML text and
+        None, or with None, None and the error when the copy could not
+        be made. Returns False if there is nothing to paste
+
+        Pastes that are made while the copy is still being serialized
+        wait for it
+        """
+        if self.is_empty():
+            return False
+        if self.text is None:
+            self.waiting.append(callback)
+        else:
+            self.start_paste(callback)
+        return True
+
+    def start_paste(self, callback):
+        threading.Thread(
+            target=self.parse, args=(self.text, callback), daemon=True
+        ).start()
+
+    def parse(self, text, callback):
+        """
+        Parse a new copy of the subtree. Runs in a worker thread
+        """
+        try:
+            element = ET.fromstring(text)
+        except ET.XMLSyntaxError as e:
+            wx.CallAfter(callback, None, None, e)
+            return
+        wx.CallAfter(callback, element, text, None)
+
+
+_clipboard = Clipboard()
+
+
+def get_clipboard():
+    return _clipboard
@@ -0,0 +1,186 @@
+import threading
+import wx
+
+from boom_tree import BoomTreePanel
+from event_bus import drop_bus
+from journal import element_path
+from xml_diff import DELETED, INSERTED, XmlDiff
+from xml_io import full_tree
+
+# Items expanded on each side to show where the changes are
+MAX_AUTO_EXPAND = 200
+
+
+class ChangeList(wx.ListCtrl):
+    """
+    A virtual list of the changes of a diff
+    """
+
+    def __init__(self, parent):
+        wx.ListCtrl.__init__(
+            self, parent, style=wx.LC_REPORT | wx.LC_VIRTUAL | wx.LC_SINGLE_SEL
+        )
+        self.InsertColumn(0, "Change", width=220)
+        self.InsertColumn(1, "Path", width=500)
+        self.changes = []
+
+    def set_changes(self, changes):
+        self.changes = changes
+        self.SetItemCount(len(changes))
+        self.Refresh()
+
+    def OnGetItemText(self, item, col):
+        change = self.changes[item]
+        if col == 0:
+            return change.describe()
+        return element_path(change.new if change.old is None else change.old)
+
+
+class DiffFrame(wx.Frame):
+    """
+    Shows the structural differences between two documents side by side
+
+    The documents are parsed and compared in a worker thread. Both trees
+    only create the items on the way to the changes. Selecting an item
+    on one side selects the matching item on the other
+    """
+
+    def __init__(self, parent, old_source, new_source, old_title, new_title):
+        """
+        @param old_source: A file path or a parsed document that is not
+            used by anything else, like a copy of an open document
+        @param new_source: Same as old_source for the other side
+        """
+        wx.Frame.__init__(self, parent, title="Compare", size=(1000, 700))
+        self.old_title = old_title
+        self.new_title = new_title
+        self.diff = None
+        self.panels = []
+        self.syncing = False
+
+        self.panel = wx.Panel(self)
+        self.main_sizer = wx.BoxSizer(wx.VERTICAL)
+        self.status = wx.StaticText(self.panel, label="Comparing...")
+        self.main_sizer.Add(self.status, 0, wx.ALL | wx.EXPAND, 5)
+        self.panel.SetSizer(self.main_sizer)
+        self.Bind(wx.EVT_CLOSE, self.on_close)
+
+        worker = threading.Thread(
+            target=self.compare, args=(old_source, new_source), daemon=True
+        )
+        worker.start()
+
+    def compare(self, old_source, new_source):
+        """
+        Parse and diff the documents. Runs in the worker thread
+        """
+        try:
+            old_tree = full_tree(old_source)
+            new_tree = full_tree(new_source)
+            diff = XmlDiff(old_tree.getroot(), new_tree.getroot())
+        except Exception as e:
+            wx.CallAfter(self.on_compared, None, None, None, e)
+            return
+        wx.CallAfter(self.on_compared, old_tree, new_tree, diff, None)
+
+    def on_compared(self, old_tree, new_tree, diff, error):
+        """
+        Build the trees and the change list once the diff is ready
+        """
+        if not self:
+            return
+        if error is not None:
+            self.status.SetLabel("Unable to compare: {}".format(error))
+            return
+
+        self.diff = diff
+        self.status.SetLabel(
+            "{} changes between {} and {}".format(
+                len(diff), self.old_title, self.new_title
+            )
+        )
+
+        splitter = wx.SplitterWindow(self.panel)
+        old_panel = self.create_side(
+            splitter, old_tree, diff.old_marks, diff.old_ancestors
+        )
+        new_panel = self.create_side(
+            splitter, new_tree, diff.new_marks, diff.new_ancestors
+        )
+        splitter.SplitVertically(old_panel, new_panel)
+        splitter.SetSashGravity(0.5)
+        self.main_sizer.Add(splitter, 3, wx.ALL | wx.EXPAND, 5)
+
+        self.change_list = ChangeList(self.panel)
+        self.change_list.set_changes(diff.changes)
+        self.change_list.Bind(wx.EVT_LIST_ITEM_SELECTED, self.on_change_selected)
+        self.main_sizer.Add(self.change_list, 1, wx.ALL | wx.EXPAND, 5)
+        self.panel.Layout()
+
+    def create_side(self, parent, xml_tree, marks, ancestors):
+        """
+        Returns the read only tree panel of one side of the diff
+        """
+        panel = BoomTreePanel(
+            parent,
+            xml_tree.getroot(),
+            wx.NewIdRef().GetId(),
+            xml_tree=xml_tree,
+            marks=marks,
+            ancestors=ancestors,
+            editable=False,
+        )
+        panel.tree.expand_marks(MAX_AUTO_EXPAND)
+        panel.tree.Bind(wx.EVT_TREE_SEL_CHANGED, self.on_tree_selection)
+        self.panels.append(panel)
+        return panel
+
+    def reveal(self, old_obj, new_obj):
+        """
+        Select the elements in their trees. Either may be None
+        """
+        self.syncing = True
+        try:
+            for panel, xml_obj in zip(self.panels, (old_obj, new_obj)):
+                if xml_obj is not None:
+                    panel.tree.reveal(xml_obj)
+        finally:
+            self.syncing = False
+
+    def on_tree_selection(self, event):
+        """
+        Event handler that selects the partner of the selected element
+        in the other tree
+        """
+        event.Skip()
+        if self.syncing:
+            return
+        tree = event.GetEventObject()
+        xml_obj = tree.get_xml_obj(event.GetItem())
+        if xml_obj is None:
+            return
+
+        old_side = tree is self.panels[0].tree
+        partner = self.diff.partner(xml_obj, old_side)
+        if old_side:
+            self.reveal(None, partner)
+        else:
+            self.reveal(partner, None)
+
+    def on_change_selected(self, event):
+        """
+        Event handler that reveals both sides of the selected change
+        """
+        change = self.change_list.changes[event.GetIndex()]
+        old_obj = change.old
+        new_obj = change.new
+        if change.kind == DELETED:
+            new_obj = self.diff.partner(old_obj.getparent(), True)
+        elif change.kind == INSERTED:
+            old_obj = self.diff.partner(new_obj.getparent(), False)
+        self.reveal(old_obj, new_obj)
+
+    def on_close(self, event):
+        for panel in self.panels:
+            drop_bus(panel.page_id)
+        event.Skip()
@@ -1,5 +1,7 @@
 import wx
 
+from event_bus import get_bus
+
 
 class EditDialog(wx.Dialog):
     """
@@ -18,6 +20,7 @@ class EditDialog(wx.Dialog):
         wx.Dialog.__init__(self, None, title=title)
         self.xml_obj = xml_obj
         self.page_id = page_id
+        self.bus = get_bus(page_id)
 
         flex_sizer = wx.FlexGridSizer(2, 2, gap=wx.Size(5, 5))
         btn_sizer = wx.BoxSizer(wx.HORIZONTAL)
@@ -1,14 +1,26 @@
+import boom_core
 import lxml.etree as ET
 import os
+import perf
 import sys
-import time
 import utils
 import wx
+import xml_io
 
+from autosave import AutoSaveScheduler
 from boom_attribute_ed import AttributeEditorPanel
+from boom_search import SearchPanel
 from boom_tree import BoomTreePanel
 from boom_xml_editor import XmlEditorPanel
+from event_bus import CHANGE, TREE_REFRESH, UI_UPDATE, drop_bus, get_bus
+from journal import DraftStore, find_element, is_attached
 from pubsub import pub
+from replace_dialog import ReplaceDialog
+from search_index import SearchIndex
+from undo import CommandStack
+from validation import Schema, Validator
+from validation_panel import ValidationPanel
+from xml_index import LazyDocument
 
 
 class NewPage(wx.Panel):
@@ -17,28 +29,42 @@ class NewPage(wx.Panel):
     top-level widget for the majority of the application
     """
 
-    def __init__(self, parent, xml_path, size, opened_files):
+    def __init__(self, parent, xml_path, size, opened_files, xml_tree=None):
         wx.Panel.__init__(self, parent)
         self.page_id = id(self)
         self.xml_root = None
+        self.xml_tree = None
         self.size = size
         self.opened_files = opened_files
         self.current_file = xml_path
         self.title = os.path.basename(xml_path)
+        self.autosaver = None
+        self.search_index = None
+        self.validator = None
+        self.tree_panel = None
+        self.selected_xml_obj = None
+        self.command_stack = CommandStack()
+
+        # bumped on every change, compared against the generation that
+        # was last saved to tell if the document is modified
+        self.generation = 0
+        self.saved_generation = 0
 
         self.app_location = os.path.dirname(os.path.abspath(sys.argv[0]))
 
         self.tmp_location = os.path.join(self.app_location, "drafts")
 
+        self.bus = get_bus(self.page_id)
+        self.bus.schedule = wx.CallAfter
+        self.bus.subscribe(CHANGE, self.auto_save)
+        self.bus.subscribe(UI_UPDATE, self.on_selection)
+
         pub.subscribe(self.save, "save_{}".format(self.page_id))
-        pub.subscribe(self.auto_save, "on_change_{}".format(self.page_id))
+        pub.subscribe(self.undo, "undo_{}".format(self.page_id))
+        pub.subscribe(self.redo, "redo_{}".format(self.page_id))
+        pub.subscribe(self.replace, "replace_{}".format(self.page_id))
 
-        self.parse_xml(xml_path)
-
-        current_time = time.strftime("%Y-%m-%d.%H.%M.%S", time.localtime())
-        self.full_tmp_path = os.path.join(
-            self.tmp_location, current_time + "-" + os.path.basename(xml_path)
-        )
+        self.parse_xml(xml_path, xml_tree)
 
         if not os.path.exists(self.tmp_location):
             try:
@@ -46,7 +72,14 @@ class NewPage(wx.Panel):
             except IOError:
                 raise IOError("Unable to create file at {}".format(self.tmp_location))
 
+        self.draft_store = DraftStore(self.tmp_location, xml_path)
+
         if self.xml_root is not None:
+            self.recover_draft()
+            self.autosaver = AutoSaveScheduler(self.xml_tree, self.draft_store)
+            if self.draft_store.needs_snapshot():
+                self.autosaver.schedule()
+            self.search_index = SearchIndex(self.xml_tree)
             self.create_editor()
 
     def create_editor(self):
@@ -56,7 +89,9 @@ class NewPage(wx.Panel):
         page_sizer = wx.BoxSizer(wx.VERTICAL)
 
         splitter = wx.SplitterWindow(self)
-        tree_panel = BoomTreePanel(splitter, self.xml_root, self.page_id)
+        self.tree_panel = BoomTreePanel(
+            splitter, self.xml_root, self.page_id, xml_tree=self.xml_tree
+        )
 
         xml_editor_notebook = wx.Notebook(splitter)
         xml_editor_panel = XmlEditorPanel(xml_editor_notebook, self.page_id)
@@ -65,7 +100,17 @@ class NewPage(wx.Panel):
         attribute_panel = AttributeEditorPanel(xml_editor_notebook, self.page_id)
         xml_editor_notebook.AddPage(attribute_panel, "Attributes")
 
-        splitter.SplitVertically(tree_panel, xml_editor_notebook)
+        search_panel = SearchPanel(
+            xml_editor_notebook, self.page_id, self.xml_root, self.search_index
+        )
+        xml_editor_notebook.AddPage(search_panel, "Search")
+
+        validation_panel = ValidationPanel(
+            xml_editor_notebook, self.page_id, self.attach_schema, self.revalidate
+        )
+        xml_editor_notebook.AddPage(validation_panel, "Validation")
+
+        splitter.SplitVertically(self.tree_panel, xml_editor_notebook)
         splitter.SetMinimumPaneSize(int(self.size[0] / 2))
         page_sizer.Add(splitter, 1, wx.ALL | wx.EXPAND, 5)
 
@@ -74,21 +119,176 @@ class NewPage(wx.Panel):
 
         self.Bind(wx.EVT_CLOSE, self.on_close)
 
-    def auto_save(self, event):
+    @perf.timed("page.auto_save")
+    def auto_save(self, edit=None):
         """
-        Event handler that is called via pubsub to save the
+        Event handler that is called via the event bus to save the
         current version of the XML to disk in a temporary location
+
+        The edit is appended to the draft's journal and the draft is
+        compacted in a worker thread by the AutoSaveScheduler, which
+        reports back via on_change_status
+        """
+        if edit is None:
+            # there is no way to undo across a change we know nothing about
+            self.command_stack.clear()
+        else:
+            self.command_stack.push(edit)
+        self.record_change(edit)
+
+    def record_change(self, edit):
+        """
+        Count the change and hand it to the autosaver and search index
+        """
+        self.generation += 1
+        if self.autosaver:
+            self.autosaver.record(edit)
+        if self.search_index:
+            self.search_index.record(edit)
+        if self.validator:
+            self.validator.record(edit)
+
+    def attach_schema(self, path):
         """
-        self.xml_tree.write(self.full_tmp_path)
-        pub.sendMessage("on_change_status", save_path=self.full_tmp_path)
+        Validate the document against the schema from now on. Returns
+        an error message if the schema cannot be loaded
+        """
+        try:
+            schema = Schema(path)
+        except (IOError, ValueError, ET.LxmlError) as e:
+            return str(e)
+        if self.validator:
+            self.validator.close()
+        self.validator = Validator(self.xml_tree, self.bus, schema)
+        return None
+
+    def revalidate(self):
+        if self.validator:
+            self.validator.revalidate()
+
+    def undo(self):
+        """
+        Undo the last edit. Called via pubsub
+        """
+        edit = self.command_stack.undo()
+        if edit is not None:
+            self.apply_edit(edit.inverse())
+
+    def redo(self):
+        """
+        Redo the last undone edit. Called via pubsub
+        """
+        edit = self.command_stack.redo()
+        if edit is not None:
+            self.apply_edit(edit)
 
-    def parse_xml(self, xml_path):
+    def replace(self):
         """
-        Parses the XML from the file that is passed in
+        Show the replace dialog. Called via pubsub
+        """
+        if self.xml_root is None:
+            return
+        dlg = ReplaceDialog(self.xml_root, self.page_id)
+        dlg.Destroy()
+
+        selected = self.selected_xml_obj
+        if selected is not None:
+            self.bus.send(UI_UPDATE, xml_obj=selected)
+
+    @perf.timed("page.undo_redo")
+    def apply_edit(self, edit):
+        """
+        Apply an edit from the undo history, journal it and update only
+        the parts of the tree and editors it touched
+        """
+        edit.apply(self.xml_tree)
+        self.record_change(edit)
+
+        for parent in self.get_structure_changes(edit):
+            self.bus.send(TREE_REFRESH, xml_obj=parent)
+
+        selected = self.selected_xml_obj
+        if selected is not None and is_attached(selected, self.xml_root):
+            self.bus.send(UI_UPDATE, xml_obj=selected)
+
+    def get_structure_changes(self, edit):
+        """
+        Returns the elements whose children were changed by the edit
+        """
+        if edit.op == "batch":
+            parents = []
+            for child in edit.new:
+                parents.extend(self.get_structure_changes(child))
+            return parents
+        if edit.op in ("add", "paste", "remove"):
+            return [find_element(self.xml_tree, edit.path)]
+        return []
+
+    def is_modified(self):
+        """
+        Returns True if the document has changed since it was opened
+        or last saved
+        """
+        return self.generation != self.saved_generation
+
+    def on_selection(self, xml_obj):
+        """
+        Keep track of the element that is selected in the tree
+        """
+        self.selected_xml_obj = xml_obj
+
+    def get_preview_obj(self):
+        """
+        Returns what the XML preview should show: the selected subtree,
+        or the whole document when the root is selected
+        """
+        if self.selected_xml_obj is None or self.selected_xml_obj is self.xml_root:
+            return self.xml_tree
+        return self.selected_xml_obj
+
+    def recover_draft(self):
+        """
+        Offer to restore the unsaved edits of a session that did not
+        close cleanly
+        """
+        if not self.draft_store.has_recovery():
+            return
+
+        msg = "Unsaved changes to {} were found. Do you want to recover them?"
+        dlg = wx.MessageDialog(
+            parent=None,
+            message=msg.format(self.title),
+            caption="Recover Changes",
+            style=wx.YES_NO | wx.YES_DEFAULT | wx.ICON_QUESTION,
+        )
+        recover = dlg.ShowModal() == wx.ID_YES
+        dlg.Destroy()
+
+        if recover:
+            try:
+                xml_tree = self.draft_store.recover(parse=self.load_tree)
+                if isinstance(self.xml_tree, LazyDocument):
+                    self.xml_tree.close()
+                self.xml_tree = xml_tree
+                self.xml_root = self.xml_tree.getroot()
+                return
+            except Exception as e:
+                print("Unable to recover the draft")
+                print(e)
+
+        self.draft_store.discard()
+
+    @perf.timed("page.parse")
+    def parse_xml(self, xml_path, xml_tree=None):
+        """
+        Parses the XML from the file that is passed in, unless it has
+        already been parsed in the background
         """
         self.current_directory = os.path.dirname(xml_path)
         try:
-            self.xml_tree = ET.parse(xml_path)
+            if xml_tree is None:
+                xml_tree = self.load_tree(xml_path)
+            self.xml_tree = xml_tree
         except IOError:
             print("Bad file")
             return
@@ -99,6 +299,14 @@ class NewPage(wx.Panel):
 
         self.xml_root = self.xml_tree.getroot()
 
+    def load_tree(self, xml_path):
+        """
+        Returns the tree for the given file. Files above the
+        LARGE_FILE_THRESHOLD are only indexed and parsed on demand
+        """
+        return boom_core.load(xml_path)
+
+    @perf.timed("page.save")
     def save(self, location=None):
         """
         Save the XML to disk
@@ -109,12 +317,18 @@ class NewPage(wx.Panel):
             path = location
 
         if path:
-            if ".xml" not in path:
+            if not xml_io.has_save_extension(path):
                 path += ".xml"
 
             # Save the xml
-            self.xml_tree.write(path)
+            boom_core.save(self.xml_tree, path)
             self.changed = False
+            self.saved_generation = self.generation
+
+            source_path = os.path.abspath(self.draft_store.source_path)
+            if self.autosaver and os.path.abspath(path) == source_path:
+                # the journal holds edits that are in the file now
+                self.autosaver.reset()
 
     def on_close(self, event):
         """
@@ -123,8 +337,17 @@ class NewPage(wx.Panel):
         if self.current_file in self.opened_files:
             self.opened_files.remove(self.current_file)
 
-        if os.path.exists(self.full_tmp_path):
-            try:
-                os.remove(self.full_tmp_path)
-            except IOError:
-                print("Unable to delete file: {}".format(self.full_tmp_path))
+        if self.autosaver:
+            self.autosaver.close()
+
+        if self.search_index:
+            self.search_index.close()
+
+        if self.validator:
+            self.validator.close()
+
+        drop_bus(self.page_id)
+        self.draft_store.discard()
+
+        if isinstance(self.xml_tree, LazyDocument):
+            self.xml_tree.close()
@@ -0,0 +1,101 @@
+# The events of a page. Listeners are called with keyword arguments:
+# UI_UPDATE(xml_obj), CHANGE(edit), TREE_UPDATE(xml_obj),
+# TREE_REFRESH(xml_obj), REVEAL(xml_obj), VALIDATION(errors) and
+# VALIDATION_FAILED(error)
+UI_UPDATE = "ui_update"
+CHANGE = "change"
+TREE_UPDATE = "tree_update"
+TREE_REFRESH = "tree_refresh"
+REVEAL = "reveal"
+VALIDATION = "validation"
+VALIDATION_FAILED = "validation_failed"
+
+EVENTS = (
+    UI_UPDATE,
+    CHANGE,
+    TREE_UPDATE,
+    TREE_REFRESH,
+    REVEAL,
+    VALIDATION,
+    VALIDATION_FAILED,
+)
+
+_buses = {}
+
+
+class EventBus:
+    """
+    Dispatches the high frequency events of one page, like keystrokes
+    and selection changes, straight to their listeners
+
+    Unlike pubsub there is no topic name to build or look up and no
+    argument checking on every send: each event has a plain list of
+    bound methods. Application wide messages still go through pubsub
+    """
+
+    def __init__(self, schedule=None):
+        """
+        @param schedule: Callable like wx.CallAfter that runs a function
+            on the next turn of the event loop. Without it posted events
+            are delivered right away
+        """
+        self.schedule = schedule
+        self.listeners = {event: [] for event in EVENTS}
+        self.posted = {}
+
+    def subscribe(self, event, listener):
+        self.listeners[event].append(listener)
+
+    def unsubscribe(self, event, listener):
+        if listener in self.listeners[event]:
+            self.listeners[event].remove(listener)
+
+    def send(self, event, **kwargs):
+        """
+        Call every listener of the event now
+        """
+        for listener in self.listeners[event]:
+            listener(**kwargs)
+
+    def post(self, event, **kwargs):
+        """
+        Deliver the event on the next turn of the event loop. When the
+        same event is posted several times before then, only the last
+        one is delivered
+        """
+        if self.schedule is None:
+            self.send(event, **kwargs)
+            return
+        if not self.posted:
+            self.schedule(self.flush)
+        self.posted[event] = kwargs
+
+    def flush(self):
+        posted = self.posted
+        self.posted = {}
+        for event, kwargs in posted.items():
+            self.send(event, **kwargs)
+
+    def clear(self):
+        for listeners in self.listeners.values():
+            listeners.clear()
+        self.posted = {}
+
+
+def get_bus(page_id):
+    """
+    Returns the event bus of a page, creating it on first use
+    """
+    bus = _buses.get(page_id)
+    if bus is None:
+        bus = _buses[page_id] = EventBus()
+    return bus
+
+
+def drop_bus(page_id):
+    """
+    Forget the event bus of a page that is being closed
+    """
+    bus = _buses.pop(page_id, None)
+    if bus is not None:
+        bus.clear()
@@ -0,0 +1,100 @@
+import json
+import os
+import secrets
+import socket
+import threading
+
+# Where the running instance publishes its port and token. Only the
+# user that started it can read the file
+INSTANCE_FILE = os.path.join(os.path.expanduser("~"), ".boomslang_instance")
+
+# How long a second launch waits for the running instance to answer
+CONNECT_TIMEOUT = 1.0
+
+MAX_MESSAGE_SIZE = 1024 * 1024
+
+
+def send_paths(paths, instance_file=INSTANCE_FILE):
+    """
+    Hand the paths to a running instance. Returns True if one took
+    them, False if this process has to start the editor itself
+    """
+    try:
+        with open(instance_file) as fobj:
+            port, token = fobj.read().split()
+        port = int(port)
+    except (OSError, ValueError):
+        return False
+
+    message = {"token": token, "paths": [os.path.abspath(path) for path in paths]}
+    try:
+        with socket.create_connection(
+            ("127.0.0.1", port), timeout=CONNECT_TIMEOUT
+        ) as sock:
+            sock.sendall(json.dumps(message).encode("utf-8") + b"\n")
+            return sock.makefile("rb").readline().strip() == b"ok"
+    except OSError:
+        # the instance file is left over from a session that crashed
+        return False
+
+
+class InstanceServer(threading.Thread):
+    """
+    Listens on a local socket for the paths that later launches of
+    the application hand over instead of starting a second editor
+
+    The callback is called from the server thread with the list of
+    paths, so it has to pass them on to the GUI thread itself
+    """
+
+    def __init__(self, callback, instance_file=INSTANCE_FILE):
+        threading.Thread.__init__(self, daemon=True)
+        self.callback = callback
+        self.instance_file = instance_file
+        self.token = secrets.token_hex(16)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen(5)
+        self.port = self.sock.getsockname()[1]
+
+        fd = os.open(instance_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as fobj:
+            fobj.write("{} {}\n".format(self.port, self.token))
+
+    def run(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                # the socket was closed
+                return
+            with conn:
+                self.handle(conn)
+
+    def handle(self, conn):
+        """
+        Read one message and pass its paths on if the token is right
+        """
+        try:
+            conn.settimeout(CONNECT_TIMEOUT)
+            line = conn.makefile("rb").readline(MAX_MESSAGE_SIZE)
+            message = json.loads(line.decode("utf-8"))
+            if message.get("token") != self.token:
+                return
+            conn.sendall(b"ok\n")
+        except (OSError, ValueError, AttributeError):
+            return
+        self.callback(message.get("paths", []))
+
+    def close(self):
+        """
+        Stop listening and remove the instance file if it is still ours
+        """
+        self.sock.close()
+        try:
+            with open(self.instance_file) as fobj:
+                ours = fobj.read().split()[1:] == [self.token]
+            if ours:
+                os.remove(self.instance_file)
+        except (OSError, IndexError):
+            pass
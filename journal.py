@@ -0,0 +1,367 @@
+import glob
+import hashlib
+import json
+import lxml.etree as ET
+import os
+import re
+import shutil
+
+# Number of journal entries after which the draft is compacted into
+# a full snapshot of the document
+COMPACT_EVERY = 1000
+
+# Edits that change a single element without moving any elements
+FIELD_OPS = ("text", "tail", "attrib", "rename_attrib")
+
+
+# Paths of edits, the child indexes from the root like "/0/3/1"
+INDEX_PATH_RE = re.compile(r"^/(\d+(/\d+)*)?$")
+
+
+def element_path(element):
+    """
+    Returns the XPath of the element inside of its own document
+    """
+    return element.getroottree().getpath(element)
+
+
+def edit_path(element):
+    """
+    Returns the path an edit of the element is addressed by: the index
+    of each element among the children of its parent, from the root
+    down. Unlike an XPath it needs no namespace prefixes to be resolved
+    """
+    indexes = []
+    parent = element.getparent()
+    while parent is not None:
+        indexes.append(str(parent.index(element)))
+        element = parent
+        parent = element.getparent()
+    return "/" + "/".join(reversed(indexes))
+
+
+def find_element(xml_tree, path):
+    """
+    Returns the element at a path created with edit_path. The
+    placeholders of large documents are parsed on the way. Raises
+    ValueError for anything that is not such a path and IndexError when
+    the path leads past the children of an element
+    """
+    if not INDEX_PATH_RE.match(path):
+        raise ValueError("Not an edit path: {!r}".format(path))
+
+    materialize = getattr(xml_tree, "materialize", None)
+    element = xml_tree.getroot()
+    for index in path.split("/")[1:]:
+        if not index:
+            break
+        if materialize is not None:
+            element = materialize(element)
+        element = element[int(index)]
+    if materialize is not None:
+        element = materialize(element)
+    return element
+
+
+def is_attached(element, root):
+    """
+    Returns True if the element is still part of the tree under root.
+    Removed elements keep their document, so getroottree() cannot tell
+    """
+    top = element
+    for top in element.iterancestors():
+        pass
+    return top is root
+
+
+def serialize(element):
+    """
+    Returns the element as a unicode string without its tail
+    """
+    return ET.tostring(element, encoding="unicode", with_tail=False)
+
+
+class Edit:
+    """
+    A single, reversible change to the XML document
+
+    Every edit is addressed by the edit_path of the element it applies
+    to (the parent element for add, paste and remove operations) so that
+    it can be written to the journal and replayed against a fresh copy
+    of the document
+    """
+
+    __slots__ = ("op", "path", "old", "new", "key", "index", "value")
+
+    def __init__(self, op, path, old=None, new=None, key=None, index=None, value=None):
+        """
+        @param op: text, tail, attrib, rename_attrib, add, paste, remove
+            or batch
+        @param path: The edit_path of the element that is changed
+        @param old: The value before the edit
+        @param new: The value after the edit
+        @param key: The attribute name for attrib edits
+        @param index: The child index for add, paste and remove edits
+        @param value: The attribute value for rename_attrib edits or the
+            tail text for add, paste and remove edits
+        """
+        self.op = op
+        self.path = path
+        self.old = old
+        self.new = new
+        self.key = key
+        self.index = index
+        self.value = value
+
+    def to_dict(self):
+        """
+        Returns the edit as a JSON serializable dictionary
+        """
+        data = {}
+        for name in self.__slots__:
+            value = getattr(self, name)
+            if value is not None:
+                data[name] = value
+        if self.op == "batch":
+            data["new"] = [edit.to_dict() for edit in self.new]
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Create an edit from a dictionary created with to_dict
+        """
+        # batches have no path of their own
+        edit = cls(**dict({"path": None}, **data))
+        if edit.op == "batch":
+            edit.new = [cls.from_dict(item) for item in edit.new]
+        return edit
+
+    def inverse(self):
+        """
+        Returns the edit that undoes this one
+        """
+        if self.op == "batch":
+            return Edit("batch", None, new=[edit.inverse() for edit in self.new[::-1]])
+        if self.op in ("add", "paste"):
+            return Edit(
+                "remove", self.path, old=self.new, index=self.index, value=self.value
+            )
+        if self.op == "remove":
+            return Edit(
+                "add", self.path, new=self.old, index=self.index, value=self.value
+            )
+        return Edit(
+            self.op,
+            self.path,
+            old=self.new,
+            new=self.old,
+            key=self.key,
+            index=self.index,
+            value=self.value,
+        )
+
+    def apply(self, xml_tree, reverse=False):
+        """
+        Apply the edit to the given tree. When reverse is True the
+        edit is undone instead
+        """
+        if reverse:
+            self.inverse().apply(xml_tree)
+            return
+
+        if self.op == "batch":
+            # field edits do not move elements, so their paths stay valid
+            # until the next structural edit
+            elements = {}
+            for edit in self.new:
+                if edit.op in FIELD_OPS:
+                    element = elements.get(edit.path)
+                    if element is None:
+                        element = find_element(xml_tree, edit.path)
+                        elements[edit.path] = element
+                    edit.apply_to(element)
+                else:
+                    elements.clear()
+                    edit.apply(xml_tree)
+            return
+
+        self.apply_to(find_element(xml_tree, self.path))
+
+    def apply_to(self, element):
+        """
+        Apply the edit to the element it is addressed to
+        """
+        if self.op == "text":
+            element.text = self.new
+        elif self.op == "tail":
+            element.tail = self.new
+        elif self.op == "attrib":
+            if self.new is None:
+                element.attrib.pop(self.key, None)
+            else:
+                element.attrib[self.key] = self.new
+        elif self.op == "rename_attrib":
+            element.attrib.pop(self.old, None)
+            element.attrib[self.new] = self.value
+        elif self.op in ("add", "paste"):
+            child = ET.fromstring(self.new)
+            child.tail = self.value
+            element.insert(self.index, child)
+        elif self.op == "remove":
+            element.remove(element[self.index])
+        else:
+            raise ValueError("Unknown edit operation: {}".format(self.op))
+
+
+class DraftStore:
+    """
+    Keeps the draft of a document as a full snapshot plus an append-only
+    journal of the edits made since that snapshot
+
+    The files live in a directory that is named after the source file so
+    that a crashed session can be found again when the file is reopened.
+    Snapshot N is the document before journal N is applied. Snapshot 0
+    is the source file itself and is never copied
+    """
+
+    def __init__(self, tmp_location, source_path):
+        """
+        @param tmp_location: The drafts folder of the application
+        @param source_path: The path of the XML document being edited
+        """
+        self.source_path = source_path
+        digest = hashlib.md5(os.path.abspath(source_path).encode("utf-8"))
+        name = "{}-{}".format(os.path.basename(source_path), digest.hexdigest()[:10])
+        self.draft_dir = os.path.join(tmp_location, name)
+        self.journal_fobj = None
+        self.entries = 0
+        self.unjournaled = False
+
+        existing = self.generations("journal-*.jsonl")
+        existing += self.generations("snapshot-*.xml")
+        self.generation = max(existing) if existing else 0
+
+    def generations(self, pattern):
+        """
+        Returns the generation numbers of the draft files that match
+        the glob pattern
+        """
+        numbers = []
+        for path in glob.glob(os.path.join(self.draft_dir, pattern)):
+            match = re.search(r"-(\d+)\.", os.path.basename(path))
+            if match:
+                numbers.append(int(match.group(1)))
+        return sorted(numbers)
+
+    def snapshot_path(self, generation):
+        if generation == 0:
+            return self.source_path
+        return os.path.join(self.draft_dir, "snapshot-{}.xml".format(generation))
+
+    def journal_path(self, generation=None):
+        if generation is None:
+            generation = self.generation
+        return os.path.join(self.draft_dir, "journal-{}.jsonl".format(generation))
+
+    def has_recovery(self):
+        """
+        Returns True if a previous session left unsaved edits behind
+        """
+        for generation in self.generations("journal-*.jsonl"):
+            if os.path.getsize(self.journal_path(generation)):
+                return True
+        return bool(self.generations("snapshot-*.xml"))
+
+    def recover(self, parse=ET.parse):
+        """
+        Rebuild the document of a crashed session by replaying the
+        journals on top of the newest complete snapshot
+
+        @param parse: The function used to load the snapshot
+        """
+        snapshots = self.generations("snapshot-*.xml")
+        base = snapshots[-1] if snapshots else 0
+        xml_tree = parse(self.snapshot_path(base))
+
+        for generation in self.generations("journal-*.jsonl"):
+            if generation < base:
+                continue
+            with open(self.journal_path(generation), encoding="utf-8") as fobj:
+                for line in fobj:
+                    try:
+                        data = json.loads(line)
+                    except ValueError:
+                        # a partially written last line from the crash
+                        break
+                    Edit.from_dict(data).apply(xml_tree)
+
+        # new edits go to a fresh journal and get compacted soon
+        self.generation += 1
+        self.unjournaled = True
+        return xml_tree
+
+    def record(self, edit):
+        """
+        Append an edit to the current journal
+        """
+        if self.journal_fobj is None:
+            os.makedirs(self.draft_dir, exist_ok=True)
+            self.journal_fobj = open(self.journal_path(), "a", encoding="utf-8")
+
+        self.journal_fobj.write(json.dumps(edit.to_dict()))
+        self.journal_fobj.write("\n")
+        self.journal_fobj.flush()
+        self.entries += 1
+
+    def sync(self):
+        """
+        Make sure the journal has reached the disk
+        """
+        if self.journal_fobj is not None:
+            os.fsync(self.journal_fobj.fileno())
+
+    def needs_snapshot(self):
+        """
+        Returns True if the journal should be compacted into a snapshot
+        """
+        return self.unjournaled or self.entries >= COMPACT_EVERY
+
+    def begin_snapshot(self):
+        """
+        Start a new journal generation and return the path the snapshot
+        of the current document has to be written to
+        """
+        if self.journal_fobj is not None:
+            self.journal_fobj.close()
+            self.journal_fobj = None
+        os.makedirs(self.draft_dir, exist_ok=True)
+
+        self.generation += 1
+        self.entries = 0
+        self.unjournaled = False
+        return self.snapshot_path(self.generation)
+
+    def finish_snapshot(self, generation):
+        """
+        Remove the snapshots and journals that are older than the
+        snapshot that was just written
+        """
+        for number in self.generations("snapshot-*.xml"):
+            if number < generation:
+                os.remove(self.snapshot_path(number))
+        for number in self.generations("journal-*.jsonl"):
+            if number < generation:
+                os.remove(self.journal_path(number))
+
+    def discard(self):
+        """
+        Remove all draft files of the document
+        """
+        if self.journal_fobj is not None:
+            self.journal_fobj.close()
+            self.journal_fobj = None
+        shutil.rmtree(self.draft_dir, ignore_errors=True)
+        self.generation = 0
+        self.entries = 0
+        self.unjournaled = False
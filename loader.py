@@ -0,0 +1,104 @@
+import os
+import perf
+import threading
+import wx
+import xml_io
+
+from xml_index import LazyDocument, is_large_file
+
+
+class LoadCancelled(Exception):
+    """
+    Raised inside the worker thread when the user cancels loading
+    """
+
+
+class XmlLoader(threading.Thread):
+    """
+    Parses an XML file in a worker thread
+
+    lxml releases the GIL while it parses, so the GUI stays responsive.
+    The callback is called on the GUI thread with the loader, the parsed
+    tree and the error, if any. Both are None when the load was cancelled
+    """
+
+    def __init__(self, xml_path, callback):
+        threading.Thread.__init__(self, daemon=True)
+        self.xml_path = xml_path
+        self.callback = callback
+        self.bytes_read = 0
+        self.cancelled = False
+        try:
+            self.total_bytes = os.path.getsize(xml_path)
+        except OSError:
+            self.total_bytes = 0
+
+    def cancel(self):
+        self.cancelled = True
+
+    def check_cancelled(self):
+        if self.cancelled:
+            raise LoadCancelled
+
+    def on_progress(self, bytes_read):
+        self.check_cancelled()
+        self.bytes_read = bytes_read
+
+    @perf.timed("loader.parse")
+    def run(self):
+        xml_tree = None
+        error = None
+        try:
+            if is_large_file(self.xml_path) and not xml_io.is_compressed(self.xml_path):
+                xml_tree = LazyDocument(self.xml_path, progress=self.on_progress)
+            else:
+                # compressed files report the compressed bytes read
+                xml_tree = xml_io.parse(self.xml_path, progress=self.on_progress)
+        except LoadCancelled:
+            pass
+        except Exception as e:
+            # lxml wraps exceptions raised by the reader in its own errors
+            if not self.cancelled:
+                error = e
+
+        if self.cancelled and isinstance(xml_tree, LazyDocument):
+            xml_tree.close()
+        if self.cancelled:
+            xml_tree = None
+        wx.CallAfter(self.callback, self, xml_tree, error)
+
+
+class LoadProgressDialog:
+    """
+    Shows the progress of an XmlLoader in a progress dialog with a
+    Cancel button
+    """
+
+    def __init__(self, parent, loader, interval=100):
+        self.loader = loader
+        self.dialog = wx.ProgressDialog(
+            "Opening",
+            "Loading {}".format(os.path.basename(loader.xml_path)),
+            maximum=100,
+            parent=parent,
+            style=wx.PD_CAN_ABORT | wx.PD_AUTO_HIDE | wx.PD_ELAPSED_TIME,
+        )
+        self.timer = wx.Timer()
+        self.timer.Bind(wx.EVT_TIMER, self.on_timer)
+        self.timer.Start(interval)
+
+    def on_timer(self, event):
+        """
+        Update the gauge from the number of bytes the parser has read
+        """
+        if self.loader.total_bytes:
+            percent = self.loader.bytes_read * 100 // self.loader.total_bytes
+        else:
+            percent = 0
+        keep_going, _ = self.dialog.Update(min(percent, 99))
+        if not keep_going:
+            self.loader.cancel()
+
+    def close(self):
+        self.timer.Stop()
+        self.dialog.Destroy()
@@ -1,17 +1,61 @@
-import os
-import sys
 import time
-import utils
-import wx
-import wx.adv
-import wx.lib.agw.flatnotebook as fnb
 
-from datetime import datetime
+START_TIME = time.perf_counter()
+
+import argparse  # noqa: E402
+import instance  # noqa: E402
+import os  # noqa: E402
+import perf  # noqa: E402
+import sys  # noqa: E402
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Boomslang XML editor")
+    parser.add_argument("files", nargs="*", help="XML files to open")
+    parser.add_argument(
+        "--new-instance",
+        action="store_true",
+        help="Start a new editor instead of opening the files in the running one",
+    )
+    parser.add_argument(
+        "--perf",
+        action="store_true",
+        help="Time the editor operations from startup on, see Help > Performance",
+    )
+    parser.add_argument(
+        "--profile-startup",
+        action="store_true",
+        help="Print import and init timings once the window is up, then quit. "
+        "Run with python -X importtime for a per module breakdown",
+    )
+    args, _ = parser.parse_known_args(argv)
+    return args
 
-from editor_page import NewPage
-from pubsub import pub
-from xml_viewer import XmlViewer
-from wx.lib.wordwrap import wordwrap
+
+if __name__ == "__main__":
+    ARGS = parse_args()
+    # hand the files to the running editor before paying for importing wx
+    if not (ARGS.new_instance or ARGS.profile_startup) and instance.send_paths(
+        ARGS.files
+    ):
+        sys.exit(0)
+
+import utils  # noqa: E402
+import wx  # noqa: E402
+
+from datetime import datetime  # noqa: E402
+from pubsub import pub  # noqa: E402
+
+# The editor, the viewer, the notebook and the about box pull in lxml
+# and most of wx.lib, so they are imported the first time they are used
+
+IMPORT_TIME = time.perf_counter()
+
+# Cold start budget checked by --profile-startup
+STARTUP_TARGET_MS = 500
+
+# Number of files kept in File > Recent
+RECENT_FILES_MAX = 10
 
 
 class Boomslang(wx.Frame):
@@ -24,8 +68,10 @@ class Boomslang(wx.Frame):
         self.changed = False
         self.notebook = None
         self.opened_files = []
+        self.loaders = {}
         self.last_opened_file = None
         self.current_page = None
+        self.perf_frame = None
         self.today = datetime.now()
 
         self.current_directory = os.path.expanduser("~")
@@ -44,12 +90,17 @@ class Boomslang(wx.Frame):
         self.Bind(wx.EVT_CLOSE, self.on_exit)
 
         self.Show()
+        wx.CallAfter(self.load_recent_items)
 
-    def create_new_editor(self, xml_path):
+    def create_new_editor(self, xml_path, xml_tree=None):
         """
         Create the tree and xml editing widgets when the user loads
         an XML file
         """
+        import wx.lib.agw.flatnotebook as fnb
+
+        from editor_page import NewPage
+
         if not self.notebook:
             self.notebook = fnb.FlatNotebook(self.panel)
             self.main_sizer.Add(self.notebook, 1, wx.ALL | wx.EXPAND, 5)
@@ -60,7 +111,7 @@ class Boomslang(wx.Frame):
 
         if xml_path not in self.opened_files:
             self.current_page = NewPage(
-                self.notebook, xml_path, self.size, self.opened_files
+                self.notebook, xml_path, self.size, self.opened_files, xml_tree
             )
             self.notebook.AddPage(
                 self.current_page, os.path.basename(xml_path), select=True
@@ -78,25 +129,73 @@ class Boomslang(wx.Frame):
         """
         menu_bar = wx.MenuBar()
         file_menu = wx.Menu()
+        edit_menu = wx.Menu()
         help_menu = wx.Menu()
 
         # add menu items to the file menu
         open_menu_item = file_menu.Append(wx.NewIdRef(), "Open", "")
         self.Bind(wx.EVT_MENU, self.on_open, open_menu_item)
 
-        sub_menu = self.create_recent_items()
-        file_menu.Append(wx.NewIdRef(), "Recent", sub_menu)
+        # filled in by load_recent_items once the frame is up
+        self.recent_menu = wx.Menu()
+        self.recent_dict = {}
+        file_menu.Append(wx.NewIdRef(), "Recent", self.recent_menu)
 
         save_menu_item = file_menu.Append(wx.NewIdRef(), "Save", "")
         self.Bind(wx.EVT_MENU, self.on_save, save_menu_item)
 
+        view_file_menu_item = file_menu.Append(
+            wx.NewIdRef(), "View File on Disk", "Shows the file as it is saved"
+        )
+        self.Bind(wx.EVT_MENU, self.on_view_file, view_file_menu_item)
+
+        compare_saved_menu_item = file_menu.Append(
+            wx.NewIdRef(), "Compare With Saved", "Shows the unsaved changes"
+        )
+        self.Bind(wx.EVT_MENU, self.on_compare_saved, compare_saved_menu_item)
+
+        compare_file_menu_item = file_menu.Append(
+            wx.NewIdRef(), "Compare With File...", "Compare with another XML file"
+        )
+        self.Bind(wx.EVT_MENU, self.on_compare_file, compare_file_menu_item)
+
         exit_menu_item = file_menu.Append(wx.NewIdRef(), "Quit", "")
         self.Bind(wx.EVT_MENU, self.on_exit, exit_menu_item)
         menu_bar.Append(file_menu, "&File")
 
+        # add menu items to the edit menu
+        undo_menu_item = edit_menu.Append(wx.NewIdRef(), "Undo", "")
+        self.Bind(wx.EVT_MENU, self.on_undo, undo_menu_item)
+
+        redo_menu_item = edit_menu.Append(wx.NewIdRef(), "Redo", "")
+        self.Bind(wx.EVT_MENU, self.on_redo, redo_menu_item)
+
+        copy_node_menu_item = edit_menu.Append(
+            wx.NewIdRef(), "Copy Node", "Copy the selected node and its children"
+        )
+        self.Bind(wx.EVT_MENU, self.on_copy_node, copy_node_menu_item)
+
+        paste_node_menu_item = edit_menu.Append(
+            wx.NewIdRef(),
+            "Paste Node",
+            "Append the copied node to the selected node of the current file",
+        )
+        self.Bind(wx.EVT_MENU, self.on_paste_node, paste_node_menu_item)
+
+        replace_menu_item = edit_menu.Append(
+            wx.NewIdRef(), "Replace...", "Replace text in many elements"
+        )
+        self.Bind(wx.EVT_MENU, self.on_replace, replace_menu_item)
+        menu_bar.Append(edit_menu, "&Edit")
+
         # add menu items to the help menu
         about_menu_item = help_menu.Append(wx.NewIdRef(), "About")
         self.Bind(wx.EVT_MENU, self.on_about_box, about_menu_item)
+
+        perf_menu_item = help_menu.Append(
+            wx.NewIdRef(), "Performance", "Time the editor operations"
+        )
+        self.Bind(wx.EVT_MENU, self.on_perf_stats, perf_menu_item)
         menu_bar.Append(help_menu, "&Help")
 
         self.SetMenuBar(menu_bar)
@@ -151,6 +250,9 @@ class Boomslang(wx.Frame):
                 (wx.ACCEL_CTRL, ord("S"), save_menu_item.GetId()),
                 (wx.ACCEL_CTRL, ord("A"), add_tool.GetId()),
                 (wx.ACCEL_CTRL, ord("X"), remove_node_tool.GetId()),
+                (wx.ACCEL_CTRL, ord("Z"), undo_menu_item.GetId()),
+                (wx.ACCEL_CTRL, ord("Y"), redo_menu_item.GetId()),
+                (wx.ACCEL_CTRL, ord("H"), replace_menu_item.GetId()),
             ]
         )
 
@@ -163,23 +265,31 @@ class Boomslang(wx.Frame):
         msg = f"Welcome to Boomslang XML (c) Michael Driscoll - 2017-{self.today.year}"
         self.status_bar.SetStatusText(msg)
 
-    def create_recent_items(self):
+    def load_recent_items(self):
         """
-        Create the recent items sub_menu and return it
+        Fill the recent items sub_menu. Called after the frame is shown
+        so that reading the file does not delay startup
         """
+        for item in self.recent_menu.GetMenuItems():
+            self.recent_menu.Delete(item)
         self.recent_dict = {}
-        if os.path.exists(self.recent_files_path):
-            submenu = wx.Menu()
-            try:
-                with open(self.recent_files_path) as fobj:
-                    for line in fobj:
-                        menu_id = wx.NewIdRef()
-                        submenu.Append(menu_id, line)
-                        self.recent_dict[menu_id] = line.strip()
-                        self.Bind(wx.EVT_MENU, self.on_open_recent_file, id=menu_id)
-                return submenu
-            except IOError:
-                pass
+
+        for path in self.read_recent_files():
+            menu_id = wx.NewIdRef()
+            label = "{}  ({})".format(os.path.basename(path), os.path.dirname(path))
+            self.recent_menu.Append(menu_id, label.replace("&", "&&"), path)
+            self.recent_dict[menu_id.GetId()] = path
+            self.Bind(wx.EVT_MENU, self.on_open_recent_file, id=menu_id)
+
+    def read_recent_files(self):
+        """
+        Returns the paths of the recent files, most recent first
+        """
+        try:
+            with open(self.recent_files_path) as fobj:
+                return [line.strip() for line in fobj if line.strip()]
+        except IOError:
+            return []
 
     def auto_save_status(self, save_path):
         """
@@ -190,12 +300,68 @@ class Boomslang(wx.Frame):
         self.status_bar.SetStatusText(msg)
 
         self.changed = True
+        self.update_page_titles()
+
+    def update_page_titles(self):
+        """
+        Mark the tabs of modified documents with an asterisk
+        """
+        if not self.notebook:
+            return
+
+        for index in range(self.notebook.GetPageCount()):
+            page = self.notebook.GetPage(index)
+            title = "*" + page.title if page.is_modified() else page.title
+            if self.notebook.GetPageText(index) != title:
+                self.notebook.SetPageText(index, title)
 
     def open_xml_file(self, xml_path):
         """
         Open the specified XML file and load it in the application
+
+        The file is parsed in a worker thread and the editor is only
+        created once the tree is ready
         """
-        self.create_new_editor(xml_path)
+        if xml_path in self.opened_files or xml_path in self.loaders:
+            return
+
+        from loader import LoadProgressDialog, XmlLoader
+
+        loader = XmlLoader(xml_path, self.on_xml_loaded)
+        self.loaders[xml_path] = LoadProgressDialog(self, loader)
+        loader.start()
+
+    def open_paths(self, paths):
+        """
+        Open the files given on the command line or handed over by
+        another launch of the application, and bring the frame forward
+        """
+        for path in paths:
+            path = os.path.abspath(path)
+            if os.path.isfile(path):
+                self.open_xml_file(path)
+                self.update_recent_files(path)
+            else:
+                print("No such file: {}".format(path))
+
+        if self.IsIconized():
+            self.Iconize(False)
+        self.Raise()
+
+    def on_xml_loaded(self, loader, xml_tree, error):
+        """
+        Called on the GUI thread when an XmlLoader has finished
+        """
+        self.loaders.pop(loader.xml_path).close()
+
+        if error:
+            utils.warn_bad_file(loader.xml_path, error)
+        elif xml_tree is None:
+            self.status_bar.SetStatusText(
+                "Cancelled opening {}".format(loader.xml_path)
+            )
+        else:
+            self.create_new_editor(loader.xml_path, xml_tree)
 
     def save(self, location=None):
         """
@@ -210,11 +376,16 @@ class Boomslang(wx.Frame):
         self.changed = False
         msg = f"Last saved at {self.today:%H:%M:%S}"
         self.status_bar.SetStatusText(msg)
+        self.update_page_titles()
 
     def on_about_box(self, event):
         """
         Event handler that builds and shows an about box
         """
+        import wx.adv
+
+        from wx.lib.wordwrap import wordwrap
+
         info = wx.adv.AboutDialogInfo()
         info.Name = "About Boomslang"
         info.Version = "0.1 Beta"
@@ -233,6 +404,28 @@ class Boomslang(wx.Frame):
         # Show the wx.AboutBox
         wx.adv.AboutBox(info)
 
+    def on_perf_stats(self, event):
+        """
+        Event handler that turns on the instrumentation and shows the
+        live statistics
+        """
+        from perf_panel import PerfStatsFrame
+
+        perf.enable()
+        if not self.perf_frame:
+            self.perf_frame = PerfStatsFrame(self, self.get_tree_size)
+        self.perf_frame.Show()
+        self.perf_frame.Raise()
+
+    def get_tree_size(self):
+        """
+        Returns the number of items in the tree of the current page
+        """
+        page = self.notebook.GetCurrentPage() if self.notebook else None
+        if page is None or page.tree_panel is None:
+            return 0
+        return page.tree_panel.tree.GetCount()
+
     def on_add_node(self, event):
         """
         Event handler that is fired when an XML node is added to the
@@ -246,6 +439,42 @@ class Boomslang(wx.Frame):
         """
         pub.sendMessage(f"remove_node_{self.current_page.page_id}")
 
+    def on_undo(self, event):
+        """
+        Event handler that undoes the last edit on the current page
+        """
+        if self.notebook and self.notebook.GetCurrentPage():
+            pub.sendMessage(f"undo_{self.notebook.GetCurrentPage().page_id}")
+
+    def on_redo(self, event):
+        """
+        Event handler that redoes the last undone edit on the current page
+        """
+        if self.notebook and self.notebook.GetCurrentPage():
+            pub.sendMessage(f"redo_{self.notebook.GetCurrentPage().page_id}")
+
+    def on_copy_node(self, event):
+        """
+        Event handler that copies the selected node of the current page
+        """
+        if self.notebook and self.notebook.GetCurrentPage():
+            pub.sendMessage(f"copy_node_{self.notebook.GetCurrentPage().page_id}")
+
+    def on_paste_node(self, event):
+        """
+        Event handler that pastes the copied node, which may come from
+        another page, into the current page
+        """
+        if self.notebook and self.notebook.GetCurrentPage():
+            pub.sendMessage(f"paste_node_{self.notebook.GetCurrentPage().page_id}")
+
+    def on_replace(self, event):
+        """
+        Event handler that opens the replace dialog for the current page
+        """
+        if self.notebook and self.notebook.GetCurrentPage():
+            pub.sendMessage(f"replace_{self.notebook.GetCurrentPage().page_id}")
+
     def on_open(self, event):
         """
         Event handler that is called when you need to open an XML file
@@ -272,56 +501,102 @@ class Boomslang(wx.Frame):
         Event handler called for previewing the current state of the XML
         in memory
         """
-        if self.last_opened_file:
-            previewer = XmlViewer(xml_file=self.last_opened_file)
+        if not self.notebook:
+            return
+
+        from xml_viewer import XmlViewer
+
+        page = self.notebook.GetCurrentPage()
+        if page and page.xml_root is not None:
+            previewer = XmlViewer(xml_obj=page.get_preview_obj())
             previewer.ShowModal()
             previewer.Destroy()
 
+    def on_view_file(self, event):
+        """
+        Event handler that shows the current page's file as it is
+        on disk
+        """
+        if not self.notebook:
+            return
+
+        from xml_viewer import XmlViewer
+
+        page = self.notebook.GetCurrentPage()
+        if page and os.path.exists(page.current_file):
+            viewer = XmlViewer(xml_file=page.current_file)
+            viewer.ShowModal()
+            viewer.Destroy()
+
+    def compare_page(self, other_path):
+        """
+        Open a diff of a file against the current page. The page is
+        copied so that it can keep being edited while the diff runs
+        """
+        import copy
+
+        from diff_view import DiffFrame
+
+        page = self.notebook.GetCurrentPage() if self.notebook else None
+        if page is None or page.xml_root is None:
+            return
+
+        diff_frame = DiffFrame(
+            self,
+            other_path,
+            copy.deepcopy(page.xml_tree),
+            os.path.basename(other_path),
+            page.title,
+        )
+        diff_frame.Show()
+
+    def on_compare_saved(self, event):
+        """
+        Event handler that shows how the current page differs from
+        its file on disk
+        """
+        page = self.notebook.GetCurrentPage() if self.notebook else None
+        if page and os.path.exists(page.current_file):
+            self.compare_page(page.current_file)
+
+    def on_compare_file(self, event):
+        """
+        Event handler that compares the current page with a file the
+        user picks
+        """
+        if not self.notebook or not self.notebook.GetCurrentPage():
+            return
+        xml_path = utils.open_file(self, self.current_directory)
+        if xml_path:
+            self.compare_page(xml_path)
+
     def update_recent_files(self, xml_path):
         """
-        Update the recent files file
+        Move the file to the top of the recent files and refresh the menu
         """
-        lines = []
+        lines = [line for line in self.read_recent_files() if line != xml_path]
+        lines.insert(0, xml_path)
         try:
-            with open(self.recent_files_path) as fobj:
-                lines = fobj.readlines()
+            with open(self.recent_files_path, "w") as fobj:
+                for line in lines[:RECENT_FILES_MAX]:
+                    fobj.write(line)
+                    fobj.write("\n")
         except IOError:
             pass
-
-        lines = [line.strip() for line in lines]
-
-        if xml_path not in lines:
-            try:
-                with open(self.recent_files_path, "a") as fobj:
-                    fobj.write(xml_path)
-                    fobj.write("\n")
-            except IOError:
-                pass
-        elif xml_path != lines[0]:
-            for index, item in enumerate(lines):
-                if xml_path == item:
-                    lines.pop(index)
-                    break
-            lines.insert(0, xml_path)
-
-        if len(lines) > 10:
-            lines = lines[0:9]
-
-            # rewrite the file
-            try:
-                with open(self.recent_files_path, "w") as fobj:
-                    for line in lines:
-                        fobj.write(line)
-                        fobj.write("\n")
-            except IOError:
-                pass
+        # the menu may be the one whose event is being handled
+        wx.CallAfter(self.load_recent_items)
 
     def on_open_recent_file(self, event):
         """
         Event handler that is called when a recent file is selected
         for opening
         """
-        self.open_xml_file(self.recent_dict[event.GetId()])
+        xml_path = self.recent_dict[event.GetId()]
+        if not os.path.isfile(xml_path):
+            self.status_bar.SetStatusText("No such file: {}".format(xml_path))
+            return
+        self.open_xml_file(xml_path)
+        self.update_recent_files(xml_path)
 
     def on_save(self, event):
         """
@@ -331,15 +606,60 @@ class Boomslang(wx.Frame):
 
     def on_exit(self, event):
         """
-        Event handler that closes the application
+        Event handler that closes the application. The pages are closed
+        first so that their workers stop and their drafts are removed
         """
+        if self.notebook:
+            for index in reversed(range(self.notebook.GetPageCount())):
+                self.notebook.GetPage(index).Close()
         self.Destroy()
 
 
+def report_startup(frame, times):
+    """
+    Print how long each startup phase took, then close the frame
+    """
+    times.append(("first idle", time.perf_counter()))
+    print("Startup profile (ms):")
+    previous = START_TIME
+    for label, stamp in times:
+        print("  {:<12} {:8.1f}".format(label, (stamp - previous) * 1000))
+        previous = stamp
+    total = (previous - START_TIME) * 1000
+    print("  {:<12} {:8.1f}".format("total", total))
+    if total > STARTUP_TARGET_MS:
+        print("Startup is over the {} ms target".format(STARTUP_TARGET_MS))
+    frame.Close()
+
+
 # ------------------------------------------------------------------------------
 # Run the program!
 if __name__ == "__main__":
-    xml_path = "books.xml"
+    if ARGS.perf:
+        perf.enable()
+    times = [("imports", IMPORT_TIME)]
     app = wx.App(redirect=False)
+    times.append(("wx.App", time.perf_counter()))
     frame = Boomslang()
+    times.append(("frame", time.perf_counter()))
+
+    server = None
+    if not ARGS.profile_startup:
+        try:
+            server = instance.InstanceServer(
+                lambda paths: wx.CallAfter(frame.open_paths, paths)
+            )
+            server.start()
+        except OSError as e:
+            print("Unable to accept files from other launches")
+            print(e)
+
+    if ARGS.files:
+        wx.CallAfter(frame.open_paths, ARGS.files)
+    if ARGS.profile_startup:
+        # runs after the pending load_recent_items call
+        wx.CallAfter(wx.CallAfter, report_startup, frame, times)
     app.MainLoop()
+
+    if server:
+        server.close()
@@ -0,0 +1,156 @@
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+from collections import deque
+
+# Set the environment variable to 1 to record timings from startup on
+ENABLED = os.environ.get("BOOMSLANG_PERF") == "1"
+
+# Number of trace events kept for export
+MAX_EVENTS = 100000
+
+# Number of durations per operation used for the averages
+MAX_SAMPLES = 1000
+
+_lock = threading.Lock()
+_events = deque(maxlen=MAX_EVENTS)
+_samples = {}
+_origin = time.perf_counter()
+
+
+def enable(enabled=True):
+    global ENABLED
+    ENABLED = enabled
+
+
+def record(name, start, duration):
+    """
+    Record one timed operation. Times are perf_counter seconds
+    """
+    with _lock:
+        _events.append((name, start, duration, threading.get_ident()))
+        samples = _samples.get(name)
+        if samples is None:
+            samples = _samples[name] = deque(maxlen=MAX_SAMPLES)
+        samples.append(duration)
+
+
+class span:
+    """
+    Context manager that times the block it wraps when instrumentation
+    is enabled
+    """
+
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        if ENABLED:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.start is not None:
+            record(self.name, self.start, time.perf_counter() - self.start)
+
+
+def timed(name):
+    """
+    Decorator that times every call of the function when instrumentation
+    is enabled. Disabled, it costs one global lookup per call
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(name, start, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+def stats():
+    """
+    Returns a list of (name, count, last, average, p95) tuples with the
+    durations in seconds, sorted by name
+    """
+    with _lock:
+        samples = {name: list(values) for name, values in _samples.items()}
+
+    rows = []
+    for name in sorted(samples):
+        values = samples[name]
+        ordered = sorted(values)
+        p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+        rows.append((name, len(values), values[-1], sum(values) / len(values), p95))
+    return rows
+
+
+def reset():
+    with _lock:
+        _events.clear()
+        _samples.clear()
+
+
+def rss_mb():
+    """
+    Returns the resident set size of the process in MB, or None if it
+    cannot be read on this platform
+    """
+    try:
+        with open("/proc/self/statm") as fobj:
+            pages = int(fobj.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 1024**2
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    # the peak is the best we can do without /proc. It is in bytes on
+    # macOS and in kilobytes elsewhere
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak / 1024**2
+    return peak / 1024
+
+
+def export_chrome_trace(path):
+    """
+    Write the recorded operations as a Chrome trace, which can be
+    opened in chrome://tracing or Perfetto
+    """
+    with _lock:
+        events = list(_events)
+
+    pid = os.getpid()
+    trace = [
+        {
+            "name": name,
+            "cat": name.split(".")[0],
+            "ph": "X",
+            "ts": (start - _origin) * 1e6,
+            "dur": duration * 1e6,
+            "pid": pid,
+            "tid": tid,
+        }
+        for name, start, duration, tid in events
+    ]
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as fobj:
+        json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, fobj)
+    os.replace(tmp_path, path)
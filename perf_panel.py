@@ -0,0 +1,119 @@
+import perf
+import wx
+
+# How often the stats are refreshed
+REFRESH_MS = 1000
+
+
+def count_widgets(window):
+    """
+    Returns the number of windows in the hierarchy under window
+    """
+    return 1 + sum(count_widgets(child) for child in window.GetChildren())
+
+
+class PerfStatsFrame(wx.Frame):
+    """
+    A small window with live timings of the instrumented operations
+    and the size of the application
+    """
+
+    def __init__(self, parent, get_tree_size):
+        """
+        @param parent: The main frame
+        @param get_tree_size: Callable that returns the number of items
+            in the tree of the current page
+        """
+        wx.Frame.__init__(self, parent, title="Performance", size=(560, 400))
+        self.get_tree_size = get_tree_size
+        panel = wx.Panel(self)
+        main_sizer = wx.BoxSizer(wx.VERTICAL)
+
+        self.summary = wx.StaticText(panel, label="")
+        main_sizer.Add(self.summary, 0, wx.ALL | wx.EXPAND, 5)
+
+        self.list_ctrl = wx.ListCtrl(panel, style=wx.LC_REPORT)
+        for col, (label, width) in enumerate(
+            (
+                ("Operation", 180),
+                ("Count", 60),
+                ("Last ms", 80),
+                ("Avg ms", 80),
+                ("P95 ms", 80),
+            )
+        ):
+            self.list_ctrl.InsertColumn(col, label, width=width)
+        main_sizer.Add(self.list_ctrl, 1, wx.ALL | wx.EXPAND, 5)
+
+        btn_sizer = wx.BoxSizer(wx.HORIZONTAL)
+        export_btn = wx.Button(panel, label="Export Trace...")
+        export_btn.Bind(wx.EVT_BUTTON, self.on_export)
+        btn_sizer.Add(export_btn, 0, wx.ALL, 5)
+        reset_btn = wx.Button(panel, label="Reset")
+        reset_btn.Bind(wx.EVT_BUTTON, self.on_reset)
+        btn_sizer.Add(reset_btn, 0, wx.ALL, 5)
+        main_sizer.Add(btn_sizer, 0, wx.CENTER)
+        panel.SetSizer(main_sizer)
+
+        self.timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.on_timer, self.timer)
+        self.timer.Start(REFRESH_MS)
+        self.Bind(wx.EVT_CLOSE, self.on_close)
+        self.refresh()
+
+    def refresh(self):
+        """
+        Update the summary line and the table of timings
+        """
+        widgets = sum(count_widgets(window) for window in wx.GetTopLevelWindows())
+        rss = perf.rss_mb()
+        summary = "Widgets: {}   Tree items: {}".format(widgets, self.get_tree_size())
+        if rss is not None:
+            summary += "   RSS: {:.1f} MB".format(rss)
+        self.summary.SetLabel(summary)
+
+        rows = perf.stats()
+        self.list_ctrl.Freeze()
+        try:
+            if self.list_ctrl.GetItemCount() != len(rows):
+                self.list_ctrl.DeleteAllItems()
+                for name, *_ in rows:
+                    self.list_ctrl.Append([name, "", "", "", ""])
+            for index, (name, count, last, average, p95) in enumerate(rows):
+                self.list_ctrl.SetItem(index, 0, name)
+                self.list_ctrl.SetItem(index, 1, str(count))
+                self.list_ctrl.SetItem(index, 2, "{:.1f}".format(last * 1000))
+                self.list_ctrl.SetItem(index, 3, "{:.1f}".format(average * 1000))
+                self.list_ctrl.SetItem(index, 4, "{:.1f}".format(p95 * 1000))
+        finally:
+            self.list_ctrl.Thaw()
+
+    def on_timer(self, event):
+        self.refresh()
+
+    def on_export(self, event):
+        """
+        Event handler that saves the recorded operations as a Chrome trace
+        """
+        dlg = wx.FileDialog(
+            self,
+            message="Export trace",
+            defaultFile="boomslang-trace.json",
+            wildcard="Chrome trace (*.json)|*.json",
+            style=wx.FD_SAVE | wx.FD_OVERWRITE_PROMPT,
+        )
+        if dlg.ShowModal() == wx.ID_OK:
+            try:
+                perf.export_chrome_trace(dlg.GetPath())
+            except (IOError, OSError) as e:
+                print("Unable to export the trace")
+                print(e)
+        dlg.Destroy()
+
+    def on_reset(self, event):
+        perf.reset()
+        self.refresh()
+
+    def on_close(self, event):
+        self.timer.Stop()
+        event.Skip()
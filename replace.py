@@ -0,0 +1,163 @@
+import lxml.etree as ET
+import re
+
+from journal import Edit, edit_path
+from xml_index import ENTRY_ATTR, is_placeholder
+
+TEXT = "text"
+TAIL = "tail"
+ATTR_NAMES = "attr_names"
+ATTR_VALUES = "attr_values"
+
+
+def is_valid_attribute_name(name):
+    """
+    Returns True if lxml accepts the name for an attribute
+    """
+    try:
+        ET.Element("check").set(name, "")
+    except ValueError:
+        return False
+    return True
+
+
+class ReplacePlan:
+    """
+    A find and replace operation that is compiled once and then run in
+    a single pass over the elements selected by the scope
+
+    find() computes the edits without touching the document, so the
+    number of matches can be shown before anything is changed. apply()
+    then makes all of them or, if one fails, none of them
+    """
+
+    def __init__(
+        self,
+        find,
+        replace,
+        scope="//*",
+        regex=False,
+        ignore_case=False,
+        targets=(TEXT, ATTR_VALUES),
+    ):
+        """
+        @param find: The literal text or regular expression to look for
+        @param replace: The replacement. For regular expressions it can
+            refer to groups like re.sub
+        @param scope: XPath that selects the elements to look at
+        @param regex: Treat find as a regular expression
+        @param ignore_case: Match without regard to case
+        @param targets: Which fields of the elements to change
+        """
+        flags = re.IGNORECASE if ignore_case else 0
+        self.pattern = re.compile(find if regex else re.escape(find), flags)
+        if not regex:
+            # keep backslashes in a literal replacement as they are
+            replace = replace.replace("\\", "\\\\")
+        self.replace = replace
+        self.scope = ET.XPath(scope)
+        self.targets = frozenset(targets)
+        self.changes = []
+        self.skipped = 0
+
+    def sub(self, value):
+        """
+        Returns the value with the replacement made, or None if the
+        pattern does not match
+        """
+        if not value:
+            return None
+        new_value, count = self.pattern.subn(self.replace, value)
+        if not count or new_value == value:
+            return None
+        return new_value
+
+    def find(self, xml_root):
+        """
+        Compute the changes for the document and return how many there are
+        """
+        self.changes = []
+        self.skipped = 0
+        for element in self.scope(xml_root):
+            if not ET.iselement(element) or not isinstance(element.tag, str):
+                continue
+            if is_placeholder(element):
+                # entries of large files that have not been parsed yet
+                self.skipped += 1
+                continue
+            edits = self.plan_element(element)
+            if edits:
+                self.changes.append((element, edits))
+        return self.count()
+
+    def plan_element(self, element):
+        """
+        Returns the edits for one element
+        """
+        path = edit_path(element)
+        edits = []
+
+        if TEXT in self.targets:
+            text = self.sub(element.text)
+            if text is not None:
+                edits.append(Edit("text", path, old=element.text, new=text))
+
+        if TAIL in self.targets:
+            tail = self.sub(element.tail)
+            if tail is not None:
+                edits.append(Edit("tail", path, old=element.tail, new=tail))
+
+        # the names the attributes will have once the renames are made
+        names = set(element.attrib.keys())
+        for key, value in element.attrib.items():
+            if key == ENTRY_ATTR:
+                continue
+            if ATTR_VALUES in self.targets:
+                new_value = self.sub(value)
+                if new_value is not None:
+                    edits.append(
+                        Edit("attrib", path, old=value, new=new_value, key=key)
+                    )
+                    value = new_value
+            if ATTR_NAMES in self.targets:
+                new_key = self.sub(key)
+                if new_key is None:
+                    continue
+                if new_key in names or not is_valid_attribute_name(new_key):
+                    # renaming would overwrite another attribute, or the
+                    # new name is not allowed in XML
+                    self.skipped += 1
+                    continue
+                names.discard(key)
+                names.add(new_key)
+                edits.append(
+                    Edit("rename_attrib", path, old=key, new=new_key, value=value)
+                )
+        return edits
+
+    def count(self):
+        """
+        Returns the number of changes found by the last find()
+        """
+        return sum(len(edits) for _, edits in self.changes)
+
+    def apply(self):
+        """
+        Make the changes found by the last find() and return them as a
+        single batch edit, or None if there was nothing to change
+        """
+        applied = []
+        try:
+            for element, edits in self.changes:
+                for edit in edits:
+                    edit.apply_to(element)
+                    applied.append((element, edit))
+        except Exception:
+            for element, edit in reversed(applied):
+                edit.inverse().apply_to(element)
+            raise
+
+        self.changes = []
+        if not applied:
+            return None
+        return Edit("batch", None, new=[edit for _, edit in applied])
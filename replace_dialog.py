@@ -0,0 +1,149 @@
+import lxml.etree as ET
+import re
+import wx
+
+from event_bus import CHANGE, get_bus
+from replace import ATTR_NAMES, ATTR_VALUES, TAIL, TEXT, ReplacePlan
+
+
+class ReplaceDialog(wx.Dialog):
+    """
+    Dialog for replacing text in many elements at once
+    """
+
+    def __init__(self, xml_root, page_id):
+        """
+        @param xml_root: The root of the document to search
+        @param page_id: A unique id based on the current page being viewed
+        """
+        wx.Dialog.__init__(self, None, title="Replace")
+        self.xml_root = xml_root
+        self.page_id = page_id
+        self.bus = get_bus(page_id)
+        self.plan = None
+
+        flex_sizer = wx.FlexGridSizer(3, 2, gap=wx.Size(5, 5))
+        main_sizer = wx.BoxSizer(wx.VERTICAL)
+
+        flex_sizer.Add(wx.StaticText(self, label="Find"), 0, wx.ALL, 5)
+        self.find_txt = wx.TextCtrl(self)
+        flex_sizer.Add(self.find_txt, 1, wx.ALL | wx.EXPAND, 5)
+        flex_sizer.Add(wx.StaticText(self, label="Replace with"), 0, wx.ALL, 5)
+        self.replace_txt = wx.TextCtrl(self)
+        flex_sizer.Add(self.replace_txt, 1, wx.ALL | wx.EXPAND, 5)
+        flex_sizer.Add(wx.StaticText(self, label="In (XPath)"), 0, wx.ALL, 5)
+        self.scope_txt = wx.TextCtrl(self, value="//*")
+        flex_sizer.Add(self.scope_txt, 1, wx.ALL | wx.EXPAND, 5)
+        flex_sizer.AddGrowableCol(1, 1)
+        main_sizer.Add(flex_sizer, 0, wx.EXPAND)
+
+        self.targets = {}
+        target_sizer = wx.BoxSizer(wx.HORIZONTAL)
+        for target, label, checked in (
+            (TEXT, "Text", True),
+            (TAIL, "Tail", False),
+            (ATTR_NAMES, "Attribute names", False),
+            (ATTR_VALUES, "Attribute values", True),
+        ):
+            check = wx.CheckBox(self, label=label)
+            check.SetValue(checked)
+            target_sizer.Add(check, 0, wx.ALL, 5)
+            self.targets[target] = check
+        main_sizer.Add(target_sizer)
+
+        option_sizer = wx.BoxSizer(wx.HORIZONTAL)
+        self.regex_chk = wx.CheckBox(self, label="Regular expression")
+        option_sizer.Add(self.regex_chk, 0, wx.ALL, 5)
+        self.case_chk = wx.CheckBox(self, label="Ignore case")
+        option_sizer.Add(self.case_chk, 0, wx.ALL, 5)
+        main_sizer.Add(option_sizer)
+
+        self.status = wx.StaticText(self, label="")
+        main_sizer.Add(self.status, 0, wx.ALL | wx.EXPAND, 5)
+
+        # any change to the inputs makes the counted plan stale
+        for ctrl in (self.find_txt, self.replace_txt, self.scope_txt):
+            ctrl.Bind(wx.EVT_TEXT, self.on_input_change)
+        for ctrl in list(self.targets.values()) + [self.regex_chk, self.case_chk]:
+            ctrl.Bind(wx.EVT_CHECKBOX, self.on_input_change)
+
+        btn_sizer = wx.BoxSizer(wx.HORIZONTAL)
+        count_btn = wx.Button(self, label="Count")
+        count_btn.Bind(wx.EVT_BUTTON, self.on_count)
+        btn_sizer.Add(count_btn, 0, wx.ALL | wx.CENTER, 5)
+
+        replace_btn = wx.Button(self, label="Replace All")
+        replace_btn.Bind(wx.EVT_BUTTON, self.on_replace)
+        btn_sizer.Add(replace_btn, 0, wx.ALL | wx.CENTER, 5)
+
+        close_btn = wx.Button(self, label="Close")
+        close_btn.Bind(wx.EVT_BUTTON, self.on_cancel)
+        btn_sizer.Add(close_btn, 0, wx.ALL | wx.CENTER, 5)
+        main_sizer.Add(btn_sizer, 0, wx.CENTER)
+
+        self.SetSizer(main_sizer)
+        self.Fit()
+
+        self.ShowModal()
+
+    def on_input_change(self, event):
+        self.plan = None
+
+    def build_plan(self):
+        """
+        Compile the inputs into a plan and count its matches. Returns
+        False and shows the problem if the inputs are invalid
+        """
+        targets = [key for key, check in self.targets.items() if check.GetValue()]
+        try:
+            self.plan = ReplacePlan(
+                self.find_txt.GetValue(),
+                self.replace_txt.GetValue(),
+                scope=self.scope_txt.GetValue() or "//*",
+                regex=self.regex_chk.GetValue(),
+                ignore_case=self.case_chk.GetValue(),
+                targets=targets,
+            )
+            count = self.plan.find(self.xml_root)
+        except (re.error, ET.XPathError, IndexError, ValueError) as e:
+            self.plan = None
+            self.status.SetLabel("Error: {}".format(e))
+            return False
+
+        msg = "{} matches".format(count)
+        if self.plan.skipped:
+            msg += ", {} skipped".format(self.plan.skipped)
+        self.status.SetLabel(msg)
+        return True
+
+    def on_count(self, event):
+        """
+        Event handler that shows how many changes would be made
+        """
+        if self.find_txt.GetValue():
+            self.build_plan()
+
+    def on_replace(self, event):
+        """
+        Event handler that makes all the changes as one edit
+        """
+        if not self.find_txt.GetValue():
+            return
+        if self.plan is None and not self.build_plan():
+            return
+
+        count = self.plan.count()
+        try:
+            edit = self.plan.apply()
+        except ValueError as e:
+            # nothing was changed, apply() undoes what it did
+            self.plan = None
+            self.status.SetLabel("Error: {}".format(e))
+            return
+        self.plan = None
+        if edit is not None:
+            self.bus.send(CHANGE, edit=edit)
+        self.status.SetLabel("Replaced {} matches".format(count))
+
+    def on_cancel(self, event):
+        self.Close()
@@ -0,0 +1,243 @@
+import itertools
+import lxml.etree as ET
+import re
+import wx
+
+from journal import find_element, is_attached
+from xml_index import ENTRY_ATTR, LazyDocument, is_placeholder
+
+WORD_RE = re.compile(r"\w+")
+
+# Number of elements that are indexed in one turn of the event loop
+BUILD_CHUNK = 5000
+
+# Edits that add or remove elements
+STRUCTURE_OPS = ("add", "paste", "remove")
+
+# Query prefixes that limit a term to one kind of key
+FIELDS = ("tag", "attr", "text")
+
+
+def tokenize(text):
+    """
+    Returns the lower case words of the text
+    """
+    if not text:
+        return []
+    return [word.lower() for word in WORD_RE.findall(text)]
+
+
+class IndexData:
+    """
+    The maps of a search index. Every map goes from a key to an
+    insertion ordered dict of the elements that contain it
+    """
+
+    def __init__(self):
+        self.maps = {"tag": {}, "attr": {}, "text": {}}
+        self.keys = {}
+
+    def add(self, element):
+        """
+        Index the tag, attribute values and text words of one element
+        """
+        if not isinstance(element.tag, str) or is_placeholder(element):
+            return
+
+        keys = [("tag", key) for key in tokenize(ET.QName(element).localname)]
+        for name, value in element.attrib.items():
+            if name != ENTRY_ATTR:
+                keys.extend(("attr", key) for key in tokenize(value))
+        keys.extend(("text", key) for key in tokenize(element.text))
+
+        for field, key in keys:
+            self.maps[field].setdefault(key, {})[element] = None
+        self.keys[element] = keys
+
+    def add_subtree(self, element):
+        for child in element.iter(ET.Element):
+            self.reindex(child)
+
+    def drop(self, element):
+        """
+        Remove one element from the maps
+        """
+        for field, key in self.keys.pop(element, ()):
+            elements = self.maps[field].get(key)
+            if elements is not None:
+                elements.pop(element, None)
+                if not elements:
+                    del self.maps[field][key]
+
+    def reindex(self, element):
+        self.drop(element)
+        self.add(element)
+
+    def find(self, query):
+        """
+        Returns an insertion ordered dict of the elements that contain
+        every word of the query
+        """
+        results = None
+        for term in query.split():
+            fields = FIELDS
+            prefix, sep, rest = term.partition(":")
+            if sep and prefix.lower() in FIELDS:
+                fields = (prefix.lower(),)
+                term = rest
+
+            for word in tokenize(term):
+                matches = {}
+                for field in fields:
+                    matches.update(self.maps[field].get(word, {}))
+                if results is None:
+                    results = matches
+                else:
+                    results = {el: None for el in results if el in matches}
+        return results or {}
+
+
+class SearchIndex:
+    """
+    A word index of the tags, attribute values and text of a document
+
+    The index is built BUILD_CHUNK elements at a time on the GUI thread,
+    one turn of the event loop after the other, so the document is never
+    read while it is being edited and the editor stays responsive. Edits
+    to the fields of elements that are made during a build are replayed
+    once it is done, edits that add or remove elements start it over.
+    Afterwards the index is kept up to date with the edits the page
+    records. Elements that were removed are left in the maps and
+    filtered out when a query runs into them
+
+    For large files only the elements that have been parsed are indexed.
+    Top level entries are added as they are opened
+    """
+
+    def __init__(self, xml_tree):
+        self.xml_tree = xml_tree
+        self.xml_root = xml_tree.getroot()
+        self.data = IndexData()
+        self.ready = False
+        self.pending = []
+        self.build_id = 0
+        self.building = None
+        self.remaining = None
+
+        if isinstance(xml_tree, LazyDocument):
+            xml_tree.on_materialize = self.on_materialize
+
+        self.start()
+
+    def start(self):
+        """
+        Start building the index from scratch
+        """
+        self.ready = False
+        self.pending = []
+        self.build_id += 1
+        self.building = IndexData()
+        self.remaining = self.xml_root.iter(ET.Element)
+        wx.CallAfter(self.build, self.build_id)
+
+    def build(self, build_id):
+        """
+        Index the next BUILD_CHUNK elements and schedule the rest
+        """
+        if build_id != self.build_id:
+            return
+        count = 0
+        for element in itertools.islice(self.remaining, BUILD_CHUNK):
+            self.building.add(element)
+            count += 1
+        if count == BUILD_CHUNK:
+            wx.CallAfter(self.build, build_id)
+        else:
+            self.on_built()
+
+    def on_built(self):
+        self.data = self.building
+        self.building = None
+        self.remaining = None
+        self.ready = True
+        for edit in self.pending:
+            self.update(edit)
+        self.pending = []
+
+    def record(self, edit):
+        """
+        Update the index for an edit that was just made. None stands
+        for a change that was not described, which needs a rebuild
+        """
+        if edit is None:
+            self.start()
+        elif not self.ready:
+            if self.moves_elements(edit):
+                # the elements that are left to index may have moved
+                self.start()
+            else:
+                self.pending.append(edit)
+        else:
+            self.update(edit)
+
+    def moves_elements(self, edit):
+        if edit.op == "batch":
+            return any(self.moves_elements(child) for child in edit.new)
+        return edit.op in STRUCTURE_OPS
+
+    def update(self, edit):
+        if edit.op == "batch":
+            for child in edit.new:
+                self.update(child)
+            return
+
+        try:
+            elements = [find_element(self.xml_tree, edit.path)]
+        except (IndexError, ValueError):
+            elements = []
+
+        for element in elements:
+            if edit.op in ("add", "paste"):
+                if edit.index < len(element):
+                    self.data.add_subtree(element[edit.index])
+            elif edit.op != "remove":
+                self.data.reindex(element)
+
+    def on_materialize(self, element):
+        if self.ready:
+            self.data.add_subtree(element)
+        else:
+            # the placeholder was swapped for the element, which may
+            # already have been passed
+            self.start()
+
+    def search(self, query):
+        """
+        Returns the elements that contain every word of the query, in
+        the order they were indexed. Words can be limited to tags, attribute values
+        or text with a tag:, attr: or text: prefix. Until the index is
+        built the document is scanned instead
+        """
+        if self.ready:
+            data = self.data
+        else:
+            data = IndexData()
+            data.add_subtree(self.xml_root)
+
+        found = []
+        for element in data.find(query):
+            if is_attached(element, self.xml_root):
+                found.append(element)
+            else:
+                data.drop(element)
+        return found
+
+    def close(self):
+        """
+        Stop a running build and unhook from the document
+        """
+        self.build_id += 1
+        self.building = None
+        self.remaining = None
+        if isinstance(self.xml_tree, LazyDocument):
+            self.xml_tree.on_materialize = None
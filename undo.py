@@ -0,0 +1,117 @@
+import time
+
+from collections import deque
+
+# Rough upper bound for the memory used by the undo history of a page
+UNDO_MEMORY_LIMIT = 32 * 1024 * 1024
+
+# Keystrokes in the same field that are closer together than this are
+# undone as one step
+COALESCE_SECONDS = 1.5
+
+# Approximate fixed cost of an edit object
+EDIT_OVERHEAD = 200
+
+
+def edit_size(edit):
+    """
+    Returns a rough estimate of the memory used by an edit
+    """
+    if edit.op == "batch":
+        return EDIT_OVERHEAD + sum(edit_size(child) for child in edit.new)
+
+    size = EDIT_OVERHEAD
+    for value in (edit.path, edit.old, edit.new, edit.key, edit.value):
+        if value:
+            size += len(value)
+    return size
+
+
+class CommandStack:
+    """
+    The undo and redo history of a page
+
+    The history stores the edits themselves, which already know how to
+    invert themselves, instead of copies of the tree. Runs of keystrokes
+    in the same field are merged into one entry and the oldest entries
+    are dropped once the history grows past the memory limit
+    """
+
+    def __init__(self, limit=UNDO_MEMORY_LIMIT):
+        self.limit = limit
+        self.undo_stack = deque()
+        self.redo_stack = []
+        self.size = 0
+        self.last_push = 0
+
+    def push(self, edit):
+        """
+        Add an edit that was just made to the history
+        """
+        now = time.monotonic()
+        self.redo_stack = []
+
+        if self.undo_stack and now - self.last_push < COALESCE_SECONDS:
+            last = self.undo_stack[-1]
+            if self.merge(last, edit):
+                self.last_push = now
+                return
+
+        self.undo_stack.append(edit)
+        self.size += edit_size(edit)
+        self.last_push = now
+
+        while self.size > self.limit and len(self.undo_stack) > 1:
+            self.size -= edit_size(self.undo_stack.popleft())
+
+    def merge(self, last, edit):
+        """
+        Fold the edit into the previous one if both change the same
+        field. Returns True if the edit was merged
+        """
+        if last.op != edit.op or last.path != edit.path:
+            return False
+
+        if edit.op == "text" or (edit.op == "attrib" and last.key == edit.key):
+            pass
+        elif edit.op == "rename_attrib" and last.new == edit.old:
+            last.value = edit.value
+        else:
+            return False
+
+        self.size -= edit_size(last)
+        last.new = edit.new
+        self.size += edit_size(last)
+        return True
+
+    def undo(self):
+        """
+        Returns the edit to undo, or None if there is nothing to undo
+        """
+        if not self.undo_stack:
+            return None
+        edit = self.undo_stack.pop()
+        self.size -= edit_size(edit)
+        self.redo_stack.append(edit)
+        self.last_push = 0
+        return edit
+
+    def redo(self):
+        """
+        Returns the edit to redo, or None if there is nothing to redo
+        """
+        if not self.redo_stack:
+            return None
+        edit = self.redo_stack.pop()
+        self.undo_stack.append(edit)
+        self.size += edit_size(edit)
+        self.last_push = 0
+        return edit
+
+    def clear(self):
+        """
+        Forget the history, used when a change cannot be undone
+        """
+        self.undo_stack.clear()
+        self.redo_stack = []
+        self.size = 0
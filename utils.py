@@ -2,7 +2,13 @@ import hashlib
 import os
 import wx
 
-wildcard = "XML (*.xml)|*.xml|All files (*.*)|*.*"
+# compressed files are recognized by their content, the patterns only
+# filter the dialog
+wildcard = (
+    "XML (*.xml;*.xml.gz;*.xml.xz;*.xml.bz2)|*.xml;*.xml.gz;*.xml.xz;*.xml.bz2|"
+    "Compressed XML (*.gz;*.xz;*.bz2)|*.gz;*.xz;*.bz2|"
+    "All files (*.*)|*.*"
+)
 
 
 def open_file(self, default_dir=os.path.expanduser("~")):
@@ -50,6 +56,10 @@ def save_file(self):
         return path
 
 
+# Files are hashed in blocks of this size
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
 def get_md5(path):
     """
     Returns the MD5 hash of the given file
@@ -57,22 +67,36 @@ def get_md5(path):
     hash_md5 = hashlib.md5()
     with open(path, "rb") as f:
         while True:
-            data = f.read(4096)
-            hash_md5.update(data)
+            data = f.read(HASH_BLOCK_SIZE)
             if not data:
                 break
+            hash_md5.update(data)
     return hash_md5.hexdigest()
 
 
 def is_save_current(saved_file_path, tmp_file_path):
     """
     Returns a bool that determines if the saved file and the
-    tmp file's MD5 hash are the same
+    tmp file have the same contents
+
+    Files of different sizes are never hashed
     """
-    saved_md5 = get_md5(saved_file_path)
-    tmp_md5 = get_md5(tmp_file_path)
+    if os.path.getsize(saved_file_path) != os.path.getsize(tmp_file_path):
+        return False
+
+    return get_md5(saved_file_path) == get_md5(tmp_file_path)
+
 
-    return saved_md5 == tmp_md5
+def warn_bad_file(path, error):
+    """
+    Warns the user that the file could not be opened
+    """
+    msg = "Unable to open {}\n\n{}".format(path, error)
+    dlg = wx.MessageDialog(
+        parent=None, message=msg, caption="Error", style=wx.OK | wx.ICON_ERROR
+    )
+    dlg.ShowModal()
+    dlg.Destroy()
 
 
 def warn_nothing_to_save():
@@ -0,0 +1,325 @@
+import copy
+import lxml.etree as ET
+import os
+import perf
+import threading
+import wx
+import xml_io
+
+from event_bus import VALIDATION, VALIDATION_FAILED
+from journal import find_element, is_attached
+from xml_index import LazyDocument
+
+# How long the document has to be quiet before it is validated again
+VALIDATE_DELAY_MS = 800
+
+XSD_NS = "http://www.w3.org/2001/XMLSchema"
+RELAXNG_NS = "http://relaxng.org/ns/structure/1.0"
+
+
+class ValidationError:
+    """
+    One problem found by the schema, attached to the element it is about
+    """
+
+    __slots__ = ("element", "message", "line")
+
+    def __init__(self, element, message, line):
+        self.element = element
+        self.message = message
+        self.line = line
+
+
+class Schema:
+    """
+    An XSD, RelaxNG or DTD schema
+
+    DTDs declare the content of an element the same wherever it is, so
+    any element can be checked on its own. In an XSD only the elements
+    that are declared at the top level of the schema can, the others
+    are checked together with the nearest such ancestor. RelaxNG
+    patterns depend on their context and always check the document.
+    Keys and ID references that span regions are only checked when the
+    whole document is
+    """
+
+    def __init__(self, path):
+        """
+        @param path: The path of a .xsd, .rng or .dtd file. Other files
+            are recognized by their root element
+        """
+        self.path = path
+        self.global_tags = None
+        extension = os.path.splitext(path)[1].lower()
+        if extension == ".dtd":
+            self.kind = "DTD"
+            self.validator = ET.DTD(path)
+            return
+
+        schema_doc = xml_io.parse(path)
+        root = schema_doc.getroot()
+        if root.tag == "{%s}schema" % XSD_NS:
+            self.kind = "XSD"
+            self.validator = ET.XMLSchema(schema_doc)
+            namespace = root.get("targetNamespace")
+            self.global_tags = set()
+            for element in root.iterchildren("{%s}element" % XSD_NS):
+                name = element.get("name")
+                if namespace:
+                    name = "{%s}%s" % (namespace, name)
+                self.global_tags.add(name)
+        elif root.tag.startswith("{%s}" % RELAXNG_NS):
+            self.kind = "RelaxNG"
+            self.validator = ET.RelaxNG(schema_doc)
+        else:
+            raise ValueError("{} is not a schema".format(path))
+
+    @property
+    def name(self):
+        return os.path.basename(self.path)
+
+    def region_of(self, element):
+        """
+        Returns the element whose subtree has to be validated after the
+        element changed, or None if the whole document has to be
+        """
+        if self.kind == "DTD":
+            return element
+        if self.kind == "XSD":
+            for candidate in [element] + list(element.iterancestors()):
+                if candidate.tag in self.global_tags:
+                    return candidate
+        return None
+
+    def validate(self, xml_obj):
+        """
+        Returns a list of (path, message, line) for the tree or element.
+        The paths are relative to xml_obj's own document
+        """
+        # each validator keeps the log of its last run, so a schema is
+        # only ever used by one thread at a time
+        if self.validator.validate(xml_obj):
+            return []
+        return [
+            (entry.path, entry.message, entry.line)
+            for entry in self.validator.error_log
+        ]
+
+
+def resolve(copy_root, live_root, path, materialize=None):
+    """
+    Returns the live element that corresponds to the error path found
+    in the copy, or live_root if it cannot be found
+
+    @param materialize: Parses the placeholders of a LazyDocument that
+        are on the way to the element
+    """
+    try:
+        found = copy_root.getroottree().xpath(path) if path else []
+    except ET.XPathError:
+        found = []
+    if not found or not ET.iselement(found[0]):
+        return live_root
+
+    indexes = []
+    node = found[0]
+    while node is not copy_root and node.getparent() is not None:
+        parent = node.getparent()
+        indexes.append(parent.index(node))
+        node = parent
+
+    element = live_root
+    for index in reversed(indexes):
+        if materialize is not None:
+            element = materialize(element)
+        if index >= len(element):
+            return live_root
+        element = element[index]
+    return element
+
+
+class Validator:
+    """
+    Validates the document of a page in a worker thread after edits
+
+    Edits are collected until the document has been quiet for a while.
+    Then the smallest subtrees the schema can check on their own are
+    copied and validated in the worker, or the whole document when the
+    schema needs it. The errors are sent on the page's event bus
+    """
+
+    def __init__(self, xml_tree, bus, schema, delay=VALIDATE_DELAY_MS):
+        """
+        @param xml_tree: The tree of the page
+        @param bus: The EventBus of the page
+        @param schema: The Schema to validate against
+        @param delay: The quiet window in milliseconds
+        """
+        self.xml_tree = xml_tree
+        self.xml_root = xml_tree.getroot()
+        self.bus = bus
+        self.schema = schema
+        self.delay = delay
+        self.timer = None
+        self.worker = None
+        self.errors = []
+        self.regions = set()
+        self.full = True
+        self.generation = 0
+        self.closed = False
+        self.schedule()
+
+    def record(self, edit):
+        """
+        Remember which part of the document an edit touched
+        """
+        self.generation += 1
+        if edit is None:
+            self.full = True
+        elif not self.full:
+            for element in self.changed_elements(edit):
+                region = self.schema.region_of(element)
+                if region is None:
+                    self.full = True
+                    break
+                self.regions.add(region)
+        self.schedule()
+
+    def changed_elements(self, edit):
+        if edit.op == "batch":
+            elements = []
+            for child in edit.new:
+                elements.extend(self.changed_elements(child))
+            return elements
+        if edit.path is None:
+            return [self.xml_root]
+        return [find_element(self.xml_tree, edit.path)]
+
+    def schedule(self):
+        if self.closed:
+            return
+        if self.timer is None:
+            self.timer = wx.CallLater(self.delay, self.start)
+        else:
+            self.timer.Restart(self.delay)
+
+    def start(self):
+        """
+        Copy what has to be validated and hand it to the worker thread
+        """
+        if self.worker is not None:
+            # check again once the running validation is done
+            self.schedule()
+            return
+
+        with perf.span("validation.snapshot"):
+            if self.full:
+                snapshot = copy.deepcopy(self.xml_tree)
+                jobs = [(self.xml_root, snapshot)]
+            else:
+                jobs = [
+                    (region, copy.deepcopy(region))
+                    for region in self.outermost(self.regions)
+                    if is_attached(region, self.xml_root)
+                ]
+        full = self.full
+        self.full = False
+        self.regions = set()
+        if not jobs:
+            return
+
+        self.worker = threading.Thread(
+            target=self.validate, args=(jobs, full, self.generation), daemon=True
+        )
+        self.worker.start()
+
+    def outermost(self, regions):
+        """
+        Drop the regions that are inside of another region
+        """
+        return [
+            region
+            for region in regions
+            if not any(ancestor in regions for ancestor in region.iterancestors())
+        ]
+
+    def validate(self, jobs, full, generation):
+        """
+        Validate the copies. Runs in the worker thread
+        """
+        results = []
+        try:
+            for live, snapshot in jobs:
+                if full:
+                    snapshot = xml_io.full_tree(snapshot)
+                results.append((live, snapshot, self.schema.validate(snapshot)))
+        except Exception as e:
+            wx.CallAfter(self.on_validated, jobs, full, generation, None, e)
+            return
+        wx.CallAfter(self.on_validated, jobs, full, generation, results, None)
+
+    def on_validated(self, jobs, full, generation, results, error):
+        """
+        Merge the new errors into the list of the page and announce them.
+        Called on the GUI thread
+        """
+        self.worker = None
+        if self.closed:
+            return
+        if error is not None:
+            print("Unable to validate against {}: {}".format(self.schema.name, error))
+            self.bus.send(VALIDATION_FAILED, error=error)
+            return
+
+        if generation != self.generation:
+            # the document changed while the copies were checked, so
+            # the element positions the errors point at may be stale
+            if full:
+                self.full = True
+            else:
+                self.regions.update(live for live, _ in jobs)
+            self.schedule()
+            return
+
+        if full:
+            self.errors = []
+        else:
+            checked = [live for live, _ in jobs]
+            self.errors = [
+                error
+                for error in self.errors
+                if is_attached(error.element, self.xml_root)
+                and not self.is_inside(error.element, checked)
+            ]
+
+        materialize = None
+        if isinstance(self.xml_tree, LazyDocument):
+            materialize = self.xml_tree.materialize
+        for live, snapshot, problems in results:
+            copy_root = snapshot.getroot() if full else snapshot
+            for path, message, line in problems:
+                element = resolve(copy_root, live, path, materialize)
+                self.errors.append(ValidationError(element, message, line))
+
+        self.bus.send(VALIDATION, errors=self.errors)
+
+    def is_inside(self, element, regions):
+        if element in regions:
+            return True
+        return any(ancestor in regions for ancestor in element.iterancestors())
+
+    def revalidate(self):
+        """
+        Validate the whole document again
+        """
+        self.full = True
+        self.schedule()
+
+    def close(self):
+        self.closed = True
+        if self.timer is not None:
+            self.timer.Stop()
+            self.timer = None
+        if self.worker is not None:
+            self.worker.join()
+            self.worker = None
@@ -0,0 +1,136 @@
+import wx
+
+from event_bus import REVEAL, VALIDATION, VALIDATION_FAILED, get_bus
+from journal import element_path
+
+wildcard = (
+    "Schemas (*.xsd;*.rng;*.dtd)|*.xsd;*.rng;*.dtd|"
+    "XML Schema (*.xsd)|*.xsd|"
+    "RelaxNG (*.rng)|*.rng|"
+    "DTD (*.dtd)|*.dtd|"
+    "All files (*.*)|*.*"
+)
+
+
+class ErrorList(wx.ListCtrl):
+    """
+    A virtual list of validation errors. The paths of the elements are
+    only computed for the rows that are on screen
+    """
+
+    def __init__(self, parent):
+        wx.ListCtrl.__init__(
+            self, parent, style=wx.LC_REPORT | wx.LC_VIRTUAL | wx.LC_SINGLE_SEL
+        )
+        self.InsertColumn(0, "Line", width=60)
+        self.InsertColumn(1, "Error", width=400)
+        self.InsertColumn(2, "Path", width=300)
+        self.errors = []
+
+    def set_errors(self, errors):
+        self.errors = errors
+        self.SetItemCount(len(errors))
+        self.Refresh()
+
+    def OnGetItemText(self, item, col):
+        error = self.errors[item]
+        if col == 0:
+            return str(error.line) if error.line else ""
+        if col == 1:
+            return error.message
+        return element_path(error.element)
+
+
+class ValidationPanel(wx.Panel):
+    """
+    Attaches a schema to the page and lists what it finds wrong.
+    Selecting an error reveals its element in the tree
+    """
+
+    def __init__(self, parent, page_id, attach_schema, revalidate):
+        """
+        @param attach_schema: Callable that takes the path of a schema
+            and returns an error message, or None if it was attached
+        @param revalidate: Callable that validates the whole document
+        """
+        wx.Panel.__init__(self, parent)
+        self.page_id = page_id
+        self.attach_schema = attach_schema
+        self.revalidate = revalidate
+        self.bus = get_bus(page_id)
+        self.bus.subscribe(VALIDATION, self.show_errors)
+        self.bus.subscribe(VALIDATION_FAILED, self.show_failure)
+
+        main_sizer = wx.BoxSizer(wx.VERTICAL)
+        btn_sizer = wx.BoxSizer(wx.HORIZONTAL)
+
+        attach_btn = wx.Button(self, label="Attach Schema...")
+        attach_btn.Bind(wx.EVT_BUTTON, self.on_attach)
+        btn_sizer.Add(attach_btn, 0, wx.ALL, 5)
+
+        self.validate_btn = wx.Button(self, label="Validate")
+        self.validate_btn.Bind(wx.EVT_BUTTON, self.on_validate)
+        self.validate_btn.Disable()
+        btn_sizer.Add(self.validate_btn, 0, wx.ALL, 5)
+
+        self.status = wx.StaticText(self, label="No schema attached")
+        btn_sizer.Add(self.status, 1, wx.ALL | wx.ALIGN_CENTER_VERTICAL, 5)
+        main_sizer.Add(btn_sizer, 0, wx.EXPAND)
+
+        self.error_list = ErrorList(self)
+        self.error_list.Bind(wx.EVT_LIST_ITEM_SELECTED, self.on_error_selected)
+        main_sizer.Add(self.error_list, 1, wx.ALL | wx.EXPAND, 5)
+
+        self.SetSizer(main_sizer)
+
+    def on_attach(self, event):
+        """
+        Event handler that lets the user pick the schema of the page
+        """
+        dlg = wx.FileDialog(
+            self,
+            message="Choose a schema",
+            wildcard=wildcard,
+            style=wx.FD_OPEN | wx.FD_FILE_MUST_EXIST,
+        )
+        path = dlg.GetPath() if dlg.ShowModal() == wx.ID_OK else None
+        dlg.Destroy()
+        if not path:
+            return
+
+        error = self.attach_schema(path)
+        if error:
+            self.status.SetLabel("Unable to load the schema: {}".format(error))
+            return
+        self.validate_btn.Enable()
+        self.status.SetLabel("Validating...")
+
+    def on_validate(self, event):
+        self.status.SetLabel("Validating...")
+        self.revalidate()
+
+    def show_errors(self, errors):
+        """
+        Show the errors of the latest validation. Called via the event bus
+        """
+        self.error_list.set_errors(list(errors))
+        if errors:
+            self.status.SetLabel("{} errors".format(len(errors)))
+        else:
+            self.status.SetLabel("The document is valid")
+        self.Layout()
+
+    def show_failure(self, error):
+        """
+        Show why the document could not be validated. The errors of the
+        last validation that worked stay listed. Called via the event bus
+        """
+        self.status.SetLabel("Unable to validate: {}".format(error))
+        self.Layout()
+
+    def on_error_selected(self, event):
+        """
+        Event handler that reveals the element of the selected error
+        """
+        error = self.error_list.errors[event.GetIndex()]
+        self.bus.send(REVEAL, xml_obj=error.element)
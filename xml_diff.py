@@ -0,0 +1,390 @@
+import lxml.etree as ET
+
+from bisect import bisect_left
+from collections import deque
+
+INSERTED = "inserted"
+DELETED = "deleted"
+MOVED = "moved"
+CHANGED = "changed"
+
+# Siblings that have one of these attributes are matched by its value
+# instead of by their position
+KEY_ATTRS = ("id", "name", "key")
+
+
+def label(element):
+    """
+    Returns the tag of an element, or the kind of node for comments,
+    processing instructions and entities
+    """
+    if isinstance(element.tag, str):
+        return element.tag
+    if isinstance(element, ET._Comment):
+        return "#comment"
+    if isinstance(element, ET._ProcessingInstruction):
+        return "#pi"
+    return "#entity"
+
+
+def normalize(text):
+    """
+    Whitespace around text is only indentation and not compared
+    """
+    return text.strip() if text else ""
+
+
+def key_of(element):
+    """
+    Returns the key siblings are matched by, or None if the element
+    has none of the KEY_ATTRS
+    """
+    if not isinstance(element.tag, str):
+        return None
+    for attr in KEY_ATTRS:
+        value = element.get(attr)
+        if value is not None:
+            return (element.tag, attr, value)
+    return None
+
+
+def subtree_hashes(root):
+    """
+    Returns a dict of every node under root to a hash of its subtree.
+    Nodes are visited in reverse document order, so the children of a
+    node are always hashed before the node itself
+    """
+    hashes = {}
+    for element in reversed(list(root.iter())):
+        # inlined, this runs for every node of both documents
+        items = element.items()
+        if items:
+            items.sort()
+        text = element.text
+        tail = element.tail
+        hashes[element] = hash(
+            (
+                element.tag,
+                tuple(items),
+                text.strip() if text else "",
+                tail.strip() if tail else "",
+                tuple([hashes[child] for child in element]),
+            )
+        )
+    return hashes
+
+
+def changed_fields(old, new):
+    """
+    Returns the names of what differs between two matched nodes,
+    ignoring their children. Attributes are named with an @
+    """
+    fields = []
+    if label(old) != label(new):
+        fields.append("tag")
+    if normalize(old.text) != normalize(new.text):
+        fields.append("text")
+    if normalize(old.tail) != normalize(new.tail):
+        fields.append("tail")
+    if old.attrib != new.attrib:
+        for name in sorted(set(old.attrib) | set(new.attrib)):
+            if old.get(name) != new.get(name):
+                fields.append("@" + name)
+    return fields
+
+
+def stable_positions(old_positions):
+    """
+    Returns the indexes of the longest increasing run of old positions.
+    Matched siblings outside of it are the ones that moved
+    """
+    tails = []
+    tail_indexes = []
+    previous = [-1] * len(old_positions)
+    for index, position in enumerate(old_positions):
+        slot = bisect_left(tails, position)
+        if slot == len(tails):
+            tails.append(position)
+            tail_indexes.append(index)
+        else:
+            tails[slot] = position
+            tail_indexes[slot] = index
+        previous[index] = tail_indexes[slot - 1] if slot else -1
+
+    stable = set()
+    index = tail_indexes[-1] if tail_indexes else -1
+    while index >= 0:
+        stable.add(index)
+        index = previous[index]
+    return stable
+
+
+class Change:
+    """
+    One difference between the documents. old and new are the nodes on
+    either side, one of them is None for insertions and deletions
+    """
+
+    __slots__ = ("kind", "old", "new", "fields")
+
+    def __init__(self, kind, old, new, fields=()):
+        self.kind = kind
+        self.old = old
+        self.new = new
+        self.fields = fields
+
+    def describe(self):
+        element = self.new if self.old is None else self.old
+        text = "{} {}".format(self.kind, label(element))
+        if self.fields:
+            text += " ({})".format(", ".join(self.fields))
+        return text
+
+
+class XmlDiff:
+    """
+    A structural diff of two XML documents
+
+    Every node gets a hash of its subtree in one pass, so identical
+    subtrees are skipped without being walked. The children of matched
+    nodes are paired by their key attribute, then by identical subtree,
+    then in order by tag. Matched siblings that are not in the longest
+    run that kept its order are reported as moved. Left over subtrees
+    are paired across parents by key or identical content and are
+    reported as moved too, everything else is an insertion or deletion.
+    All of it is close to linear in the size of the documents
+    """
+
+    def __init__(self, old_root, new_root):
+        self.old_root = old_root
+        self.new_root = new_root
+        self.old_hashes = subtree_hashes(old_root)
+        self.new_hashes = subtree_hashes(new_root)
+        self.matches = {}
+        self.reverse_matches = {}
+        self.changes = []
+        self.old_marks = {}
+        self.new_marks = {}
+        self.old_ancestors = set()
+        self.new_ancestors = set()
+        self.unmatched_old = []
+        self.unmatched_new = []
+        self.run()
+
+    def __len__(self):
+        return len(self.changes)
+
+    def run(self):
+        pending = []
+        if self.old_hashes[self.old_root] != self.new_hashes[self.new_root]:
+            pending.append((self.old_root, self.new_root))
+        else:
+            self.matches[self.old_root] = self.new_root
+            self.reverse_matches[self.new_root] = self.old_root
+        while pending:
+            self.walk(pending)
+            pending = self.match_keyed_moves()
+        self.match_identical_moves()
+
+        for element in self.unmatched_old:
+            self.add_change(Change(DELETED, element, None))
+        for element in self.unmatched_new:
+            self.add_change(Change(INSERTED, None, element))
+
+    def walk(self, pending):
+        """
+        Compare matched pairs whose subtrees differ, top down until
+        pending is empty
+        """
+        while pending:
+            old, new = pending.pop()
+            self.matches[old] = new
+            self.reverse_matches[new] = old
+            fields = changed_fields(old, new)
+            if fields:
+                self.add_change(Change(CHANGED, old, new, fields))
+            pending.extend(self.match_children(old, new))
+
+    def match_children(self, old, new):
+        """
+        Pair the children of two matched nodes. Returns the pairs, the
+        unpaired children are kept for the cross parent pass
+        """
+        old_children = list(old)
+        new_children = list(new)
+        paired_old = [False] * len(old_children)
+        pairs = []
+
+        by_key = {}
+        by_hash = {}
+        by_label = {}
+        for index, child in enumerate(old_children):
+            key = key_of(child)
+            if key is not None:
+                by_key.setdefault(key, deque()).append(index)
+            else:
+                # keyed and unkeyed elements never have the same hash
+                by_label.setdefault(label(child), deque()).append(index)
+                by_hash.setdefault(self.old_hashes[child], deque()).append(index)
+
+        def take(queue):
+            while queue:
+                index = queue.popleft()
+                if not paired_old[index]:
+                    paired_old[index] = True
+                    return index
+            return None
+
+        unpaired_new = []
+        for new_index, child in enumerate(new_children):
+            key = key_of(child)
+            if key is not None:
+                index = take(by_key.get(key, ()))
+            else:
+                index = take(by_hash.get(self.new_hashes[child], ()))
+            if index is None:
+                unpaired_new.append(new_index)
+            else:
+                pairs.append((index, new_index))
+
+        # what is left is matched in order by tag
+        for new_index in unpaired_new:
+            child = new_children[new_index]
+            index = None
+            if key_of(child) is None:
+                index = take(by_label.get(label(child), ()))
+            if index is None:
+                self.unmatched_new.append(child)
+            else:
+                pairs.append((index, new_index))
+
+        pairs.sort(key=lambda pair: pair[1])
+        stable = stable_positions([old_index for old_index, _ in pairs])
+        for position, (old_index, new_index) in enumerate(pairs):
+            if position not in stable:
+                self.add_change(
+                    Change(MOVED, old_children[old_index], new_children[new_index])
+                )
+
+        for index, child in enumerate(old_children):
+            if not paired_old[index]:
+                self.unmatched_old.append(child)
+
+        # identical subtrees are matched but not walked
+        different = []
+        for old_index, new_index in pairs:
+            old_child = old_children[old_index]
+            new_child = new_children[new_index]
+            if self.old_hashes[old_child] == self.new_hashes[new_child]:
+                self.matches[old_child] = new_child
+                self.reverse_matches[new_child] = old_child
+            else:
+                different.append((old_child, new_child))
+        return different
+
+    def match_keyed_moves(self):
+        """
+        Pair left over keyed elements that changed parent. Returns the
+        pairs, which still need to be walked
+        """
+        by_key = {}
+        for element in self.unmatched_old:
+            key = key_of(element)
+            if key is not None:
+                by_key.setdefault(key, deque()).append(element)
+
+        pairs = []
+        unmatched_new = []
+        for element in self.unmatched_new:
+            queue = by_key.get(key_of(element))
+            if queue:
+                old = queue.popleft()
+                pairs.append((old, element))
+                self.add_change(Change(MOVED, old, element))
+            else:
+                unmatched_new.append(element)
+
+        moved = {old for old, _ in pairs}
+        self.unmatched_old = [e for e in self.unmatched_old if e not in moved]
+        self.unmatched_new = unmatched_new
+        return pairs
+
+    def match_identical_moves(self):
+        """
+        Pair left over subtrees that changed parent without changing
+        """
+        by_hash = {}
+        for element in self.unmatched_old:
+            by_hash.setdefault(self.old_hashes[element], deque()).append(element)
+
+        moved = set()
+        unmatched_new = []
+        for element in self.unmatched_new:
+            queue = by_hash.get(self.new_hashes[element])
+            if queue:
+                old = queue.popleft()
+                moved.add(old)
+                self.matches[old] = element
+                self.reverse_matches[element] = old
+                self.add_change(Change(MOVED, old, element))
+            else:
+                unmatched_new.append(element)
+
+        self.unmatched_old = [e for e in self.unmatched_old if e not in moved]
+        self.unmatched_new = unmatched_new
+
+    def add_change(self, change):
+        self.changes.append(change)
+        if change.old is not None:
+            self.mark(change.old, change.kind, self.old_marks, self.old_ancestors)
+        if change.new is not None:
+            self.mark(change.new, change.kind, self.new_marks, self.new_ancestors)
+
+    def mark(self, element, kind, marks, ancestors):
+        """
+        Mark a changed node and its ancestors. The walk up stops at the
+        first ancestor that is already marked, so every node is marked
+        at most once
+        """
+        marks.setdefault(element, kind)
+        for ancestor in element.iterancestors():
+            if ancestor in ancestors:
+                break
+            ancestors.add(ancestor)
+
+    def partner(self, element, old_side=True):
+        """
+        Returns the node on the other side that matches the element, or
+        None. Nodes inside of identical subtrees are not stored, they
+        are found through the nearest matched ancestor
+        """
+        matches = self.matches if old_side else self.reverse_matches
+        path = []
+        node = element
+        while node is not None and node not in matches:
+            parent = node.getparent()
+            if parent is None:
+                return None
+            path.append(parent.index(node))
+            node = parent
+        if node is None:
+            return None
+
+        other = matches[node]
+        if path:
+            old, new = (node, other) if old_side else (other, node)
+            if self.old_hashes[old] != self.new_hashes[new]:
+                # the element is in a subtree that was inserted or deleted
+                return None
+        for index in reversed(path):
+            if index >= len(other):
+                return None
+            other = other[index]
+        return other
+
+
+def diff_trees(old_tree, new_tree):
+    """
+    Returns the XmlDiff of two parsed documents
+    """
+    return XmlDiff(old_tree.getroot(), new_tree.getroot())
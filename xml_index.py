@@ -0,0 +1,551 @@
+import copy
+import lxml.etree as ET
+import mmap
+import os
+import re
+
+from array import array
+from itertools import accumulate, chain, repeat
+from operator import add, getitem
+from xml.sax.saxutils import escape
+
+# Files that are at least this big are opened in large file mode
+LARGE_FILE_THRESHOLD = 64 * 1024 * 1024
+
+# Bytes of a placeholder that write_pieces copies before yielding
+COPY_PIECE_SIZE = 1024 * 1024
+
+# Namespace of the attribute that marks a top level element that has
+# not been parsed yet. It is declared on the root of the shell tree
+LAZY_NS = "urn:boomslang:lazy"
+ENTRY_ATTR = "{%s}entry" % LAZY_NS
+LAZY_DECLARATION = b' xmlns:boomslang-lazy="urn:boomslang:lazy"'
+
+# Placeholder markup, formatted with the tag, the namespace declarations
+# of the element and the entry's ordinal
+PLACEHOLDER = b'<%s%s boomslang-lazy:entry="%d"/>'
+
+# Namespace declaration in a start tag
+XMLNS_RE = re.compile(rb"\sxmlns(?::[^\s=]+)?\s*=\s*(?:\"[^\"]*\"|'[^']*')")
+
+# Markup that is not an element, and element tags. Used for the prolog
+# and for the top level elements that the quick scan cannot handle
+TOKEN_RE = re.compile(
+    rb"<!--.*?-->"
+    rb"|<!\[CDATA\[.*?\]\]>"
+    rb"|<\?.*?\?>"
+    rb"|<!DOCTYPE(?:[^\[>]|\[.*?\])*>"
+    rb"|<(/?)([^\s/>]+)((?:[^>\"']|\"[^\"]*\"|'[^']*')*)>",
+    re.S,
+)
+
+# The attributes of a start tag up to the / of an empty element
+TAG_ATTRS = rb"[^>\"'/]*(?:(?:\"[^\"]*\"|'[^']*'|/(?!>))[^>\"'/]*)*"
+
+# Start tag of an element, group 1 is the name and group 2 is set for
+# empty elements
+START_TAG_RE = re.compile(rb"<([^\s/>!?]+)" + TAG_ATTRS + rb"(/?)>")
+
+# The next start tag like START_TAG_RE, or in group 3 the character
+# after the < of other markup
+NODE_RE = re.compile(rb"<(?:([^\s/>!?]+)" + TAG_ATTRS + rb"(/?)>|([/!?]))")
+
+# Bytes of the source scanned between two progress reports
+PROGRESS_SIZE = 1024 * 1024
+
+# Bytes of the source that index_run splits at once
+RUN_SIZE = 4 * 1024 * 1024
+
+# Characters that can follow the name in a start tag
+NAME_END = frozenset(b" \t\r\n/>")
+
+# The shell markup is fed to the parser in batches of this many pieces,
+# and markup between placeholders that is longer than SHELL_GAP_SIZE is
+# fed straight from the source, which keeps a batch within what lxml's
+# feed parser accepts at once
+SHELL_BATCH = 2000
+SHELL_GAP_SIZE = 4096
+
+
+def is_large_file(xml_path):
+    """
+    Returns True if the file should be opened in large file mode
+    """
+    try:
+        return os.path.getsize(xml_path) >= LARGE_FILE_THRESHOLD
+    except OSError:
+        return False
+
+
+def is_placeholder(element):
+    """
+    Returns True if the element stands in for a top level element
+    that has not been parsed yet
+    """
+    return isinstance(element.tag, str) and element.get(ENTRY_ATTR) is not None
+
+
+class LazyDocument:
+    """
+    A stand-in for lxml's ElementTree that is used for very large files
+
+    The file is memory mapped and indexed with a single pass that only
+    records the byte offsets of the top level elements in flat arrays.
+    The end of a top level element is found by searching for its end
+    tag instead of tokenizing its content, so the Python code runs once
+    per top level element rather than once per node. The pass also
+    builds the markup of the shell tree, which is the source with the
+    top level elements that have children replaced by empty placeholder
+    elements, and lxml parses it in one go. The namespace of the
+    placeholders' marker attribute is declared on the shell root, which
+    is cheaper to parse than a declaration on every placeholder.
+    Placeholders are only parsed when they are materialized, which the
+    tree does when they are expanded or selected. Saving copies the
+    bytes of the placeholders straight from the source
+    """
+
+    def __init__(self, xml_path, progress=None):
+        """
+        @param xml_path: The path of the XML file
+        @param progress: Optional callable that is called with the number
+            of bytes indexed so far
+        """
+        self.xml_path = xml_path
+        self.fobj = open(xml_path, "rb")
+        self.mm = mmap.mmap(self.fobj.fileno(), 0, access=mmap.ACCESS_READ)
+        self.starts = array("q")
+        self.ends = array("q")
+        self.root_start = None
+        self.root_open_end = None
+        self.root_close = None
+        self.shell_root = None
+        self.materialized = {}
+        self.on_materialize = None
+        self.end_patterns = {}
+
+        try:
+            self.build_index(progress)
+        except Exception:
+            self.close()
+            raise
+
+        self.shell_tree = self.shell_root.getroottree()
+        self.root_attrib = dict(self.shell_root.attrib)
+
+    def build_index(self, progress):
+        """
+        Scan the file and build the shell tree of top level elements
+        """
+        mm = self.mm
+        if self.find_root():
+            self.shell_root = self.parse_root()
+            return
+
+        # without comments, processing instructions and CDATA sections in
+        # the root, which could hide tags, the end of a top level element
+        # is found by searching for its end tag
+        content_end = mm.rfind(self.root_close_tag)
+        plain = (
+            mm.find(b"<!", self.root_open_end, content_end) < 0
+            and mm.find(b"<?", self.root_open_end, content_end) < 0
+        )
+
+        # the shell markup is the source with the top level elements that
+        # have children replaced by placeholders. It is fed to the parser
+        # in batches while the file is scanned
+        parser = ET.XMLParser()
+        parser.feed(mm[: self.root_start])
+        parser.feed(self.root_open[:-1] + LAZY_DECLARATION + b">")
+        pieces = []
+        copied = position = self.root_open_end
+        next_run = position if plain else len(mm)
+        next_progress = position + PROGRESS_SIZE
+        while True:
+            if progress and position >= next_progress:
+                progress(position)
+                next_progress = position + PROGRESS_SIZE
+
+            tag = NODE_RE.search(mm, position)
+            if tag is None:
+                raise ET.XMLSyntaxError(
+                    "Premature end of data", None, 0, 0, self.xml_path
+                )
+            start = tag.start()
+            marker = tag.group(3)
+            if marker == b"/":
+                self.root_close = start
+                break
+            if marker:
+                # comments, processing instructions and CDATA sections
+                # are left in the shell markup
+                token = TOKEN_RE.match(mm, start)
+                if token is None:
+                    raise ET.XMLSyntaxError(
+                        "Unterminated markup", None, 0, 0, self.xml_path
+                    )
+                position = token.end()
+                continue
+            if start >= next_run:
+                run = self.index_run(tag, content_end)
+                if run is not None:
+                    end, markup = run
+                    self.feed_gap(parser, pieces, copied, start)
+                    parser.feed(markup)
+                    pieces = []
+                    copied = position = end
+                    continue
+                # the elements ahead are scanned one by one for a while
+                next_run = start + RUN_SIZE
+            if tag.group(2):
+                position = tag.end()
+                continue
+
+            if plain:
+                end, has_children = self.find_end(tag)
+            else:
+                end, has_children = self.tokenize_end(tag)
+            if has_children:
+                if start - copied > SHELL_GAP_SIZE or len(pieces) >= SHELL_BATCH:
+                    self.feed_gap(parser, pieces, copied, start)
+                    pieces = []
+                else:
+                    pieces.append(mm[copied:start])
+                declarations = b""
+                if mm.find(b"xmlns", start, tag.end()) >= 0:
+                    declarations = b"".join(XMLNS_RE.findall(tag.group(0)))
+                pieces.append(
+                    PLACEHOLDER % (tag.group(1), declarations, len(self.starts))
+                )
+                self.starts.append(start)
+                self.ends.append(end)
+                copied = end
+            position = end
+
+        self.feed_gap(parser, pieces, copied, self.root_close)
+        parser.feed(self.root_close_tag)
+        self.shell_root = parser.close()
+        if progress:
+            progress(len(mm))
+
+    def index_run(self, tag, limit):
+        """
+        Index the top level elements from the given start tag match on in
+        one go, as long as they have the same name and either all or none
+        of them have children. Returns the offset the run ends at and its
+        shell markup, or None if the elements ahead do not have that shape
+
+        The source is split at the end tags, and each piece must be some
+        text, a start tag of the name and the content. The pieces are
+        checked and measured with C level functions that go over all of
+        them at once, which is several times faster than finding the
+        elements one by one
+        """
+        start = tag.start()
+        name = tag.group(1)
+        open_tag = b"<" + name
+        # a run of empty elements is split after each of them
+        close_tag = b"/>" if tag.group(2) else b"</" + name + b">"
+        end = self.mm.rfind(close_tag, start, min(start + RUN_SIZE, limit))
+        if end < 0:
+            return None
+        end += len(close_tag)
+        source = self.mm[start:end]
+
+        parts = source.split(close_tag)
+        parts.pop()
+        if not all(map((1).__eq__, map(bytes.count, parts, repeat(open_tag)))):
+            return None
+        firsts = list(map(bytes.find, parts, repeat(open_tag)))
+        name_ends = map(getitem, parts, map(add, firsts, repeat(len(open_tag))))
+        if not NAME_END.issuperset(name_ends):
+            return None
+        markup_counts = list(map(bytes.count, parts, repeat(b"<")))
+        if not any(map((1).__lt__, markup_counts)):
+            # elements without children stay in the shell as they are
+            return end, source
+
+        gaps = list(map(getitem, parts, map(slice, firsts)))
+        if (
+            tag.group(2)
+            or not all(map((1).__lt__, markup_counts))
+            or any(map(bytes.strip, gaps))
+            or b"xmlns" in source
+        ):
+            # a mix, or placeholders that would need the text in front of
+            # them or their namespace declarations
+            return None
+
+        # the offsets after each piece's end tag, starting with the start
+        offsets = list(
+            accumulate(
+                chain((start,), map(add, map(len, parts), repeat(len(close_tag))))
+            )
+        )
+        ordinal = len(self.starts)
+        self.starts.extend(map(add, offsets, firsts))
+        self.ends.extend(offsets[1:])
+        placeholders = map(
+            PLACEHOLDER.__mod__,
+            zip(repeat(name), repeat(b""), range(ordinal, len(self.starts))),
+        )
+        return end, b"".join(chain.from_iterable(zip(gaps, placeholders)))
+
+    def feed_gap(self, parser, pieces, start, end):
+        """
+        Feed the pieces of shell markup that are waiting, then the source
+        between two placeholders
+        """
+        parser.feed(b"".join(pieces))
+        self.feed_source(parser, start, end)
+
+    def feed_source(self, parser, start, end):
+        """
+        Feed a range of the source to the parser in COPY_PIECE_SIZE
+        pieces, lxml's feed parser refuses pieces of more than a few MB
+        """
+        for offset in range(start, end, COPY_PIECE_SIZE):
+            parser.feed(self.mm[offset : min(offset + COPY_PIECE_SIZE, end)])
+
+    def find_root(self):
+        """
+        Find the start tag of the root element after the prolog. Returns
+        True if the root is an empty element
+        """
+        for token in TOKEN_RE.finditer(self.mm):
+            name = token.group(2)
+            if name is None:
+                continue
+            if token.group(1):
+                break
+            self.root_start = token.start()
+            self.root_open_end = token.end()
+            self.root_open = token.group(0)
+            self.root_close_tag = b"</" + name + b">"
+            if token.group(3).rstrip().endswith(b"/"):
+                self.root_open = self.root_open[:-2].rstrip() + b">"
+                return True
+            return False
+        raise ET.XMLSyntaxError("No root element found", None, 0, 0, self.xml_path)
+
+    def find_end(self, tag):
+        """
+        Returns the end offset of the top level element that starts with
+        the given start tag match, and whether it has child elements.
+        Elements of the same name inside of it are skipped
+        """
+        name = tag.group(1)
+        pattern = self.end_patterns.get(name)
+        if pattern is None:
+            escaped = re.escape(name)
+            pattern = re.compile(
+                rb"<" + escaped + rb"(?=[\s/>])" + TAG_ATTRS + rb"(/?)>"
+                rb"|</" + escaped + rb"\s*>"
+            )
+            self.end_patterns[name] = pattern
+
+        nested = 0
+        position = tag.end()
+        while True:
+            match = pattern.search(self.mm, position)
+            if match is None:
+                raise ET.XMLSyntaxError(
+                    "Premature end of data", None, 0, 0, self.xml_path
+                )
+            position = match.end()
+            if match.group(1) is None:
+                if not nested:
+                    break
+                nested -= 1
+            elif not match.group(1):
+                nested += 1
+        return position, self.mm.find(b"<", tag.end(), match.start()) >= 0
+
+    def tokenize_end(self, tag):
+        """
+        Like find_end, but tokenizes the content of the element
+        """
+        depth = 1
+        has_children = False
+        for token in TOKEN_RE.finditer(self.mm, tag.end()):
+            if token.group(2) is None:
+                continue
+            if token.group(1):
+                depth -= 1
+                if not depth:
+                    return token.end(), has_children
+            else:
+                has_children = True
+                if not token.group(3).rstrip().endswith(b"/"):
+                    depth += 1
+        raise ET.XMLSyntaxError("Premature end of data", None, 0, 0, self.xml_path)
+
+    def parse_root(self):
+        """
+        Returns the root element without any of its children
+        """
+        return ET.fromstring(
+            self.mm[: self.root_start] + self.root_open + self.root_close_tag
+        )
+
+    def parse_fragment(self, markup):
+        """
+        Parse a top level node inside of a copy of the prolog and the
+        root's start tag so that namespace declarations and entities
+        are honoured
+        """
+        wrapper = ET.fromstring(
+            self.mm[: self.root_start] + self.root_open + markup + self.root_close_tag
+        )
+        return wrapper[0]
+
+    def materialize(self, element):
+        """
+        Replace a placeholder with the fully parsed element and return
+        it. Other elements are returned unchanged, as are placeholders
+        that were already replaced through another reference
+        """
+        if not is_placeholder(element):
+            return element
+
+        ordinal = int(element.get(ENTRY_ATTR))
+        if ordinal in self.materialized:
+            return self.materialized[ordinal]
+
+        real = self.parse_fragment(self.mm[self.starts[ordinal] : self.ends[ordinal]])
+        real.tail = element.tail
+        element.getparent().replace(element, real)
+        self.materialized[ordinal] = real
+        if self.on_materialize:
+            self.on_materialize(real)
+        return real
+
+    def getroot(self):
+        return self.shell_root
+
+    def getpath(self, element):
+        return self.shell_tree.getpath(element)
+
+    def xpath(self, path):
+        """
+        Evaluate an absolute XPath like the ones created by getpath,
+        materializing the top level element the path goes through
+        """
+        steps = path.split("/")
+        top_level = self.shell_tree.xpath("/".join(steps[:3]))
+        results = []
+        for element in top_level:
+            element = self.materialize(element)
+            if len(steps) > 3:
+                results.extend(element.xpath("/".join(steps[3:])))
+            else:
+                results.append(element)
+        if len(steps) < 3:
+            return top_level
+        return results
+
+    def write_to(self, fobj):
+        """
+        Stream the document into an open binary file object
+        """
+        for _ in self.write_pieces(fobj):
+            pass
+
+    def write_pieces(self, fobj):
+        """
+        Write the document like write_to, yielding after every top level
+        node and every COPY_PIECE_SIZE bytes copied from the source, so
+        a caller can spread the writing over several turns of the event
+        loop
+        """
+        fobj.write(self.mm[: self.root_start])
+        if self.root_close is None:
+            fobj.write(ET.tostring(self.shell_root, with_tail=False))
+            fobj.write(self.mm[self.root_open_end :])
+            return
+
+        if dict(self.shell_root.attrib) == self.root_attrib:
+            fobj.write(self.mm[self.root_start : self.root_open_end])
+        else:
+            nsmap = {
+                prefix: uri
+                for prefix, uri in self.shell_root.nsmap.items()
+                if uri != LAZY_NS
+            }
+            shallow = ET.Element(self.shell_root.tag, nsmap=nsmap)
+            shallow.attrib.update(self.shell_root.attrib)
+            fobj.write(ET.tostring(shallow)[:-2] + b">")
+
+        if self.shell_root.text:
+            fobj.write(encode_text(self.shell_root.text))
+        inherited = self.inherited_declarations()
+        for child in self.shell_root:
+            if is_placeholder(child):
+                ordinal = int(child.get(ENTRY_ATTR))
+                end = self.ends[ordinal]
+                for start in range(self.starts[ordinal], end, COPY_PIECE_SIZE):
+                    fobj.write(self.mm[start : min(start + COPY_PIECE_SIZE, end)])
+                    yield
+            else:
+                fobj.write(
+                    strip_declarations(ET.tostring(child, with_tail=False), inherited)
+                )
+            if child.tail:
+                fobj.write(encode_text(child.tail))
+            yield
+        fobj.write(self.mm[self.root_close :])
+
+    def inherited_declarations(self):
+        """
+        Returns the namespace declarations of the root as lxml writes them
+        on the start tag of a serialized child
+        """
+        declarations = []
+        for prefix, uri in self.shell_root.nsmap.items():
+            name = "xmlns" if prefix is None else "xmlns:" + prefix
+            value = escape(uri, {'"': "&quot;"})
+            declarations.append(
+                ' {}="{}"'.format(name, value).encode("ascii", "xmlcharrefreplace")
+            )
+        return declarations
+
+    def __deepcopy__(self, memo):
+        """
+        Copies share the memory mapped source and the index, only the
+        shell tree is copied
+        """
+        clone = copy.copy(self)
+        clone.materialized = {}
+        clone.on_materialize = None
+        clone.shell_tree = copy.deepcopy(self.shell_tree, memo)
+        clone.shell_root = clone.shell_tree.getroot()
+        return clone
+
+    def close(self):
+        """
+        Release the memory map and the file handle
+        """
+        self.mm.close()
+        self.fobj.close()
+
+
+def encode_text(text):
+    """
+    Escape text content for writing between elements
+    """
+    return escape(text).encode("ascii", "xmlcharrefreplace")
+
+
+def strip_declarations(markup, declarations):
+    """
+    Remove the given namespace declarations from the first start tag of
+    a serialized element. lxml repeats the declarations a child inherits
+    from its ancestors when the child is serialized on its own
+    """
+    start_tag = START_TAG_RE.match(markup)
+    if start_tag is None:
+        # comments and processing instructions
+        return markup
+    head = start_tag.group(0)
+    for declaration in declarations:
+        head = head.replace(declaration, b"", 1)
+    return head + markup[start_tag.end() :]
@@ -0,0 +1,336 @@
+import bz2
+import codecs
+import gzip
+import io
+import lxml.etree as ET
+import lzma
+import mmap
+import os
+import re
+import tempfile
+
+from xml_index import LazyDocument
+
+# Size of the buffer between the serializer and the file
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+# Size of the pieces a mapped file is fed to the parser in when the
+# progress is reported
+FEED_SIZE = 1024 * 1024
+
+# Compression level of gzip files, lower is faster
+GZIP_LEVEL = 6
+
+# os.umask can only be read by setting it, which is not thread safe, so
+# it is read once at import
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+# Compression of the files that are saved, by extension
+COMPRESSORS = {
+    ".gz": gzip,
+    ".xz": lzma,
+    ".bz2": bz2,
+}
+
+# Compression of the files that are opened, by their first bytes
+MAGIC_NUMBERS = (
+    (b"\x1f\x8b", gzip),
+    (b"\xfd7zXZ\x00", lzma),
+    (b"BZh", bz2),
+)
+
+XML_EXTENSIONS = (".xml", ".xml.gz", ".xml.xz", ".xml.bz2")
+
+# Number of bytes at the start of a file the XML declaration is looked for in
+DECLARATION_SEARCH_SIZE = 1024
+
+# Unlike processing instructions like <?xml-stylesheet?> the declaration
+# has whitespace after its name
+DECLARATION_RE = re.compile(rb"<\?xml\s[^>]*\?>")
+
+
+def compression_of(path):
+    """
+    Returns the module that compresses a file that is saved to path,
+    or None for plain XML. The extension decides
+    """
+    return COMPRESSORS.get(os.path.splitext(path)[1].lower())
+
+
+def detect_compression(path):
+    """
+    Returns the module that decompresses an existing file, or None for
+    plain XML. The first bytes of the file decide, not its name
+    """
+    with open(path, "rb") as fobj:
+        head = fobj.read(6)
+    for magic, compressor in MAGIC_NUMBERS:
+        if head.startswith(magic):
+            return compressor
+    return None
+
+
+def is_compressed(path):
+    try:
+        return detect_compression(path) is not None
+    except OSError:
+        return False
+
+
+def has_xml_extension(path):
+    return path.lower().endswith(XML_EXTENSIONS)
+
+
+def has_save_extension(path):
+    """
+    Returns True if a file saved to path needs no extension added: it
+    ends in .xml or in the extension of a compression
+    """
+    return has_xml_extension(path) or compression_of(path) is not None
+
+
+class CountingReader:
+    """
+    A file object wrapper that reports the number of bytes read so far.
+    The progress callback can raise to stop the parse
+    """
+
+    def __init__(self, fobj, progress):
+        self.fobj = fobj
+        self.progress = progress
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = self.fobj.read(size)
+        self.bytes_read += len(data)
+        self.progress(self.bytes_read)
+        return data
+
+    def close(self):
+        self.fobj.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class DecompressedFile:
+    """
+    The decompressed content of a file. The decompressors leave the
+    file they read from open, closing this closes both
+    """
+
+    def __init__(self, stream, raw):
+        self.stream = stream
+        self.raw = raw
+
+    def read(self, size=-1):
+        return self.stream.read(size)
+
+    def close(self):
+        self.stream.close()
+        self.raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_read(path, progress=None):
+    """
+    Returns a binary file object with the XML of the file, decompressed
+    on the fly if needed
+
+    @param progress: Optional callable that is called with the number of
+        bytes of the file read so far
+    """
+    compressor = detect_compression(path)
+    fobj = open(path, "rb")
+    if progress is not None:
+        fobj = CountingReader(fobj, progress)
+    if compressor is not None:
+        return DecompressedFile(compressor.open(fobj, "rb"), fobj)
+    return fobj
+
+
+def parse(path, progress=None):
+    """
+    Parse a plain or compressed XML file
+
+    Compressed files are parsed straight from the decompressor. Plain
+    files are memory mapped and parsed from the mapping, which saves
+    copying the file through Python file objects
+
+    @param progress: Optional callable that is called with the number of
+        bytes of the file read so far
+    """
+    if detect_compression(path) is not None:
+        with open_read(path, progress) as fobj:
+            return ET.parse(fobj, base_url=path)
+    return parse_mapped(path, progress)
+
+
+def parse_mapped(path, progress=None):
+    """
+    Parse a plain XML file from a memory mapping. With a progress
+    callback the mapping is fed to the parser in FEED_SIZE pieces
+    """
+    with open(path, "rb") as fobj:
+        if not os.fstat(fobj.fileno()).st_size:
+            # let lxml report the empty document
+            return ET.parse(fobj)
+        with mmap.mmap(fobj.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if progress is None:
+                return ET.fromstring(mm, base_url=path).getroottree()
+
+            parser = ET.XMLParser()
+            for offset in range(0, len(mm), FEED_SIZE):
+                parser.feed(mm[offset : offset + FEED_SIZE])
+                progress(min(offset + FEED_SIZE, len(mm)))
+            xml_tree = parser.close().getroottree()
+            # the feed parser has no base URL, saving reads the source's
+            # declaration through it
+            xml_tree.docinfo.URL = path
+            return xml_tree
+
+
+def full_tree(source):
+    """
+    Returns the fully parsed tree of a file path or of a document. Large
+    documents are written out and parsed in one go, which is much faster
+    than parsing their placeholders one by one
+    """
+    if isinstance(source, str):
+        return parse(source)
+    if isinstance(source, LazyDocument):
+        buffer = io.BytesIO()
+        source.write_to(buffer)
+        return ET.fromstring(buffer.getvalue(), base_url=source.xml_path).getroottree()
+    return source
+
+
+def open_compressed_write(fobj, compressor):
+    if compressor is gzip:
+        return gzip.open(fobj, "wb", compresslevel=GZIP_LEVEL)
+    return compressor.open(fobj, "wb")
+
+
+def source_declaration(xml_tree):
+    """
+    Returns the XML declaration of the file the tree was parsed from,
+    b"" if it has none, or None if the file cannot be read
+    """
+    path = xml_tree.docinfo.URL
+    if not path or not os.path.isfile(path):
+        return None
+    try:
+        with open_read(path) as fobj:
+            head = fobj.read(DECLARATION_SEARCH_SIZE)
+    except (OSError, EOFError, lzma.LZMAError):
+        return None
+    if head.startswith(codecs.BOM_UTF8):
+        head = head[len(codecs.BOM_UTF8) :]
+    match = DECLARATION_RE.match(head)
+    if match:
+        return match.group(0)
+    # the declaration of UTF-16 files cannot be matched as bytes
+    return b"" if head.lstrip()[:1] == b"<" else None
+
+
+def docinfo_declaration(docinfo):
+    """
+    Returns a declaration for the document from what lxml knows about
+    it. lxml reports no standalone flag only when there was no
+    declaration, and cannot tell standalone="no" from a missing flag
+    """
+    if docinfo.standalone is None:
+        return b""
+    declaration = '<?xml version="{}" encoding="{}"'.format(
+        docinfo.xml_version or "1.0", docinfo.encoding or "UTF-8"
+    )
+    if docinfo.standalone:
+        declaration += ' standalone="yes"'
+    return (declaration + "?>").encode("ascii")
+
+
+def write_document(xml_tree, fobj):
+    """
+    Stream the document into an open binary file object
+
+    lxml hands the serialized document to fobj.write in small pieces,
+    so the whole document never exists as one string. The document is
+    written in the encoding of the source and the declaration of the
+    source file is kept as it was, or left out if it had none
+    """
+    if isinstance(xml_tree, LazyDocument):
+        # the unparsed parts are copied straight from the source
+        xml_tree.write_to(fobj)
+        return
+
+    declaration = source_declaration(xml_tree)
+    if declaration is None:
+        declaration = docinfo_declaration(xml_tree.docinfo)
+    if declaration:
+        fobj.write(declaration + b"\n")
+    encoding = xml_tree.docinfo.encoding or "UTF-8"
+    xml_tree.write(fobj, encoding=encoding, xml_declaration=False)
+
+
+def fsync_directory(directory):
+    """
+    Make a rename in the directory durable. Not possible on Windows
+    """
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def save(xml_tree, path):
+    """
+    Write the document to path without ever leaving a partial file there
+
+    The document is written to a temporary file in the same folder,
+    flushed to disk and renamed over the destination, so a crash leaves
+    either the old file or the new one. Paths ending in .gz, .xz or .bz2
+    are compressed on the fly
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(
+        dir=directory, prefix="." + os.path.basename(path) + ".", suffix=".tmp"
+    )
+    try:
+        with io.BufferedWriter(io.FileIO(fd, "wb"), WRITE_BUFFER_SIZE) as fobj:
+            compressor = compression_of(path)
+            if compressor is None:
+                write_document(xml_tree, fobj)
+            else:
+                with open_compressed_write(fobj, compressor) as compressed:
+                    write_document(xml_tree, compressed)
+            fobj.flush()
+            os.fsync(fobj.fileno())
+
+        if os.path.exists(path):
+            # keep the permissions of the file that is replaced
+            os.chmod(tmp_path, os.stat(path).st_mode & 0o7777)
+        else:
+            os.chmod(tmp_path, 0o666 & ~UMASK)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    fsync_directory(directory)
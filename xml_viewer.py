@@ -1,10 +1,238 @@
+import bisect
+import codecs
+import lxml.etree as ET
+import mmap
+import os
+import threading
 import wx
 import wx.stc as stc
+import xml_io
+
+from array import array
+from xml_index import LazyDocument
+
+# Size of the pieces the preview is filled with
+CHUNK_SIZE = 256 * 1024
+
+# Elements with more children than this, or with grandchildren, are
+# serialized one child at a time
+SMALL_ELEMENT_CHILDREN = 100
+
+# Documents above this size are styled lazily and files are shown
+# one window at a time
+LARGE_DOCUMENT_SIZE = 16 * 1024 * 1024
+WINDOW_SIZE = 4 * 1024 * 1024
+
+# Distance between the entries of the sparse line index
+LINE_INDEX_STEP = 1024 * 1024
+
+
+class ChunkWriter:
+    """
+    A file object that collects serialized XML and hands it to the
+    callback as text
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.buffer = []
+        self.size = 0
+
+    def write(self, data):
+        self.buffer.append(data)
+        self.size += len(data)
+
+    def flush(self, final=False):
+        text = self.decoder.decode(b"".join(self.buffer), final)
+        self.buffer = []
+        self.size = 0
+        if text:
+            self.callback(text)
+
+
+def is_small(element):
+    """
+    Returns True if the element is serialized in one piece: it has few
+    children and none of them has children of its own
+    """
+    return len(element) <= SMALL_ELEMENT_CHILDREN and not any(
+        len(child) for child in element
+    )
+
+
+def write_node(xf, node, parent_nsmap):
+    """
+    Write a node through lxml's xmlfile, yielding after each piece.
+    Large elements are written one child at a time
+    """
+    if not isinstance(node.tag, str) or is_small(node):
+        xf.write(node, with_tail=False)
+        yield
+        return
+
+    # only the namespaces that are new at this level are declared
+    nsmap = {
+        prefix: uri
+        for prefix, uri in node.nsmap.items()
+        if parent_nsmap.get(prefix) != uri
+    }
+    with xf.element(node.tag, dict(node.attrib), nsmap=nsmap):
+        if node.text:
+            xf.write(node.text)
+        yield
+        for child in node:
+            yield from write_node(xf, child, node.nsmap)
+            if child.tail:
+                xf.write(child.tail)
+
+
+def write_pieces(xml_obj, fobj):
+    """
+    Write an lxml ElementTree, LazyDocument, element, comment or
+    processing instruction to fobj, yielding after each piece
+    """
+    if isinstance(xml_obj, LazyDocument):
+        yield from xml_obj.write_pieces(fobj)
+        return
+    if not isinstance(xml_obj, ET._ElementTree) and not isinstance(xml_obj.tag, str):
+        # xmlfile insists on a root element
+        fobj.write(ET.tostring(xml_obj, with_tail=False))
+        return
+
+    with ET.xmlfile(fobj, encoding="utf-8", buffered=False) as xf:
+        if isinstance(xml_obj, ET._ElementTree):
+            xf.write_declaration()
+            xml_obj = xml_obj.getroot()
+        yield from write_node(xf, xml_obj, {})
+
+
+class XmlSerializer:
+    """
+    Serializes an XML tree or element on the GUI thread, about
+    CHUNK_SIZE bytes per turn of the event loop, and passes the text to
+    the callback piece by piece. The viewer is modal, so the document
+    cannot change while it is being serialized
+    """
+
+    def __init__(self, xml_obj, callback, done_callback=None):
+        """
+        @param xml_obj: An lxml ElementTree, LazyDocument or node
+        @param callback: Called with each piece of text
+        @param done_callback: Called when finished, with None or with
+            the exception that stopped the serialization
+        """
+        self.writer = ChunkWriter(callback)
+        self.pieces = write_pieces(xml_obj, self.writer)
+        self.done_callback = done_callback
+        self.cancelled = False
+
+    def start(self):
+        wx.CallAfter(self.step)
+
+    def cancel(self):
+        self.cancelled = True
+        self.pieces.close()
+
+    def step(self):
+        """
+        Serialize the next chunk and schedule the one after it
+        """
+        if self.cancelled:
+            return
+        try:
+            for _ in self.pieces:
+                if self.writer.size >= CHUNK_SIZE:
+                    break
+            else:
+                self.writer.flush(final=True)
+                self.finish(None)
+                return
+            self.writer.flush()
+        except Exception as e:
+            self.finish(e)
+            return
+        wx.CallAfter(self.step)
+
+    def finish(self, error):
+        self.cancelled = True
+        if self.done_callback:
+            self.done_callback(error)
+
+
+class LineIndex(threading.Thread):
+    """
+    A sparse index that maps line numbers to byte offsets in a memory
+    mapped file. It stores the line number at every LINE_INDEX_STEP bytes
+    and is built in a worker thread by counting newlines
+    """
+
+    def __init__(self, mm):
+        threading.Thread.__init__(self, daemon=True)
+        self.mm = mm
+        self.offsets = array("q", [0])
+        self.lines = array("q", [0])
+        self.ready = False
+        self.cancelled = False
+
+    def run(self):
+        line = 0
+        size = len(self.mm)
+        for start in range(0, size, LINE_INDEX_STEP):
+            if self.cancelled:
+                return
+            line += self.mm[start : start + LINE_INDEX_STEP].count(b"\n")
+            self.offsets.append(min(start + LINE_INDEX_STEP, size))
+            self.lines.append(line)
+        self.ready = True
+
+    def line_count(self):
+        return self.lines[-1] + 1
+
+    def offset_of_line(self, line):
+        """
+        Returns the byte offset where the zero based line starts
+        """
+        if line <= 0:
+            return 0
+        # the last block that starts before the line does
+        index = bisect.bisect_left(self.lines, line) - 1
+        offset = self.offsets[index]
+        current = self.lines[index]
+        while current < line:
+            found = self.mm.find(b"\n", offset)
+            if found == -1:
+                break
+            offset = found + 1
+            current += 1
+        return offset
+
+    def line_of_offset(self, offset):
+        """
+        Returns the zero based line that contains the byte offset
+        """
+        index = max(bisect.bisect_right(self.offsets, offset) - 1, 0)
+        start = self.offsets[index]
+        return self.lines[index] + self.mm[start:offset].count(b"\n")
 
 
 class XmlSTC(stc.StyledTextCtrl):
-    def __init__(self, parent, xml_file):
+    """
+    The styled text control used to show XML
+
+    Documents above LARGE_DOCUMENT_SIZE are only styled up to the visible
+    range while idle. Files of that size are memory mapped and shown one
+    window of about WINDOW_SIZE bytes at a time
+    """
+
+    def __init__(self, parent, xml_file=None):
         stc.StyledTextCtrl.__init__(self, parent)
+        self.mm = None
+        self.fobj = None
+        self.line_index = None
+        self.window_start = 0
+        self.window_end = 0
+        self.large_mode = False
 
         self.SetLexer(stc.STC_LEX_XML)
         self.StyleSetSpec(stc.STC_STYLE_DEFAULT, "size:12,face:Courier New")
@@ -29,22 +257,237 @@ class XmlSTC(stc.StyledTextCtrl):
         # Attribute
         self.StyleSetSpec(stc.STC_H_ATTRIBUTE, "fore:#FF5733,size:%(size)d" % faces)
 
-        with open(xml_file) as fobj:
-            text = fobj.read()
+        if xml_file and xml_io.is_compressed(xml_file):
+            # compressed files cannot be mapped, they are read in full
+            with xml_io.open_read(xml_file) as fobj:
+                text = fobj.read().decode("utf-8", errors="replace")
+            if len(text) >= LARGE_DOCUMENT_SIZE:
+                self.enable_large_mode()
+            self.SetText(text)
+        elif xml_file and os.path.getsize(xml_file) >= LARGE_DOCUMENT_SIZE:
+            self.open_large_file(xml_file)
+        elif xml_file:
+            with open(xml_file) as fobj:
+                text = fobj.read()
+
+            self.SetText(text)
+
+    def enable_large_mode(self):
+        """
+        Only style the visible part of the document, and only when idle
+        """
+        if self.large_mode:
+            return
+        self.large_mode = True
+        self.SetIdleStyling(stc.STC_IDLESTYLING_TOVISIBLE)
+        self.SetLayoutCache(stc.STC_CACHE_PAGE)
+
+    def append_chunk(self, text):
+        """
+        Append a piece of serialized XML to the end of the document
+        """
+        if self.GetLength() + len(text) >= LARGE_DOCUMENT_SIZE:
+            self.enable_large_mode()
+        self.AppendText(text)
+
+    def open_large_file(self, xml_file):
+        """
+        Memory map the file and show its first window
+        """
+        self.enable_large_mode()
+        self.fobj = open(xml_file, "rb")
+        self.mm = mmap.mmap(self.fobj.fileno(), 0, access=mmap.ACCESS_READ)
+        self.line_index = LineIndex(self.mm)
+        self.line_index.start()
+        self.load_window(0)
+
+    def load_window(self, offset):
+        """
+        Show the window of the file that starts at the line containing
+        the byte offset. Windows always start and end on line breaks
+        """
+        size = len(self.mm)
+        offset = min(max(offset, 0), size)
+        start = self.mm.rfind(b"\n", 0, offset) + 1
+        end = min(start + WINDOW_SIZE, size)
+        if end < size:
+            found = self.mm.find(b"\n", end)
+            end = size if found == -1 else found + 1
+
+        self.window_start = start
+        self.window_end = end
+        self.SetText(self.mm[start:end].decode("utf-8", errors="replace"))
+        self.EmptyUndoBuffer()
 
-        self.SetText(text)
+    def goto_offset(self, offset):
+        """
+        Scroll to the byte offset, loading another window if needed
+        """
+        if not self.window_start <= offset < self.window_end:
+            self.load_window(offset - WINDOW_SIZE // 2)
+        line = self.mm[self.window_start : offset].count(b"\n")
+        self.GotoLine(line)
+        self.ScrollToLine(max(line - 5, 0))
+
+    def goto_line(self, line):
+        """
+        Scroll to the zero based line of the file. Returns False while
+        the line index is still being built
+        """
+        if not self.line_index.ready:
+            return False
+        self.goto_offset(self.line_index.offset_of_line(line))
+        return True
+
+    def first_line(self):
+        """
+        Returns the line number of the first line of the current window
+        """
+        if self.line_index and self.line_index.ready:
+            return self.line_index.line_of_offset(self.window_start)
+        return None
+
+    def close(self):
+        """
+        Release the memory mapped file
+        """
+        if self.mm is not None:
+            self.line_index.cancelled = True
+            self.line_index.join()
+            self.mm.close()
+            self.fobj.close()
+            self.mm = None
 
 
 class XmlViewer(wx.Dialog):
-    def __init__(self, xml_file):
+    """
+    Shows an XML file, or the in-memory state of an XML tree or element
+    which is serialized a piece at a time and shown as it arrives
+    """
+
+    def __init__(self, xml_file=None, xml_obj=None):
         wx.Dialog.__init__(
             self,
             parent=None,
             title="XML Viewer",
             style=wx.DEFAULT_DIALOG_STYLE | wx.RESIZE_BORDER,
         )
+        self.serializer = None
         self.xml_view = XmlSTC(self, xml_file)
 
         sizer = wx.BoxSizer(wx.VERTICAL)
+        if self.xml_view.mm is not None:
+            sizer.Add(self.create_navigation(), 0, wx.EXPAND)
         sizer.Add(self.xml_view, 1, wx.EXPAND)
         self.SetSizer(sizer)
+
+        if xml_obj is not None:
+            self.SetTitle("XML Viewer - Loading...")
+            self.serializer = XmlSerializer(xml_obj, self.on_chunk, self.on_serialized)
+            self.serializer.start()
+
+        self.Bind(wx.EVT_WINDOW_DESTROY, self.on_destroy)
+
+    def create_navigation(self):
+        """
+        Create the controls for moving around a file that is too big to
+        be shown at once
+        """
+        nav_sizer = wx.BoxSizer(wx.HORIZONTAL)
+
+        prev_btn = wx.Button(self, label="< Previous")
+        prev_btn.Bind(wx.EVT_BUTTON, self.on_previous_window)
+        nav_sizer.Add(prev_btn, 0, wx.ALL, 5)
+
+        next_btn = wx.Button(self, label="Next >")
+        next_btn.Bind(wx.EVT_BUTTON, self.on_next_window)
+        nav_sizer.Add(next_btn, 0, wx.ALL, 5)
+
+        self.goto_choice = wx.Choice(self, choices=["Line", "Byte offset"])
+        self.goto_choice.SetSelection(0)
+        nav_sizer.Add(self.goto_choice, 0, wx.ALL | wx.CENTER, 5)
+
+        self.goto_txt = wx.TextCtrl(self, style=wx.TE_PROCESS_ENTER)
+        self.goto_txt.Bind(wx.EVT_TEXT_ENTER, self.on_goto)
+        nav_sizer.Add(self.goto_txt, 0, wx.ALL | wx.CENTER, 5)
+
+        goto_btn = wx.Button(self, label="Go")
+        goto_btn.Bind(wx.EVT_BUTTON, self.on_goto)
+        nav_sizer.Add(goto_btn, 0, wx.ALL, 5)
+
+        self.window_lbl = wx.StaticText(self)
+        nav_sizer.Add(self.window_lbl, 1, wx.ALL | wx.CENTER, 5)
+        self.update_window_label()
+
+        return nav_sizer
+
+    def update_window_label(self):
+        """
+        Show which part of the file is loaded
+        """
+        view = self.xml_view
+        msg = "Bytes {:,} - {:,} of {:,}".format(
+            view.window_start, view.window_end, len(view.mm)
+        )
+        first_line = view.first_line()
+        if first_line is not None:
+            msg += ", starting at line {:,}".format(first_line + 1)
+        self.window_lbl.SetLabel(msg)
+
+    def on_previous_window(self, event):
+        view = self.xml_view
+        view.load_window(view.window_start - WINDOW_SIZE)
+        self.update_window_label()
+
+    def on_next_window(self, event):
+        view = self.xml_view
+        if view.window_end < len(view.mm):
+            view.load_window(view.window_end)
+        self.update_window_label()
+
+    def on_goto(self, event):
+        """
+        Jump to the line or byte offset that was entered
+        """
+        try:
+            target = int(self.goto_txt.GetValue().replace(",", ""))
+        except ValueError:
+            return
+
+        if self.goto_choice.GetSelection() == 0:
+            if not self.xml_view.goto_line(max(target - 1, 0)):
+                self.window_lbl.SetLabel("Still counting lines, try again shortly")
+                return
+        else:
+            self.xml_view.goto_offset(max(target, 0))
+        self.update_window_label()
+
+    def on_chunk(self, text):
+        """
+        Called with every piece of serialized XML
+        """
+        if self:
+            self.xml_view.append_chunk(text)
+
+    def on_serialized(self, error):
+        """
+        Called when the whole preview has been serialized, or with the
+        error that stopped it
+        """
+        if not self:
+            return
+        if error is not None:
+            self.SetTitle("XML Viewer - Unable to show the XML: {}".format(error))
+        else:
+            self.SetTitle("XML Viewer")
+        self.serializer = None
+
+    def on_destroy(self, event):
+        """
+        Stop the serializer thread when the viewer goes away
+        """
+        if event.GetEventObject() is self:
+            if self.serializer:
+                self.serializer.cancel()
+            self.xml_view.close()
+        event.Skip()